@@ -14,16 +14,40 @@ __copyright__ = "Copyright (c) 2024 Joseph Porcelli"
 __license__ = "MIT"
 
 
+# Patch blocking calls first so db pool waits and sleeps yield to other green threads
+import eventlet
+import eventlet.tpool
+eventlet.monkey_patch()
+
+from bibindex import BibIndex, normalize_bib
+from broadcast import Broadcaster
+from chatlog import ChatLog
 from config import Config
+from db import (PoolTimeout, build_statement, cursor_columns, db_connect, fts_query, iter_batches, iter_table,
+                load_schema, migration, page_table, run_migrations, search_table, snapshot, table_columns,
+                zip_table)
+from escalation import Escalations
+from metrics import Counter, Gauge, Histogram, Profiler, render as render_metrics
 from pprint import pprint
+import argparse
+import csv
 import datetime
-from io import BytesIO
+import hashlib
+import hmac
+from io import BytesIO, StringIO
+import json
+import numpy as np
 import os
 import pandas as pd
 import re
 import sqlite3
 import sys
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, abort
+import tempfile
+import time
+import xlsxwriter
+import zipfile
+import zlib
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, jsonify, send_file, abort, g
 from flask_login import current_user, LoginManager, login_user, logout_user, login_required, UserMixin
 from urllib.parse import urlsplit
 from werkzeug.utils import secure_filename
@@ -39,8 +63,61 @@ login_manager = LoginManager()
 login_manager.login_view  = 'login'
 login_manager.init_app(app)
 
-socketio = SocketIO()
-socketio.init_app(app)
+# With a message queue (e.g. redis://localhost:6379/0) several worker
+# processes can serve consoles, each emit reaching clients on all of them
+SOCKETIO_MESSAGE_QUEUE = getattr(Config, 'SOCKETIO_MESSAGE_QUEUE', None)
+
+SIO_EMITS = Counter('ndart_sio_emits_total', 'Socket.IO messages emitted', labels=('namespace', 'event'))
+SIO_FANOUT = Histogram('ndart_sio_fanout_clients', 'Clients on this worker an emit was addressed to',
+                       labels=('namespace',), buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+class InstrumentedSocketIO(SocketIO):
+    """SocketIO counting every emit, flask_socketio.emit included, and its audience"""
+
+    def emit(self, event, *args, **kwargs):
+        namespace = kwargs.get('namespace') or '/'
+        to = kwargs.get('to') or kwargs.get('room')
+        SIO_EMITS.inc(namespace=namespace, event=event)
+        try:
+            # The None room holds every client in the namespace, each sid has a room of its own
+            rooms = self.server.manager.rooms.get(namespace, {})
+            targets = to if isinstance(to, (list, tuple)) else [to]
+            SIO_FANOUT.observe(len(set().union(*(rooms.get(room, ()) for room in targets))), namespace=namespace)
+        except Exception:
+            pass
+        return super().emit(event, *args, **kwargs)
+
+
+socketio = InstrumentedSocketIO()
+socketio.init_app(app, message_queue=SOCKETIO_MESSAGE_QUEUE)
+
+
+def connected_clients():
+    rooms = socketio.server.manager.rooms
+    return {(namespace,): len(rooms[namespace].get(None, ())) for namespace in list(rooms)}
+
+
+SIO_CLIENTS = Gauge('ndart_sio_clients', 'Socket.IO clients connected to this worker', labels=('namespace',),
+                    collect=connected_clients)
+
+# Change messages are buffered and sent to consoles in batches
+broadcaster = Broadcaster(socketio)
+
+# Warn/alert timers for events waiting on an agency
+escalations = Escalations(socketio, broadcaster.send,
+                          load=lambda: unresolved_events(),
+                          changes=lambda since: changes_since('events', since),
+                          audience=lambda row: change_rooms('events', row))
+
+# Bib -> event and observation ids, for a runner's timeline
+bib_index = BibIndex(('events', 'observations'),
+                     load=lambda table: bib_rows(table),
+                     revision=lambda table: current_revision(table),
+                     changes=lambda table, since: changes_since(table, since))
+
+# Recent chat kept in memory, written to chat_messages in batches
+chat_log = ChatLog(socketio, shared=bool(SOCKETIO_MESSAGE_QUEUE))
 
 # Setup some user stuff here
 class User(UserMixin):
@@ -50,8 +127,10 @@ class User(UserMixin):
         self.role = role
         self.active = active
 
+    # Sessions hold the user name, which is the same in every worker and
+    # across restarts, rather than the position in USER_ACCOUNTS
     def get_id(self):
-        return self.id
+        return self.name
 
     @property
     def is_active(self):
@@ -68,7 +147,8 @@ class User(UserMixin):
 
 @login_manager.user_loader
 def load_user(id):
-    return Config.USERS[int(id)]
+    account = Config.USER_ACCOUNTS.get(str(id).lower())
+    return Config.USERS[account['id']] if account else None
 
 
 # *====================================================================*
@@ -96,191 +176,1239 @@ for n, u in Config.USER_ACCOUNTS.items():
 if not os.path.exists('db'):
     os.makedirs('db')
 
-# Function to connect to SQLLite Database
-def db_connect():
-    return sqlite3.connect(Config.DATABASE_PATH)
-
-
 # Function to create an SQLite database and table to store data
 def create_database():
-    conn =  db_connect()
-    cursor = conn.cursor()
+    with db_connect(write=True) as conn:
+        cursor = conn.cursor()
 
-    # Events Table - Holds a list of all events
-    cursor.execute('''CREATE TABLE IF NOT EXISTS events (
-                      id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      time_in TEXT,
-                      bib TEXT,
-                      reporter TEXT,
-                      location TEXT,
-                      agency TEXT,
-                      agency_notified TEXT,
-                      agency_arrival TEXT,
-                      resolved TEXT,
-                      notes TEXT
-                   )''')
+        # Events Table - Holds a list of all events
+        cursor.execute('''CREATE TABLE IF NOT EXISTS events (
+                          id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          time_in TEXT,
+                          bib TEXT,
+                          reporter TEXT,
+                          location TEXT,
+                          agency TEXT,
+                          agency_notified TEXT,
+                          agency_arrival TEXT,
+                          resolved TEXT,
+                          notes TEXT
+                       )''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS observations (
+                          id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          time TEXT NOT NULL,
+                          bib TEXT,
+                          location TEXT,
+                          category TEXT
+                       )''')
+
+        # Change Log - One row per create/edit/remove, numbered per table
+        cursor.execute('''CREATE TABLE IF NOT EXISTS change_log (
+                          table_name TEXT NOT NULL,
+                          revision INTEGER NOT NULL,
+                          row_id INTEGER,
+                          action TEXT NOT NULL,
+                          changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                          PRIMARY KEY (table_name, revision)
+                       )''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS observations_categories (
+                          id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          value TEXT NOT NULL UNIQUE,
+                          display TEXT,
+                          active INTEGER NOT NULL DEFAULT 1
+                       )''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS locations (
+                          id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          value TEXT NOT NULL UNIQUE,
+                          display TEXT,
+                          active INTEGER NOT NULL DEFAULT 1
+                       )''')
+
+        cursor.execute('''CREATE TABLE IF NOT EXISTS agencies (
+                          id INTEGER PRIMARY KEY AUTOINCREMENT,
+                          value TEXT NOT NULL UNIQUE,
+                          display TEXT,
+                          active INTEGER NOT NULL DEFAULT 1
+                       )''')
+
+        # Add Categories for the Observations
+        try:
+            cursor.execute('''INSERT INTO agencies(value, display, active)
+                        VALUES
+                        ('Arl Fire', 'Arl Fire', 1),
+                        ('DC FEMS', 'DC FEMS', 1),
+                        ('Law', 'Law', 1)
+                    ''')
+        except Exception as e:
+            pass # Its okay, we have already added these values
+
+        # Add Categories for the Observations
+        try:
+            cursor.execute('''INSERT INTO observations_categories(value, display, active)
+                        VALUES
+                        ('Male', 'Male', 1),
+                        ('Female', 'Female', 1),
+                        ('Wheelchair', 'Wheelchair', 1)
+                    ''')
+        except Exception as e:
+            pass # Its okay, we have already added these values
+
+        # Add Locations
+        try:
+            cursor.execute('''INSERT INTO locations(value, display, active)
+                        VALUES
+                        ('MMO', 'MMO', 1),
+                        ('MM1', 'MM1', 1),
+                        ('MM2', 'MM2', 1),
+                        ('WP1', 'WP1', 1),
+                        ('MM2.7', 'MM2.7', 1),
+                        ('MM3.6', 'MM3.6', 1),
+                        ('MM4', 'MM4', 1),
+                        ('MM4.5', 'MM4.5', 1),
+                        ('MM50.1', 'MM50.1', 1),
+                        ('MM50.2', 'MM50.2', 1),
+                        ('AS50', 'AS50', 1),
+                        ('MM50.3', 'MM50.3', 1),
+                        ('AS1', 'AS1', 1),
+                        ('WP2', 'WP2', 1),
+                        ('MM5', 'MM5', 1),
+                        ('MM5.5', 'MM5.5', 1),
+                        ('MM6', 'MM6', 1),
+                        ('WP3', 'WP3', 1),
+                        ('AS2/3', 'AS2/3', 1),
+                        ('MM7', 'MM7', 1),
+                        ('MM7.5', 'MM7.5', 1),
+                        ('MM8', 'MM8', 1),
+                        ('MM9', 'MM9', 1),
+                        ('MM10', 'MM10', 1),
+                        ('WP5/7', 'WP5/7', 1),
+                        ('AS4/6', 'AS4/6', 1),
+                        ('MM11', 'MM11', 1),
+                        ('MM11.5', 'MM11.5', 1),
+                        ('MM12', 'MM12', 1),
+                        ('MM12.5', 'MM12.5', 1),
+                        ('MM13', 'MM13', 1),
+                        ('MM13.5', 'MM13.5', 1),
+                        ('WP6', 'WP6', 1),
+                        ('MM14', 'MM14', 1),
+                        ('MM14.5', 'MM14.5', 1),
+                        ('MM15', 'MM15', 1),
+                        ('MM15.5', 'MM15.5', 1),
+                        ('MM16', 'MM16', 1),
+                        ('MM16.5', 'MM16.5', 1),
+                        ('MM17', 'MM17', 1),
+                        ('AS7', 'AS7', 1),
+                        ('MM17.5', 'MM17.5', 1),
+                        ('MM18', 'MM18', 1),
+                        ('MM18.5', 'MM18.5', 1),
+                        ('FS1', 'FS1', 1),
+                        ('MM19', 'MM19', 1),
+                        ('AS8', 'AS8', 1),
+                        ('MM19.5', 'MM19.5', 1),
+                        ('MM20', 'MM20', 1),
+                        ('MM20.5', 'MM20.5', 1),
+                        ('MM21', 'MM21', 1),
+                        ('MM21.5', 'MM21.5', 1),
+                        ('AS9', 'AS9', 1),
+                        ('WP10', 'WP10', 1),
+                        ('MM22', 'MM22', 1),
+                        ('MM22.5', 'MM22.5', 1),
+                        ('MM22.7', 'MM22.7', 1),
+                        ('MM23', 'MM23', 1),
+                        ('MM23.5', 'MM23.5', 1),
+                        ('FS2', 'FS2', 1),
+                        ('WP11', 'WP11', 1),
+                        ('AS10', 'AS10', 1),
+                        ('MM24', 'MM24', 1),
+                        ('MM24.5', 'MM24.5', 1),
+                        ('WP12', 'WP12', 1),
+                        ('MM25', 'MM25', 1),
+                        ('MM25.5', 'MM25.5', 1),
+                        ('MM26', 'MM26', 1)
+                    ''')
+        except Exception as e:
+            pass # Its okay, we have already added these values
+
+
+    applied = run_migrations()
+    if applied:
+        print(f"Applied migrations {applied}", file=sys.stderr)
+    load_schema()
+    prune_request_ids()
+    bib_index.rebuild()
+    escalations.start()
+    print("Database created!", file=sys.stderr)
 
-    # Add Agency to events table if it isn't already there
-    try:
-        cursor.execute('''ALTER TABLE events ADD agency TEXT''')
-    except Exception as e:
-        pass # Its okay, we already have the agency field
 
 
-    cursor.execute('''CREATE TABLE IF NOT EXISTS observations (
-                      id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      time TEXT NOT NULL,
-                      bib TEXT,
-                      location TEXT,
-                      category TEXT
-                   )''')
+# *--------------------------------------------------------------------*
+#         Migrations
+# *--------------------------------------------------------------------*
+# Events where an agency is still working, i.e. not yet resolved.  Queries
+# must use this exact condition for SQLite to pick the partial index.
+UNRESOLVED_EVENTS = "(resolved IS NULL OR resolved = '')"
 
-    cursor.execute('''CREATE TABLE IF NOT EXISTS observations_categories (
-                      id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      value TEXT NOT NULL UNIQUE,
-                      display TEXT,
-                      active INTEGER NOT NULL DEFAULT 1
-                   )''')
 
-    cursor.execute('''CREATE TABLE IF NOT EXISTS locations (
+@migration(1, 'Add agency to events')
+def add_event_agency(cursor):
+    columns = [column[1] for column in cursor.execute('PRAGMA table_info(events)')]
+    if 'agency' not in columns:
+        cursor.execute('ALTER TABLE events ADD agency TEXT')
+
+
+@migration(2, 'Index times, bibs, locations and categories for paging and search')
+def add_paging_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS events_time_in ON events (time_in)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS events_bib ON events (bib COLLATE NOCASE)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS events_location ON events (location COLLATE NOCASE)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS observations_time ON observations (time)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS observations_bib ON observations (bib COLLATE NOCASE)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS observations_location ON observations (location COLLATE NOCASE)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS observations_category ON observations (category COLLATE NOCASE)')
+
+
+@migration(3, 'Index location and time ranges')
+def add_location_time_indexes(cursor):
+    cursor.execute('CREATE INDEX IF NOT EXISTS events_location_time ON events (location, time_in)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS observations_location_time ON observations (location, time)')
+
+
+@migration(4, 'Index unresolved events')
+def add_unresolved_index(cursor):
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS events_unresolved ON events (time_in) WHERE {UNRESOLVED_EVENTS}')
+
+
+@migration(5, "Add the 'Other' agency the consoles offered")
+def add_other_agency(cursor):
+    cursor.execute("INSERT OR IGNORE INTO agencies (value, display, active) VALUES ('Other', 'Other', 1)")
+
+
+@migration(6, 'Summarize observations by location, category and time bucket')
+def add_observation_counts(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS observation_counts (
+                      location TEXT NOT NULL,
+                      category TEXT NOT NULL,
+                      bucket TEXT NOT NULL,
+                      count INTEGER NOT NULL,
+                      PRIMARY KEY (location, category, bucket)
+                   ) WITHOUT ROWID''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS observation_counts_bucket ON observation_counts (bucket)')
+    write_summary(cursor, summary_frame(cursor.connection))
+
+
+@migration(7, 'Keep chat history')
+def add_chat_messages(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS chat_messages (
                       id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      value TEXT NOT NULL UNIQUE,
-                      display TEXT,
-                      active INTEGER NOT NULL DEFAULT 1
+                      room TEXT NOT NULL,
+                      kind TEXT NOT NULL,
+                      name TEXT,
+                      msg TEXT NOT NULL,
+                      sent_at TEXT NOT NULL
                    )''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS chat_messages_room_sent ON chat_messages (room, sent_at)')
 
-    cursor.execute('''CREATE TABLE IF NOT EXISTS agencies (
-                      id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      value TEXT NOT NULL UNIQUE,
-                      display TEXT,
-                      active INTEGER NOT NULL DEFAULT 1
+
+@migration(8, 'Remember client request ids')
+def add_request_ids(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS request_ids (
+                      request_id TEXT NOT NULL,
+                      table_name TEXT NOT NULL,
+                      response TEXT NOT NULL,
+                      created_at REAL NOT NULL
+                   )''')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS request_ids_request_id ON request_ids (request_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS request_ids_created_at ON request_ids (created_at)')
+
+
+@migration(9, 'Store event clocks as unix times')
+def add_event_stamps(cursor):
+    columns = [column[1] for column in cursor.execute('PRAGMA table_info(events)')]
+    for column in EVENT_STAMPS.values():
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE events ADD {column} INTEGER')
+    day = race_day()
+    rows = cursor.execute(f"SELECT id, {', '.join(EVENT_CLOCKS)} FROM events").fetchall()
+    assignments = ', '.join(f'{column} = ?' for column in EVENT_STAMPS.values())
+    cursor.executemany(f'UPDATE events SET {assignments} WHERE id = ?',
+                       [(*event_stamps(dict(zip(EVENT_CLOCKS, clocks)), day).values(), id) for id, *clocks in rows])
+    cursor.execute('CREATE INDEX IF NOT EXISTS events_time_in_at ON events (time_in_at)')
+
+
+@migration(10, 'Full-text index of event notes, locations and reporters')
+def add_event_search(cursor):
+    # External content: the index holds only words and reads the text from events
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(
+                      notes, location, reporter,
+                      content = 'events', content_rowid = 'id',
+                      tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+                   )''')
+    # Triggers keep it in step with every write, whichever path makes it
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS events_fts_insert AFTER INSERT ON events BEGIN
+                          INSERT INTO events_fts (rowid, notes, location, reporter)
+                          VALUES (new.id, new.notes, new.location, new.reporter);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS events_fts_delete AFTER DELETE ON events BEGIN
+                          INSERT INTO events_fts (events_fts, rowid, notes, location, reporter)
+                          VALUES ('delete', old.id, old.notes, old.location, old.reporter);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS events_fts_update
+                      AFTER UPDATE OF notes, location, reporter ON events BEGIN
+                          INSERT INTO events_fts (events_fts, rowid, notes, location, reporter)
+                          VALUES ('delete', old.id, old.notes, old.location, old.reporter);
+                          INSERT INTO events_fts (rowid, notes, location, reporter)
+                          VALUES (new.id, new.notes, new.location, new.reporter);
+                      END''')
+    cursor.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+
+
+@migration(11, 'Leases for single-worker background jobs')
+def add_leases(cursor):
+    # Earlier versions created it on first use
+    cursor.execute('''CREATE TABLE IF NOT EXISTS leases (
+                      name TEXT PRIMARY KEY,
+                      holder TEXT NOT NULL,
+                      expires_at REAL NOT NULL
                    )''')
 
-    # Add Categories for the Observations
-    try:
-        cursor.execute('''INSERT INTO agencies(value, display, active)
-                    VALUES
-                    ('Arl Fire', 'Arl Fire', 1),
-                    ('DC FEMS', 'DC FEMS', 1),
-                    ('Law', 'Law', 1)
-                ''')
-    except Exception as e:
-        pass # Its okay, we have already added these values
-
-    # Add Categories for the Observations
-    try:
-        cursor.execute('''INSERT INTO observations_categories(value, display, active)
-                    VALUES
-                    ('Male', 'Male', 1),
-                    ('Female', 'Female', 1),
-                    ('Wheelchair', 'Wheelchair', 1)
-                ''')
-    except Exception as e:
-        pass # Its okay, we have already added these values
-
-    # Add Locations
-    try:
-        cursor.execute('''INSERT INTO locations(value, display, active)
-                    VALUES
-                    ('MMO', 'MMO', 1),
-                    ('MM1', 'MM1', 1),
-                    ('MM2', 'MM2', 1),
-                    ('WP1', 'WP1', 1),
-                    ('MM2.7', 'MM2.7', 1),
-                    ('MM3.6', 'MM3.6', 1),
-                    ('MM4', 'MM4', 1),
-                    ('MM4.5', 'MM4.5', 1),
-                    ('MM50.1', 'MM50.1', 1),
-                    ('MM50.2', 'MM50.2', 1),
-                    ('AS50', 'AS50', 1),
-                    ('MM50.3', 'MM50.3', 1),
-                    ('AS1', 'AS1', 1),
-                    ('WP2', 'WP2', 1),
-                    ('MM5', 'MM5', 1),
-                    ('MM5.5', 'MM5.5', 1),
-                    ('MM6', 'MM6', 1),
-                    ('WP3', 'WP3', 1),
-                    ('AS2/3', 'AS2/3', 1),
-                    ('MM7', 'MM7', 1),
-                    ('MM7.5', 'MM7.5', 1),
-                    ('MM8', 'MM8', 1),
-                    ('MM9', 'MM9', 1),
-                    ('MM10', 'MM10', 1),
-                    ('WP5/7', 'WP5/7', 1),
-                    ('AS4/6', 'AS4/6', 1),
-                    ('MM11', 'MM11', 1),
-                    ('MM11.5', 'MM11.5', 1),
-                    ('MM12', 'MM12', 1),
-                    ('MM12.5', 'MM12.5', 1),
-                    ('MM13', 'MM13', 1),
-                    ('MM13.5', 'MM13.5', 1),
-                    ('WP6', 'WP6', 1),
-                    ('MM14', 'MM14', 1),
-                    ('MM14.5', 'MM14.5', 1),
-                    ('MM15', 'MM15', 1),
-                    ('MM15.5', 'MM15.5', 1),
-                    ('MM16', 'MM16', 1),
-                    ('MM16.5', 'MM16.5', 1),
-                    ('MM17', 'MM17', 1),
-                    ('AS7', 'AS7', 1),
-                    ('MM17.5', 'MM17.5', 1),
-                    ('MM18', 'MM18', 1),
-                    ('MM18.5', 'MM18.5', 1),
-                    ('FS1', 'FS1', 1),
-                    ('MM19', 'MM19', 1),
-                    ('AS8', 'AS8', 1),
-                    ('MM19.5', 'MM19.5', 1),
-                    ('MM20', 'MM20', 1),
-                    ('MM20.5', 'MM20.5', 1),
-                    ('MM21', 'MM21', 1),
-                    ('MM21.5', 'MM21.5', 1),
-                    ('AS9', 'AS9', 1),
-                    ('WP10', 'WP10', 1),
-                    ('MM22', 'MM22', 1),
-                    ('MM22.5', 'MM22.5', 1),
-                    ('MM22.7', 'MM22.7', 1),
-                    ('MM23', 'MM23', 1),
-                    ('MM23.5', 'MM23.5', 1),
-                    ('FS2', 'FS2', 1),
-                    ('WP11', 'WP11', 1),
-                    ('AS10', 'AS10', 1),
-                    ('MM24', 'MM24', 1),
-                    ('MM24.5', 'MM24.5', 1),
-                    ('WP12', 'WP12', 1),
-                    ('MM25', 'MM25', 1),
-                    ('MM25.5', 'MM25.5', 1),
-                    ('MM26', 'MM26', 1)
-                ''')
-    except Exception as e:
-        pass # Its okay, we have already added these values
+
+# *====================================================================*
+#         ROOMS
+# *====================================================================*
+# Consoles on /api join a room for their role and rooms for the course
+# locations they cover, so each change is only sent to the consoles that
+# show it.  Admins and managers cover every location; a station covers
+# the 'locations' listed for its account in USER_ACCOUNTS, by default the
+# location it is named after, and its pages only list those.  A station
+# whose name is not a location covers every location, as before.
+FULL_VIEW_ROLES = getattr(Config, 'FULL_VIEW_ROLES', ('admin', 'manager'))
+ALL_LOCATIONS_ROOM = 'locations:all'
+
+# Columns naming the course locations a row concerns
+LOCATION_COLUMNS = {
+    'events': ('location', 'reporter'),
+    'observations': ('location',),
+}
+
+# Locations revision -> {lowercased value: value}
+location_cache = {}
+
+
+def location_values():
+    """Every location in the locations table, keyed by its lowercased value"""
+    revision = current_revision('locations')
+    if revision not in location_cache:
+        with db_connect() as conn:
+            values = {row[0].lower(): row[0] for row in conn.execute('SELECT value FROM locations') if row[0]}
+        location_cache.clear()
+        location_cache[revision] = values
+    return location_cache[revision]
+
+
+def console_locations(user):
+    """Sorted locations a user's consoles cover, None for every location"""
+    if not user.is_authenticated or user.role in FULL_VIEW_ROLES:
+        return None
+    account = Config.USER_ACCOUNTS.get(user.name, {})
+    known = location_values()
+    names = account.get('locations') or [user.name]
+    return sorted({known[name.lower()] for name in names if name.lower() in known}) or None
+
+
+def console_rooms(user):
+    """Rooms a user's consoles join on /api, none for an anonymous user"""
+    if not user.is_authenticated:
+        return []
+    rooms = [f'role:{user.role}']
+    locations = console_locations(user)
+    if locations is None:
+        rooms.append(ALL_LOCATIONS_ROOM)
+    else:
+        rooms.extend(f'location:{location}' for location in locations)
+    return rooms
 
 
-    print("Database created!", file=sys.stderr)
-    conn.commit()
-    conn.close()
+def change_rooms(table, *rows, known=None):
+    """Rooms that care about a change to rows, e.g. a row before and after an edit
 
+    known, the location_values() of the caller, saves looking them up again.
+    """
+    known = location_values() if known is None else known
+    locations = {known.get(str(row[col]).lower(), row[col])
+                 for row in rows if row for col in LOCATION_COLUMNS.get(table, ()) if row.get(col)}
+    return (ALL_LOCATIONS_ROOM,) + tuple(sorted(f'location:{location}' for location in locations))
 
 
-# Function to export participant data as a zipped dict
-def zip_table(table_name, where_clause=None):
-    if where_clause is None:
-        where_clause = ""
-    else:
-        where_clause = f' WHERE {where_clause}'
-    with sqlite3.connect(Config.DATABASE_PATH) as conn:
+def role_rooms(roles=FULL_VIEW_ROLES):
+    return tuple(f'role:{role}' for role in roles)
+
+
+# *====================================================================*
+#         CHANGE TRACKING
+# *====================================================================*
+# Every create/edit/remove is written to change_log in the same
+# transaction as the row itself, giving each table a persistent,
+# monotonically increasing revision.  The change is then broadcast as a
+# delta so consoles can patch their tables in place, and a console that
+# missed some revisions asks for just those with ?since=<revision>.
+SYNC_TABLES = ('events', 'observations')
+
+# Socket.IO message sent for each kind of change
+SIO_CHANGE_MSGS = {
+    ('events', 'create'): 'new_event',
+    ('events', 'edit'): 'edit_events',
+    ('events', 'remove'): 'remove_events',
+    ('observations', 'create'): 'new_observation',
+    ('observations', 'edit'): 'edit_observations',
+    ('observations', 'remove'): 'remove_observations',
+    ('events', 'reset'): 'reset_events',
+    ('observations', 'reset'): 'reset_observations',
+    ('observations', 'bulk'): 'bulk_observations',
+}
+
+EDITOR_FIELD_PATTERN = re.compile(r'\[(\d+)\]\[([a-zA-Z_]+)\]')
+
+
+def current_revision(table):
+    """Latest revision logged for table, 0 if it has never changed"""
+    with db_connect() as conn:
         cursor = conn.cursor()
-        select_statement = f'SELECT * FROM {table_name}{where_clause if where_clause else ""}'
-        cursor.execute(select_statement)
-        rows = cursor.fetchall()
-        # Get the column names
-        cursor.execute(f"PRAGMA table_info({table_name})")
-        columns = [column[1] for column in cursor.fetchall()]
-        # Convert the data to a list of dictionaries
-    data_list = []
-    for row in rows:
-        data_dict = dict(zip(columns, row))
-        data_list.append(data_dict)
-    return {'data': data_list}
+        cursor.execute('SELECT COALESCE(MAX(revision), 0) FROM change_log WHERE table_name = ?', (table,))
+        return cursor.fetchone()[0]
+
+
+def log_change(cursor, table, action, row_id=None):
+    """Record a change in the caller's transaction and return its revision"""
+    cursor.execute('''INSERT INTO change_log (table_name, revision, row_id, action)
+                      SELECT ?, COALESCE(MAX(revision), 0) + 1, ?, ?
+                      FROM change_log WHERE table_name = ?''',
+                   (table, row_id, action, table))
+    cursor.execute('SELECT revision FROM change_log WHERE rowid = ?', (cursor.lastrowid,))
+    return cursor.fetchone()[0]
+
+
+def log_changes(cursor, table, action, row_ids):
+    """Record one change per row id, numbered consecutively; returns the first revision"""
+    cursor.execute('SELECT COALESCE(MAX(revision), 0) FROM change_log WHERE table_name = ?', (table,))
+    first_revision = cursor.fetchone()[0] + 1
+    cursor.executemany('INSERT INTO change_log (table_name, revision, row_id, action) VALUES (?, ?, ?, ?)',
+                       ((table, first_revision + n, row_id, action) for n, row_id in enumerate(row_ids)))
+    return first_revision
+
+
+def broadcast_change(table, action, row_id, revision, row=None, rooms=None):
+    """Send a committed change to the consoles in rooms, every console if None"""
+    change = {
+        'table': table,
+        'action': action,
+        'id': row_id,
+        'revision': revision,
+        'data': row
+    }
+    send_sio_msg(SIO_CHANGE_MSGS[(table, action)], change, rooms)
+    return change
+
+
+def revision_etag(table, revision, row_id=None):
+    """Weak ETag for table (or one of its rows) as of revision
+
+    Every write to a synced table moves its revision, so an unchanged
+    revision means the client's copy is still current.
+    """
+    return f'{table}-{revision}' if row_id is None else f'{table}-{revision}-{row_id}'
+
+
+def conditional(response, etag):
+    """Mark response with etag so the client revalidates before reusing it"""
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag):
+    """A 304 response if the client already holds etag, otherwise None"""
+    if request.if_none_match.contains_weak(etag):
+        return conditional(Response(status=304), etag)
+    return None
+
+
+def unresolved_events():
+    """The events revision and the events still open as of it"""
+    revision = current_revision('events')
+    return revision, zip_table('events', UNRESOLVED_EVENTS)['data']
+
+
+def changes_since(table, since):
+    """Rows changed after revision since, plus tombstones for removed ids
+
+    Asks the client to reload instead when the table was cleared in the
+    meantime or it holds a revision this database never issued.
+    """
+    revision = current_revision(table)
+    if since > revision:
+        return {'reload': True, 'revision': revision}
+
+    with db_connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('''SELECT row_id, action FROM change_log
+                          WHERE table_name = ? AND revision > ? AND action IN ('remove', 'reset')''',
+                       (table, since))
+        removals = cursor.fetchall()
+    if any(action == 'reset' for _, action in removals):
+        return {'reload': True, 'revision': revision}
+
+    changed = (f"id IN (SELECT row_id FROM change_log "
+               f"WHERE table_name = '{table}' AND revision > {int(since)})")
+    data = zip_table(table_name=table, where_clause=changed)
+    data['removed'] = sorted({row_id for row_id, _ in removals})
+    data['revision'] = revision
+    return data
+
+
+def parse_editor_form(form):
+    """Group DataTables Editor fields (data[<id>][<field>]) by row id"""
+    rows = {}
+    for key in form.keys():
+        matches = EDITOR_FIELD_PATTERN.search(key)
+        if matches:
+            rows.setdefault(int(matches.group(1)), {})[matches.group(2)] = form[key]
+    return rows
+
+
+def editor_statements(table, action, rows):
+    """Statement and columns to write each row with
+
+    Raises ValueError if a row names a field the table does not have.
+    """
+    statements = {}
+    for id, fields in rows.items():
+        columns = () if action == 'remove' else tuple(sorted(col for col in fields if col != 'id'))
+        statements[id] = (build_statement(table, action, columns), columns)
+    return statements
+
+
+def apply_editor_rows(cursor, table, action, rows, statements):
+    """Write rows in the caller's transaction; returns the changes to publish
+
+    Each change is (row id, revision, row before, row as written or None
+    if removed, summary buckets it moved).
+    """
+    select = build_statement(table, 'select')
+    changes = []
+    for id, fields in rows.items():
+        query, columns = statements[id]
+        params = [fields[col] for col in columns]
+        if action != 'create':
+            params.append(id)
+
+        old = None
+        if table in SYNC_TABLES and action != 'create':
+            cursor.execute(select, (id,))
+            found = cursor.fetchone()
+            old = found and dict(zip(cursor_columns(cursor), found))
+
+        cursor.execute(query, params)
+        if action == 'create':
+            id = cursor.lastrowid
+        elif cursor.rowcount == 0:
+            continue # Nothing to change, the row is already gone
+
+        revision = log_change(cursor, table, action, id)
+        row = None
+        if action != 'remove':
+            cursor.execute(select, (id,))
+            row = dict(zip(cursor_columns(cursor), cursor.fetchone()))
+            if table == 'events':
+                row = stamp_event(cursor, id, old, row)
+
+        buckets = None
+        if table == 'observations':
+            buckets = tally_observations(cursor, summary_deltas(old, row))
+        changes.append((id, revision, old, row, buckets))
+    return changes
+
+
+def publish_changes(table, action, changes):
+    """Broadcast changes once their transaction has committed"""
+    buckets = []
+    known = location_values() if table in SYNC_TABLES and changes else None
+    for id, revision, old, row, moved in changes:
+        if table in SYNC_TABLES:
+            broadcast_change(table, action, id, revision, row, change_rooms(table, old, row, known=known))
+        buckets.extend(moved or ())
+    if table in BIB_TABLES and changes:
+        bib_index.apply(table, changes[0][1], changes[-1][1],
+                        [(id, old, row) for id, revision, old, row, moved in changes])
+    if table == 'events' and changes:
+        escalations.poke()
+    if buckets:
+        broadcast_summary(changes[-1][1], buckets)
+
+
+def editor_action(table, action, rows, request_id=None):
+    """Apply an Editor create/edit/remove to table, broadcasting each synced row
+
+    The rows are written in one transaction, every change logged in
+    change_log, lookup tables included.  With a request_id a retry of
+    the same write is answered with the stored result instead.
+
+    Raises ValueError, before anything is written, if a row names a field
+    the table does not have.
+    """
+    statements = editor_statements(table, action, rows)
+    with db_connect(write=True) as conn:
+        cursor = conn.cursor()
+        if request_id:
+            stored = stored_result(cursor, request_id)
+            if stored is not None:
+                WRITES_REPLAYED.inc(table=table)
+                return stored
+        changes = apply_editor_rows(cursor, table, action, rows, statements)
+        result = {'data': [row for id, revision, old, row, buckets in changes if row is not None]}
+        if request_id:
+            store_result(cursor, request_id, table, result)
+    publish_changes(table, action, changes)
+    return result
+
+
+# *--------------------------------------------------------------------*
+#         Request ids
+# *--------------------------------------------------------------------*
+# Consoles send a request id (form field request_id, or the Idempotency-Key header)
+# with each write and the same one on every retry.  The result is stored
+# under it in the write's own transaction, so a retry after a dropped
+# connection gets that result back instead of writing a duplicate.
+# Every REQUEST_ID_PRUNE_EVERY stored results, ids past their ttl are
+# deleted in the same transaction, so the table does not grow all race.
+REQUEST_ID_TTL = getattr(Config, 'REQUEST_ID_TTL', 86400)
+REQUEST_ID_PRUNE_EVERY = getattr(Config, 'REQUEST_ID_PRUNE_EVERY', 500)
+
+WRITES_REPLAYED = Counter('ndart_writes_replayed_total', 'Retried writes answered from their stored result',
+                          labels=('table',))
+
+
+def client_request_id():
+    """The client's id for this write, None if it did not send one"""
+    return request.headers.get('Idempotency-Key') or request.form.get('request_id') or None
+
+
+def stored_result(cursor, request_id):
+    cursor.execute('SELECT response FROM request_ids WHERE request_id = ?', (request_id,))
+    found = cursor.fetchone()
+    return json.loads(found[0]) if found else None
+
+
+def store_result(cursor, request_id, table, result):
+    now = time.time()
+    cursor.execute('INSERT INTO request_ids (request_id, table_name, response, created_at) VALUES (?, ?, ?, ?)',
+                   (request_id, table, json.dumps(result, separators=(',', ':')), now))
+    # rowids count stored results across every worker
+    if cursor.lastrowid % REQUEST_ID_PRUNE_EVERY == 0:
+        expire_request_ids(cursor, now)
+
+
+def expire_request_ids(cursor, now):
+    cursor.execute('DELETE FROM request_ids WHERE created_at < ?', (now - REQUEST_ID_TTL,))
+
+
+def prune_request_ids():
+    """Forget request ids older than REQUEST_ID_TTL seconds"""
+    with db_connect(write=True) as conn:
+        expire_request_ids(conn.cursor(), time.time())
+
+def bulk_insert(table, rows):
+    """Insert many rows in one transaction with a single broadcast
+
+    Every row is checked against the schema before anything is written.
+    Returns the first and last new ids and the range of revisions logged.
+    """
+    columns = tuple(sorted({col for row in rows for col in row if col != 'id'}))
+    query = build_statement(table, 'create', columns)
+    params = [[row.get(col) for col in columns] for row in rows]
+
+    with db_connect(write=True) as conn:
+        cursor = conn.cursor()
+
+        # AUTOINCREMENT hands out consecutive ids while we hold the write lock
+        cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = ?', (table,))
+        first_id = cursor.fetchone()[0] + 1
+        cursor.executemany(query, params)
+        last_id = first_id + len(rows) - 1
+
+        first_revision = log_changes(cursor, table, 'create', range(first_id, last_id + 1))
+        revision = first_revision + len(rows) - 1
+
+        buckets = None
+        if table == 'observations':
+            buckets = tally_observations(cursor, summary_deltas(None, None, rows))
+
+    result = {
+        'table': table,
+        'action': 'bulk',
+        'count': len(rows),
+        'first_id': first_id,
+        'last_id': last_id,
+        'first_revision': first_revision,
+        'revision': revision
+    }
+    bib_index.apply(table, first_revision, revision,
+                    ((id, None, row) for id, row in zip(range(first_id, last_id + 1), rows)))
+    send_sio_msg(SIO_CHANGE_MSGS[(table, 'bulk')], result)
+    if buckets:
+        broadcast_summary(revision, buckets)
+    return result
+
+# *====================================================================*
+#         OBSERVATION SUMMARY
+# *====================================================================*
+# observation_counts holds the number of observations per location,
+# category and 5 minute bucket of their time.  It is kept in step with
+# observations inside the same transaction as each write, so a dashboard
+# reads locations x buckets rows instead of tallying every observation.
+BUCKET_MINUTES = 5
+BUCKET_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})')
+SUMMARY_COLUMNS = ('location', 'category', 'bucket')
+
+
+def time_bucket(clock):
+    """Start of the bucket holding an HH:mm time, e.g. '10:07' -> '10:05'"""
+    matches = BUCKET_PATTERN.match(clock or '')
+    if not matches:
+        return ''
+    minute = int(matches.group(2)) // BUCKET_MINUTES * BUCKET_MINUTES
+    return f'{int(matches.group(1)):02d}:{minute:02d}'
+
+
+def summary_key(row):
+    return (row.get('location') or '', row.get('category') or '', time_bucket(row.get('time')))
+
+
+def summary_deltas(old, new, created=()):
+    """Count changes per bucket for a row going from old to new, plus created rows"""
+    deltas = {}
+    for row, change in [(old, -1), (new, 1)] + [(row, 1) for row in created]:
+        if row:
+            key = summary_key(row)
+            deltas[key] = deltas.get(key, 0) + change
+    return deltas
+
+
+def tally_observations(cursor, deltas):
+    """Apply {(location, category, bucket): change} to observation_counts
+
+    Runs in the caller's transaction and returns the new counts of the
+    buckets that moved, 0 for those now empty.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return []
+    cursor.executemany('''INSERT INTO observation_counts (location, category, bucket, count)
+                          VALUES (?, ?, ?, ?)
+                          ON CONFLICT (location, category, bucket) DO UPDATE SET count = count + excluded.count''',
+                       [key + (delta,) for key, delta in deltas.items()])
+    counts = []
+    for key in sorted(deltas):
+        cursor.execute('SELECT count FROM observation_counts WHERE location = ? AND category = ? AND bucket = ?', key)
+        found = cursor.fetchone()
+        count = found[0] if found else 0
+        if count <= 0:
+            cursor.execute('DELETE FROM observation_counts WHERE location = ? AND category = ? AND bucket = ?', key)
+            count = 0
+        counts.append(dict(zip(SUMMARY_COLUMNS, key), count=count))
+    return counts
+
+
+def broadcast_summary(revision, buckets=None, reset=False):
+    """Push bucket counts that changed as of observations revision"""
+    if buckets or reset:
+        # For net control's dashboards; the consoles do not show it
+        send_sio_msg('summary_observations', {
+            'table': 'observation_counts',
+            'revision': revision,
+            'reset': reset,
+            'data': buckets or []
+        }, role_rooms())
+
+
+def observation_summary(location=None, since_bucket=None):
+    """Bucket counts, optionally for one location and from a bucket on"""
+    query = 'SELECT location, category, bucket, count FROM observation_counts WHERE 1'
+    params = []
+    if location:
+        query += ' AND location = ?'
+        params.append(location)
+    if since_bucket:
+        query += ' AND bucket >= ?'
+        params.append(time_bucket(since_bucket))
+    with db_connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query + ' ORDER BY bucket, location, category', params)
+        columns = cursor_columns(cursor)
+        return {'data': [dict(zip(columns, row)) for row in cursor]}
+
+
+def summary_frame(conn):
+    """Bucket counts computed from observations with pandas"""
+    frame = pd.read_sql_query('SELECT time, location, category FROM observations', conn)
+    # A race has only a few hundred distinct clock times, so bucket those once
+    times = frame['time'].fillna('')
+    frame['bucket'] = times.map({clock: time_bucket(clock) for clock in times.unique()})
+    frame['location'] = frame['location'].fillna('')
+    frame['category'] = frame['category'].fillna('')
+    counts = frame.groupby(list(SUMMARY_COLUMNS)).size().rename('count').reset_index()
+    return counts.sort_values(list(SUMMARY_COLUMNS), ignore_index=True)
+
+
+def write_summary(cursor, frame):
+    """Replace observation_counts with the counts in frame"""
+    cursor.execute('DELETE FROM observation_counts')
+    cursor.executemany('INSERT INTO observation_counts (location, category, bucket, count) VALUES (?, ?, ?, ?)',
+                       [(location, category, bucket, int(count))
+                        for location, category, bucket, count in frame.itertuples(index=False, name=None)])
+
+
+def rebuild_observation_summary(verify=False):
+    """Recompute observation_counts from observations
+
+    With verify the table is left alone and the buckets whose stored
+    count differs are returned instead.
+    """
+    # Hold the write lock so both reads see the same observations
+    with db_connect(write=True) as conn:
+        expected = summary_frame(conn)
+        if verify:
+            stored = pd.read_sql_query('SELECT location, category, bucket, count FROM observation_counts', conn)
+            merged = expected.merge(stored, on=list(SUMMARY_COLUMNS), how='outer',
+                                    suffixes=('_expected', '_stored')).fillna(0)
+            merged = merged[merged['count_expected'] != merged['count_stored']]
+            return [{**{col: row[col] for col in SUMMARY_COLUMNS},
+                     'expected': int(row['count_expected']), 'stored': int(row['count_stored'])}
+                    for _, row in merged.iterrows()]
+        write_summary(conn.cursor(), expected)
+    broadcast_summary(current_revision('observations'), reset=True)
+    return len(expected)
+
+
+# *====================================================================*
+#         PARTICIPANT TIMELINE
+# *====================================================================*
+# Everything known about a runner, for medical and family reunification
+# lookups.  bib_index finds the event and observation ids for a bib in
+# memory; only those rows are read, by primary key, and merged by time.
+BIB_TABLES = ('events', 'observations')
+
+BIB_INDEX_ROWS = Gauge('ndart_bib_index_rows', 'Rows in the bib index', labels=('table',),
+                       collect=lambda: {(table,): stats['rows'] for table, stats in bib_index.stats().items()})
+
+
+def bib_rows(table):
+    """The table's revision and (id, bib) of every row as of it"""
+    revision = current_revision(table)
+    with db_connect() as conn:
+        return revision, conn.execute(f'SELECT id, bib FROM {table} WHERE bib IS NOT NULL').fetchall()
+
+
+def bib_timeline(bib):
+    """(key, events and observations naming bib, oldest first)
+
+    Each entry is {'table', 'time', 'data': row}; rows without a time
+    come last.
+    """
+    key, found = bib_index.lookup(bib)
+    timeline = []
+    for table, ids in found.items():
+        if not ids:
+            continue
+        rows = [dict(zip(columns, values))
+                for columns, batch in iter_batches(table, f"id IN ({', '.join('?' * len(ids))})", ids)
+                for values in batch]
+        current = {row['id'] for row in rows if normalize_bib(row['bib']) == key}
+        stale = set(ids) - current
+        if stale:
+            bib_index.discard(table, key, stale)
+        time_column = EXPORT_TIME_COLUMNS[table]
+        timeline.extend({'table': table, 'time': row[time_column], 'data': row}
+                        for row in rows if row['id'] in current)
+    timeline.sort(key=lambda entry: (not entry['time'], entry['time'] or '', entry['table'], entry['data']['id']))
+    return key, timeline
+
+
+# *====================================================================*
+#         EVENT TIMES
+# *====================================================================*
+# The consoles read and write an event's clocks as HH:mm text.  Each
+# write also stores them as unix times in <clock>_at columns, on the race
+# day, every clock at or after the one before it so an event that runs
+# past midnight still adds up.  Those columns sort the events listing
+# and feed the response time analytics.
+EVENT_CLOCKS = ('time_in', 'agency_notified', 'agency_arrival', 'resolved')
+EVENT_STAMPS = {clock: f'{clock}_at' for clock in EVENT_CLOCKS}
+
+# YYYY-MM-DD the clocks are on; by default the day the event is first written
+RACE_DATE = getattr(Config, 'RACE_DATE', None)
+
+# Seconds without an event that separate one race from the next
+RACE_GAP = getattr(Config, 'RACE_GAP', 12 * 60 * 60)
+
+# Interval -> (clock it starts at, clock it ends at)
+RESPONSE_INTERVALS = {
+    'notify_to_arrival': ('agency_notified_at', 'agency_arrival_at'),
+    'arrival_to_resolve': ('agency_arrival_at', 'resolved_at'),
+}
+RESPONSE_GROUPS = ('agency', 'location')
+
+# (events revision, response_times) last computed by this worker
+response_cache = {}
+
+
+def race_day(old=None):
+    """The date an event's clocks are on, kept from its earlier stamps"""
+    if old and old.get('time_in_at') is not None:
+        return datetime.date.fromtimestamp(old['time_in_at'])
+    if RACE_DATE:
+        return datetime.date.fromisoformat(RACE_DATE)
+    return datetime.date.today()
+
+
+def event_stamps(row, day):
+    """{<clock>_at: unix time or None} for the HH:mm clocks of row on day"""
+    stamps = {}
+    previous = None
+    for clock in EVENT_CLOCKS:
+        matches = CLOCK_TIME_PATTERN.match(str(row.get(clock) or '').strip())
+        stamp = None
+        if matches and int(matches.group(1)) < 24 and int(matches.group(2)) < 60:
+            moment = datetime.datetime.combine(day, datetime.time(int(matches.group(1)), int(matches.group(2))))
+            if previous is not None and moment < previous:
+                moment += datetime.timedelta(days=1) # Past midnight
+            previous = moment
+            stamp = int(moment.timestamp())
+        stamps[EVENT_STAMPS[clock]] = stamp
+    return stamps
+
+
+def stamp_event(cursor, id, old, row):
+    """Store the typed clocks of a just written event; returns the row with them"""
+    stamps = event_stamps(row, race_day(old))
+    if any(row.get(column) != stamp for column, stamp in stamps.items()):
+        cursor.execute(f"UPDATE events SET {', '.join(f'{column} = ?' for column in stamps)} WHERE id = ?",
+                       (*stamps.values(), id))
+    return {**row, **stamps}
+
+
+def interval_summary(grouped):
+    """{interval: {group: {count, mean, std, min, p50, p90, max}}} from grouped intervals"""
+    stats = {'count': grouped.count(), 'mean': grouped.mean(), 'std': grouped.std(), 'min': grouped.min(),
+             'p50': grouped.quantile(0.5), 'p90': grouped.quantile(0.9), 'max': grouped.max()}
+    summary = {interval: {} for interval in RESPONSE_INTERVALS}
+    for stat, table in stats.items():
+        for interval, values in table.round(1).items():
+            for group, value in values.items():
+                value = None if pd.isna(value) else int(value) if stat == 'count' else float(value)
+                summary[interval].setdefault(group, {})[stat] = value
+    return summary
+
+
+def response_times(conn):
+    """Minutes each interval took, overall and per agency and location
+
+    Only events an agency arrived at take part; an event that has not
+    reached an interval's end is left out of that interval.
+    """
+    frame = pd.read_sql_query(f"SELECT {', '.join(RESPONSE_GROUPS)}, agency_notified_at, agency_arrival_at, "
+                              f"resolved_at FROM events WHERE agency_arrival_at IS NOT NULL", conn)
+    for group in RESPONSE_GROUPS:
+        frame[group] = frame[group].fillna('')
+    for interval, (start, end) in RESPONSE_INTERVALS.items():
+        frame[interval] = (frame[end] - frame[start]).astype(float) / 60
+
+    intervals = list(RESPONSE_INTERVALS)
+    overall = interval_summary(frame.groupby(np.zeros(len(frame), dtype=int))[intervals])
+    result = {'overall': {interval: groups.get(0) for interval, groups in overall.items()}}
+    for group in RESPONSE_GROUPS:
+        result[f'by_{group}'] = interval_summary(frame.groupby(group)[intervals])
+    return result
+
+
+# *====================================================================*
+#         STREAMING
+# *====================================================================*
+# Full listings are written out a batch of rows at a time, so memory
+# stays flat as the tables grow and the first bytes go out immediately.
+STREAM_GZIP = getattr(Config, 'STREAM_GZIP', True)
+STREAM_GZIP_LEVEL = getattr(Config, 'STREAM_GZIP_LEVEL', 6)
+
+
+def json_listing(table_name, where_clause=None, **envelope):
+    """Yield {"data": [...], **envelope} as JSON text, one batch at a time"""
+    yield '{"data":['
+    separator = ''
+    for batch in iter_table(table_name, where_clause):
+        yield separator + json.dumps(batch, separators=(',', ':'))[1:-1]
+        separator = ','
+        eventlet.sleep(0) # Let other consoles in between batches
+    yield '],' + json.dumps(envelope, separators=(',', ':'))[1:] if envelope else ']}'
+
+
+def gzip_chunks(chunks):
+    """Gzip a stream of text chunks"""
+    compressor = zlib.compressobj(STREAM_GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_response(chunks):
+    """Stream JSON chunks to the client, gzipped if it accepts that"""
+    headers = {'Vary': 'Accept-Encoding'}
+    if STREAM_GZIP and 'gzip' in request.accept_encodings:
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(chunks, mimetype='application/json', headers=headers)
+
+# *====================================================================*
+#         EXPORT
+# *====================================================================*
+# After-action exports are written from SQLite a batch at a time, yielding
+# to the hub between batches: CSV is streamed straight to the client and
+# XLSX goes through XlsxWriter's constant_memory mode to a temporary file.
+EXPORT_TIME_COLUMNS = {
+    'events': 'time_in',
+    'observations': 'time',
+}
+# What the rows are ordered and filtered by, the typed clock where there is one
+EXPORT_ORDER_COLUMNS = {
+    'events': 'time_in_at',
+    'observations': 'time',
+}
+EXPORT_BATCH_SIZE = getattr(Config, 'EXPORT_BATCH_SIZE', 2000)
+
+# Data rows per worksheet, leaving room for the header under Excel's limit
+XLSX_MAX_ROWS = 1048576 - 1
+
+
+def race_start():
+    """When the race began: its first event's time_in, RACE_DATE's if set
+
+    Without RACE_DATE the race is the latest run of events with no gap of
+    RACE_GAP seconds, so earlier races in the table do not move the day.
+    """
+    with db_connect() as conn:
+        if RACE_DATE:
+            day = datetime.datetime.combine(datetime.date.fromisoformat(RACE_DATE), datetime.time())
+            first = conn.execute('SELECT MIN(time_in_at) FROM events WHERE time_in_at >= ? AND time_in_at < ?',
+                                 (day.timestamp(), (day + datetime.timedelta(days=1)).timestamp())).fetchone()[0]
+        else:
+            day = datetime.datetime.combine(datetime.date.today(), datetime.time())
+            first = conn.execute('SELECT MAX(time_in_at) FROM '
+                                 '(SELECT time_in_at, time_in_at - LAG(time_in_at) OVER (ORDER BY time_in_at) AS gap '
+                                 'FROM events WHERE time_in_at IS NOT NULL) '
+                                 'WHERE gap IS NULL OR gap >= ?', (RACE_GAP,)).fetchone()[0]
+    return day if first is None else datetime.datetime.fromtimestamp(first)
+
+
+def export_filter(table, args):
+    """WHERE clause and params for the from/to (HH:mm) and location args"""
+    clocks = {}
+    for arg in ('from', 'to'):
+        clock = args.get(arg, '').strip()
+        if clock:
+            matches = CLOCK_TIME_PATTERN.match(clock)
+            hour, minute = (int(matches.group(1)), int(matches.group(2))) if matches else (None, None)
+            if not matches or hour >= 24 or minute >= 60:
+                raise ValueError(f'{arg} must be HH:mm, got {clock!r}')
+            clocks[arg] = datetime.time(hour, minute)
+    where = []
+    params = []
+    column = EXPORT_ORDER_COLUMNS[table]
+    if column == 'time_in_at' and clocks:
+        # Events are compared by their unix time stamps, both clocks on the day the race began
+        start = race_start()
+        opens = datetime.datetime.combine(start.date(), clocks['from']) if 'from' in clocks else start
+        where.append(f'{column} >= ?')
+        params.append(int(opens.timestamp()))
+        if 'to' in clocks:
+            closes = datetime.datetime.combine(start.date(), clocks['to'])
+            if closes < opens:
+                closes += datetime.timedelta(days=1) # Past midnight, e.g. 23:00 to 01:00
+            where.append(f'{column} <= ?')
+            params.append(int(closes.timestamp()))
+    else:
+        # Observations by their text clock
+        for arg, op in (('from', '>='), ('to', '<=')):
+            if arg in clocks:
+                where.append(f'{column} {op} ?')
+                params.append(clocks[arg].strftime('%H:%M'))
+    location = args.get('location', '').strip()
+    if location:
+        where.append('location = ?')
+        params.append(location)
+    return ' AND '.join(where) or None, params
+
+
+def csv_chunks(table, where_clause=None, params=()):
+    """Yield table as CSV text, one batch of rows per chunk"""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    header = True
+    for columns, rows in iter_batches(table, where_clause, params, order_by=EXPORT_ORDER_COLUMNS[table],
+                                      batch_size=EXPORT_BATCH_SIZE):
+        if header:
+            writer.writerow(columns)
+            header = False
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        eventlet.sleep(0) # Let other consoles in between batches
+    if header:
+        yield ','.join(table_columns(table)) + '\r\n'
+
+
+def write_xlsx(path, table, where_clause=None, params=()):
+    """Write table to an XLSX file at path, starting a new sheet when one fills"""
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    bold = workbook.add_format({'bold': True})
+    worksheet = None
+    row_num = XLSX_MAX_ROWS
+    sheets = 0
+    columns = table_columns(table)
+    for columns, rows in iter_batches(table, where_clause, params, order_by=EXPORT_ORDER_COLUMNS[table],
+                                      batch_size=EXPORT_BATCH_SIZE):
+        for row in rows:
+            if row_num == XLSX_MAX_ROWS:
+                sheets += 1
+                worksheet = workbook.add_worksheet(table if sheets == 1 else f'{table} {sheets}')
+                worksheet.write_row(0, 0, columns, bold)
+                row_num = 0
+            row_num += 1
+            worksheet.write_row(row_num, 0, row)
+        eventlet.sleep(0) # Let other consoles in between batches
+    if worksheet is None:
+        workbook.add_worksheet(table).write_row(0, 0, columns, bold)
+    # Zipping up the workbook takes seconds on a full race day, so keep it off the hub
+    eventlet.tpool.execute(workbook.close)
+
+
+def file_chunks(path, chunk_size=64 * 1024):
+    """Yield a temporary file's contents, removing it once sent"""
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def export_name(table, extension):
+    return f"{table}-{datetime.datetime.now().strftime('%Y%m%d-%H%M')}.{extension}"
+
+
+# *====================================================================*
+#         SERVER-SIDE PAGING
+# *====================================================================*
+# DataTables server-side processing: the browser asks for one sorted,
+# filtered page at a time.  Searches are a case-insensitive prefix match
+# on these columns, each backed by a NOCASE index.
+SEARCH_COLUMNS = {
+    'events': ('bib', 'location'),
+    'observations': ('bib', 'location', 'category'),
+}
+# Full-text index a table's search box also matches, see migration 10
+FULL_TEXT_INDEXES = {
+    'events': 'events_fts',
+}
+MAX_PAGE_LENGTH = getattr(Config, 'MAX_PAGE_LENGTH', 1000)
+
+# Table sizes, recounted only when the revision moves
+row_counts = {}
+
+
+def datatables_page(table):
+    """Answer a DataTables server-side request (draw/start/length/order/search)"""
+    args = request.args
+    columns = table_columns(table)
+
+    order = []
+    i = 0
+    while f'order[{i}][column]' in args:
+        index = args.get(f'order[{i}][column]', type=int)
+        name = args.get(f'columns[{index}][data]')
+        if table == 'events':
+            name = EVENT_STAMPS.get(name, name) # HH:mm sorts wrong across midnight
+        if name in columns and args.get(f'columns[{index}][orderable]', 'true') == 'true':
+            order.append((name, args.get(f'order[{i}][dir]', 'asc').lower() == 'desc'))
+        i += 1
+
+    start = max(args.get('start', 0, type=int), 0)
+    length = args.get('length', 10, type=int)
+    if length < 0 or length > MAX_PAGE_LENGTH:
+        length = MAX_PAGE_LENGTH
+    search = args.get('search[value]', '').strip()
+
+    # A station's console only lists the locations it covers
+    locations = console_locations(current_user)
+    within = (LOCATION_COLUMNS[table], locations) if locations else None
+
+    revision = current_revision(table)
+    counted = row_counts.get(table) if within is None else None
+    records_total = counted[1] if counted and counted[0] == revision else None
+    full_text = (FULL_TEXT_INDEXES[table], fts_query(search)) if table in FULL_TEXT_INDEXES and search else None
+    records_total, records_filtered, rows = page_table(
+        table, start=start, length=length, order=order, search=search,
+        search_columns=SEARCH_COLUMNS[table], records_total=records_total, within=within, full_text=full_text)
+    if within is None:
+        row_counts[table] = (revision, records_total)
+
+    return {
+        'draw': args.get('draw', 0, type=int),
+        'recordsTotal': records_total,
+        'recordsFiltered': records_filtered,
+        'data': rows,
+        'revision': revision
+    }
+
+# *====================================================================*
+#         LOOKUPS
+# *====================================================================*
+# Select options for the consoles come from the lookup tables.  Each is
+# serialized once per process and served with a strong ETag, so a
+# console revalidates with If-None-Match and gets 304 Not Modified
+# until net control changes the course layout.  Writes to a lookup table
+# are logged in change_log, so every worker sees its cached copy is stale.
+LOOKUP_TABLES = ('locations', 'agencies', 'observations_categories')
+LOOKUP_MAX_AGE = getattr(Config, 'LOOKUP_MAX_AGE', 0)
+
+# Lookup table -> (revision, etag, JSON body)
+lookup_cache = {}
+
+
+def lookup_options(table):
+    """Active options for a lookup table as (etag, JSON body), cached"""
+    revision = current_revision(table)
+    cached = lookup_cache.get(table)
+    if cached is None or cached[0] != revision:
+        rows = zip_table(table, 'active = 1')['data']
+        options = [{'label': row['display'] or row['value'], 'value': row['value']} for row in rows]
+        body = json.dumps({'table': table, 'options': options}, separators=(',', ':')).encode()
+        cached = lookup_cache[table] = (revision, hashlib.sha1(body).hexdigest(), body)
+    return cached[1:]
+
+
+def invalidate_lookup(table):
+    """Drop the cached options for table and tell consoles to refetch them"""
+    lookup_cache.pop(table, None)
+    send_sio_msg('lookups_changed', {'table': table})
+
 
 # *====================================================================*
 #         ROUTES
@@ -336,6 +1464,19 @@ def admin():
         elif 'remove-observations' in request.form:
             remove_all_rows('observations')
             return f'All observations removed.'
+        elif 'archive-events' in request.form:
+            return job_message('archive', start_archive('events'))
+        elif 'archive-observations' in request.form:
+            try:
+                return job_message('archive', start_archive('observations', request.form.get('before', '').strip()))
+            except ValueError as e:
+                return str(e)
+        elif 'snapshot' in request.form:
+            return job_message('snapshot', start_snapshot())
+        elif 'rebuild-summary' in request.form:
+            return f'Observation summary rebuilt with {rebuild_observation_summary()} buckets.'
+        elif 'verify-summary' in request.form:
+            return jsonify({ 'mismatched': rebuild_observation_summary(verify=True) })
         else:
             return 'I am not a teapot.'
 
@@ -388,94 +1529,57 @@ def chat():
 
 
 
+# Every pooled connection stayed busy past DATABASE_POOL_TIMEOUT; the
+# client may try again shortly
+@app.errorhandler(PoolTimeout)
+def pool_timeout(e):
+    return jsonify({ 'error': 'The server is busy, please try again' }), 503, {'Retry-After': '1'}
+
+
 # *====================================================================*
 #         API
 # *====================================================================*
 @app.route('/api/events', methods=['GET', 'POST'])
 @app.route('/api/events/', methods=['GET', 'POST'])
-@app.route('/api/events/<event_id>', methods=['GET', 'POST'])
+@app.route('/api/events/<int:event_id>', methods=['GET', 'POST'])
 @login_required
 def api_events(event_id=None):
 
     if request.method == 'GET':
-        if event_id is not None:
-            event_id = f'ID={id}'
-        
-        data = zip_table(table_name='events', where_clause=event_id)
-        return jsonify(data)
+        if 'draw' in request.args:
+            return jsonify(datatables_page('events'))
+
+        since = request.args.get('since', type=int)
+        if since is not None:
+            return jsonify(changes_since('events', since))
+
+        # Answer an unchanged revision before touching the table
+        revision = current_revision('events')
+        etag = revision_etag('events', revision, event_id)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        if event_id is None:
+            return conditional(stream_response(json_listing('events', revision=revision)), etag)
+
+        data = zip_table(table_name='events', where_clause=f'id={event_id}')
+        data['revision'] = revision
+        return conditional(jsonify(data), etag)
 
     if request.method == 'POST':
-        
+
         # Validate the post request
         if 'action' not in request.form:
             return jsonify({ 'error': 'Ahhh I dont know what to do, please provide an action'})
 
-        action = request.form['action']
-
-        pattern = r'\[(\d+)\]\[([a-zA-Z_]+)\]'
-        data = {}
-        id = 0
-        query = ""
-
-        for key in request.form.keys():
-            print(f"Key: {key}", file=sys.stderr)
-            matches = re.search(pattern, key)
-            if matches:
-                id = int(matches.group(1))
-                field_key = matches.group(2)
-                data[field_key] = request.form[key]
-
-        # Handle Editing an existing record
-        if action.lower() == 'edit':
-
-            set_elem = []
-            for col in data.keys():
-                set_elem.append(f" {col}='{data[col]}'")
-
-            query = f"UPDATE events SET {', '.join(set_elem)} WHERE ID={id}"
-
-            print(f"Query: {query}", file=sys.stderr)
-            with sqlite3.connect(Config.DATABASE_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query)
-                conn.commit()
-            
-            new_data = zip_table(table_name='events', where_clause=f'ID={id}')
-            jnew_data = jsonify(new_data)
-            send_sio_msg('edit_events', jnew_data)
-            return jnew_data
-
-        # Handle Creating a new record
-        if action.lower() == 'create':
-            col_elem = data.keys()
-            val_elem = []
-            for col in col_elem:
-                val_elem.append(f"'{data[col]}'")
-
-            query = f"INSERT INTO EVENTS ( {', '.join(col_elem) }) VALUES ({ ', '.join(val_elem) })"
-            with sqlite3.connect(Config.DATABASE_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query)
-                id = cursor.lastrowid
-                conn.commit()
-            new_data = zip_table(table_name='events', where_clause=f'ID={id}')
-            jnew_data = jsonify(new_data)
-            send_sio_msg('new_event', jnew_data)
-            return jnew_data
-
-        # Handle Remove
-        if action.lower() == 'remove':
-            with sqlite3.connect(Config.DATABASE_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute(f"DELETE FROM events WHERE id={id}")
-                conn.commit()
-            
-            new_data = zip_table(table_name='events', where_clause=f'ID={id}')
-            jnew_data = jsonify(new_data)
-            send_sio_msg('remove_events', jnew_data)
-            return jnew_data
-
-
+        action = request.form['action'].lower()
+        if action in ('create', 'edit', 'remove'):
+            rows = parse_editor_form(request.form)
+            try:
+                return jsonify(editor_action('events', action, rows, client_request_id()))
+            except ValueError as e:
+                return jsonify({ 'error': str(e) })
 
     return jsonify("Oh no, you should never be here...")
 
@@ -485,122 +1589,660 @@ def api_events(event_id=None):
 # *====================================================================*
 @app.route('/api/observations', methods=['GET', 'POST'])
 @app.route('/api/observations/', methods=['GET', 'POST'])
-@app.route('/api/observations/<event_id>', methods=['GET', 'POST'])
+@app.route('/api/observations/<int:observation_id>', methods=['GET', 'POST'])
 @login_required
 def api_observations(observation_id=None):
 
     if request.method == 'GET':
-        if observation_id is not None:
-            observation_id = f'ID={id}'
-        
-        data = zip_table(table_name='observations', where_clause=observation_id)
-        return jsonify(data)
+        if 'draw' in request.args:
+            return jsonify(datatables_page('observations'))
+
+        since = request.args.get('since', type=int)
+        if since is not None:
+            return jsonify(changes_since('observations', since))
+
+        # Answer an unchanged revision before touching the table
+        revision = current_revision('observations')
+        etag = revision_etag('observations', revision, observation_id)
+        cached = not_modified(etag)
+        if cached:
+            return cached
+
+        if observation_id is None:
+            return conditional(stream_response(json_listing('observations', revision=revision)), etag)
+
+        data = zip_table(table_name='observations', where_clause=f'id={observation_id}')
+        data['revision'] = revision
+        return conditional(jsonify(data), etag)
 
     if request.method == 'POST':
-        
+
         # Validate the post request
         if 'action' not in request.form:
             return jsonify({ 'error': 'Ahhh I dont know what to do, please provide an action'})
 
-        action = request.form['action']
-
-        pattern = r'\[(\d+)\]\[([a-zA-Z_]+)\]'
-        data = {}
-        id = 0
-        query = ""
-
-        for key in request.form.keys():
-            print(f"Key: {key}", file=sys.stderr)
-            matches = re.search(pattern, key)
-            if matches:
-                id = int(matches.group(1))
-                field_key = matches.group(2)
-                data[field_key] = request.form[key]
-
-        # Handle Editing an existing record
-        if action.lower() == 'edit':
-
-            set_elem = []
-            for col in data.keys():
-                set_elem.append(f" {col}='{data[col]}'")
-
-            query = f"UPDATE observations SET {', '.join(set_elem)} WHERE ID={id}"
-
-            print(f"Query: {query}", file=sys.stderr)
-            with sqlite3.connect(Config.DATABASE_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query)
-                conn.commit()
-            
-            new_data = zip_table(table_name='observations', where_clause=f'ID={id}')
-            jnew_data = jsonify(new_data)
-            send_sio_msg('edit_observations', jnew_data)
-            return jnew_data
-
-        # Handle Creating a new record
-        if action.lower() == 'create':
-            col_elem = data.keys()
-            val_elem = []
-            for col in col_elem:
-                val_elem.append(f"'{data[col]}'")
-
-            query = f"INSERT INTO observations ( {', '.join(col_elem) }) VALUES ({ ', '.join(val_elem) })"
-            with sqlite3.connect(Config.DATABASE_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query)
-                id = cursor.lastrowid
-                conn.commit()
-            new_data = zip_table(table_name='observations', where_clause=f'ID={id}')
-            jnew_data = jsonify(new_data)
-            send_sio_msg('new_observation', jnew_data)
-            return jnew_data
-
-        # Handle Remove
-        if action.lower() == 'remove':
-            with sqlite3.connect(Config.DATABASE_PATH) as conn:
-                cursor = conn.cursor()
-                cursor.execute(f"DELETE FROM observations WHERE id={id}")
-                conn.commit()
-            
-            new_data = zip_table(table_name='observations', where_clause=f'ID={id}')
-            jnew_data = jsonify(new_data)
-            send_sio_msg('remove_observations', jnew_data)
-            return jnew_data
+        action = request.form['action'].lower()
+        if action in ('create', 'edit', 'remove'):
+            rows = parse_editor_form(request.form)
+            try:
+                return jsonify(editor_action('observations', action, rows, client_request_id()))
+            except ValueError as e:
+                return jsonify({ 'error': str(e) })
+
+    return jsonify("Oh no, you should never be here...")
+
+# *--------------------------------------------------------------------*
+#         Replay
+# *--------------------------------------------------------------------*
+# A console that lost its connection queues its writes, each with its
+# request id, and sends them all here once it is back.  They are applied
+# in order in one transaction; a write already applied (its first
+# attempt got through after all) is answered from its stored result.
+REPLAY_MAX_WRITES = getattr(Config, 'REPLAY_MAX_WRITES', 500)
+
+
+def replay_plan(write):
+    """(table, action, rows, statements) for one queued write; ValueError if it is not valid"""
+    if not isinstance(write, dict):
+        raise ValueError('Each write must be an object')
+    table, action, data = write.get('table'), str(write.get('action', '')).lower(), write.get('data')
+    if table not in SYNC_TABLES:
+        raise ValueError(f'Unknown table {table!r}')
+    if action not in ('create', 'edit', 'remove'):
+        raise ValueError(f'Unknown action {action!r}')
+    if not isinstance(data, dict) or not all(isinstance(fields, dict) for fields in data.values()):
+        raise ValueError('data must map row ids to fields')
+    try:
+        rows = {int(id): fields for id, fields in data.items()}
+    except ValueError:
+        raise ValueError('Row ids must be numbers')
+    return table, action, rows, editor_statements(table, action, rows)
 
 
+@app.route('/api/replay', methods=['POST'])
+@login_required
+def api_replay():
+    """Apply a batch of queued Editor writes, {"writes": [{request_id, table, action, data}]}"""
+    body = request.get_json(silent=True)
+    writes = body.get('writes') if isinstance(body, dict) else None
+    if not isinstance(writes, list):
+        return jsonify({ 'error': 'Send {"writes": [...]}' })
+    if len(writes) > REPLAY_MAX_WRITES:
+        return jsonify({ 'error': f'At most {REPLAY_MAX_WRITES} writes per replay' })
+
+    results = []
+    published = []
+    with db_connect(write=True) as conn:
+        cursor = conn.cursor()
+        for write in writes:
+            request_id = write.get('request_id') if isinstance(write, dict) else None
+            try:
+                table, action, rows, statements = replay_plan(write)
+            except ValueError as e:
+                results.append({'request_id': request_id, 'error': str(e)})
+                continue
+
+            stored = stored_result(cursor, request_id) if request_id else None
+            if stored is not None:
+                WRITES_REPLAYED.inc(table=table)
+                results.append({'request_id': request_id, **stored})
+                continue
+
+            # A write SQLite rejects is reported without undoing the others
+            cursor.execute('SAVEPOINT replay_write')
+            try:
+                changes = apply_editor_rows(cursor, table, action, rows, statements)
+            except sqlite3.IntegrityError as e:
+                cursor.execute('ROLLBACK TO replay_write')
+                cursor.execute('RELEASE replay_write')
+                results.append({'request_id': request_id, 'error': str(e)})
+                continue
+            cursor.execute('RELEASE replay_write')
+            result = {'data': [row for id, revision, old, row, buckets in changes if row is not None]}
+            if request_id:
+                store_result(cursor, request_id, table, result)
+            published.append((table, action, changes))
+            results.append({'request_id': request_id, **result})
+
+    for table, action, changes in published:
+        publish_changes(table, action, changes)
+    return jsonify({ 'results': results })
 
-    return jsonify("Oh no, you should never be here...")
+
+# *--------------------------------------------------------------------*
+#         Bulk Observations
+# *--------------------------------------------------------------------*
+BULK_MAX_ROWS = getattr(Config, 'BULK_MAX_ROWS', 50000)
+CLOCK_TIME_PATTERN = re.compile(r'^(\d{1,2}):(\d{2})(:\d{2}(\.\d+)?)?$')
+
+
+def read_bulk_rows():
+    """Observation dicts from a JSON array, NDJSON, or a CSV/XLSX upload"""
+    upload = request.files.get('file')
+    if upload is not None:
+        name = secure_filename(upload.filename or '').lower()
+        if name.endswith('.xls'):
+            # Reading the old binary format needs xlrd, which we do not ship
+            raise ValueError('.xls workbooks are not supported, save the sheet as .xlsx or .csv')
+        if name.endswith('.xlsx'):
+            try:
+                frame = pd.read_excel(upload, dtype=str, engine='openpyxl')
+            except (ValueError, KeyError, OSError, zipfile.BadZipFile) as e:
+                raise ValueError(f'Could not read {name} as an .xlsx workbook') from e
+        else:
+            frame = pd.read_csv(upload, dtype=str, keep_default_na=False)
+        frame = frame.fillna('')
+        frame.columns = [str(col).strip().lower() for col in frame.columns]
+        rows = frame.to_dict('records')
+    elif request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        rows = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+    elif request.mimetype == 'text/csv':
+        frame = pd.read_csv(BytesIO(request.get_data()), dtype=str, keep_default_na=False)
+        frame.columns = [str(col).strip().lower() for col in frame.columns]
+        rows = frame.to_dict('records')
+    else:
+        rows = request.get_json(silent=True)
+        if isinstance(rows, dict):
+            rows = rows.get('data')
+
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError('Send a JSON array of observations, NDJSON, or a CSV/XLSX file')
+    if len(rows) > BULK_MAX_ROWS:
+        raise ValueError(f'At most {BULK_MAX_ROWS} observations per batch')
+
+    for n, row in enumerate(rows, start=1):
+        for col, value in row.items():
+            if value is not None and not isinstance(value, (str, int, float)):
+                raise ValueError(f'Row {n}: {col} must be a single value, got {type(value).__name__}')
+        clock = str(row.get('time') or '').strip()
+        matches = CLOCK_TIME_PATTERN.match(clock)
+        if not matches or int(matches.group(1)) >= 24 or int(matches.group(2)) >= 60:
+            raise ValueError(f'Row {n}: time must be HH:mm, got {clock!r}')
+        row['time'] = f'{int(matches.group(1)):02d}:{matches.group(2)}'
+    return rows
+
+
+@app.route('/api/observations/summary')
+@login_required
+def api_observations_summary():
+    revision = current_revision('observations')
+    etag = revision_etag('observation_counts', revision)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    data = observation_summary(location=request.args.get('location'), since_bucket=request.args.get('since_bucket'))
+    data['revision'] = revision
+    return conditional(jsonify(data), etag)
+
+
+@app.route('/api/observations/bulk', methods=['POST'])
+@login_required
+def api_observations_bulk():
+    try:
+        rows = read_bulk_rows()
+        if not rows:
+            return jsonify({ 'count': 0 })
+        return jsonify(bulk_insert('observations', rows))
+    except (ValueError, pd.errors.ParserError) as e:
+        return jsonify({ 'error': str(e) }), 400
+
+@app.route('/api/lookups/<table>', methods=['GET', 'POST'])
+@login_required
+def api_lookups(table):
+    if table not in LOOKUP_TABLES:
+        abort(404)
+
+    if request.method == 'POST':
+        if not current_user.is_admin:
+            abort(403)
+        if 'action' not in request.form:
+            return jsonify({ 'error': 'Ahhh I dont know what to do, please provide an action'})
+
+        action = request.form['action'].lower()
+        if action not in ('create', 'edit', 'remove'):
+            return jsonify("Oh no, you should never be here...")
+        try:
+            result = editor_action(table, action, parse_editor_form(request.form), client_request_id())
+        except ValueError as e:
+            return jsonify({ 'error': str(e) })
+        invalidate_lookup(table)
+        return jsonify(result)
+
+    etag, body = lookup_options(table)
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.private = True
+    if LOOKUP_MAX_AGE:
+        response.cache_control.max_age = LOOKUP_MAX_AGE
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/events/escalations')
+@login_required
+def api_events_escalations():
+    return jsonify(escalations.snapshot(unresolved_events()[1]))
+
+
+@app.route('/api/events/analytics')
+@login_required
+def api_events_analytics():
+    revision = current_revision('events')
+    etag = revision_etag('events-analytics', revision)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    cached = response_cache.get('events')
+    if cached is None or cached[0] != revision:
+        with db_connect() as conn:
+            cached = response_cache['events'] = (revision, response_times(conn))
+    return conditional(jsonify({**cached[1], 'revision': revision}), etag)
+
+
+@app.route('/api/events/search')
+@login_required
+def api_events_search():
+    """Events whose notes, location or reporter match q, best match first"""
+    query = fts_query(request.args.get('q', ''))
+    if query is None:
+        return jsonify({ 'error': 'Give some words to search for in q' }), 400
+    start = max(request.args.get('start', 0, type=int), 0)
+    length = request.args.get('length', 25, type=int)
+    if length < 0 or length > MAX_PAGE_LENGTH:
+        length = MAX_PAGE_LENGTH
+
+    locations = console_locations(current_user)
+    within = (LOCATION_COLUMNS['events'], locations) if locations else None
+    revision = current_revision('events')
+    records_filtered, rows = search_table('events', FULL_TEXT_INDEXES['events'], query, start, length, within)
+    return jsonify({'query': query, 'recordsFiltered': records_filtered, 'start': start, 'length': length,
+                    'data': rows, 'revision': revision})
+
+
+@app.route('/api/bib/<bib>')
+@login_required
+def api_bib(bib):
+    key, timeline = bib_timeline(bib)
+    if key is None:
+        return jsonify({ 'error': 'Give a bib to look up' }), 400
+    return jsonify({'bib': key, 'data': timeline})
+
+
+@app.route('/api/events/export', defaults={'table': 'events'})
+@app.route('/api/observations/export', defaults={'table': 'observations'})
+@login_required
+def api_export(table):
+    export_format = request.args.get('format', 'csv').lower()
+    try:
+        where_clause, params = export_filter(table, request.args)
+    except ValueError as e:
+        return jsonify({ 'error': str(e) }), 400
+
+    if export_format == 'csv':
+        headers = {'Content-Disposition': f'attachment; filename={export_name(table, "csv")}'}
+        return Response(csv_chunks(table, where_clause, params), mimetype='text/csv', headers=headers)
+
+    if export_format == 'xlsx':
+        fd, path = tempfile.mkstemp(suffix='.xlsx')
+        os.close(fd)
+        try:
+            write_xlsx(path, table, where_clause, params)
+        except Exception:
+            os.remove(path)
+            raise
+        headers = {'Content-Disposition': f'attachment; filename={export_name(table, "xlsx")}',
+                   'Content-Length': str(os.path.getsize(path))}
+        return Response(file_chunks(path), headers=headers,
+                        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+
+    return jsonify({ 'error': f'Unknown export format: {export_format}' }), 400
 
 # Remove all rows from the table
 def remove_all_rows(table):
-    with sqlite3.connect(Config.DATABASE_PATH) as conn:
+    with db_connect(write=True) as conn:
         cursor = conn.cursor()
         cursor.execute(f'DELETE FROM {table}')
-        conn.commit()
-    
+        if table == 'observations':
+            cursor.execute('DELETE FROM observation_counts')
+        if table in SYNC_TABLES:
+            revision = log_change(cursor, table, 'reset')
+    if table in SYNC_TABLES:
+        broadcast_change(table, 'reset', None, revision)
+    if table in BIB_TABLES:
+        bib_index.clear(table, revision)
+    if table == 'observations':
+        broadcast_summary(revision, reset=True)
+    if table == 'events':
+        escalations.poke()
+
+
+# *====================================================================*
+#         SNAPSHOTS & ARCHIVE
+# *====================================================================*
+# Both run as background tasks that give way to the consoles as they go.
+# A snapshot copies the database with the online backup API a few pages
+# a step.  Archiving moves rows into the archive database a batch per
+# write transaction, each batch logged and broadcast as removes, so the
+# live tables stay small and nothing is thrown away.  Progress is kept
+# per worker and read back from /api/snapshot and /api/archive.
+DATABASE_DIR = os.path.dirname(os.path.abspath(Config.DATABASE_PATH))
+SNAPSHOT_DIR = getattr(Config, 'SNAPSHOT_DIR', os.path.join(DATABASE_DIR, 'snapshots'))
+ARCHIVE_PATH = getattr(Config, 'ARCHIVE_PATH', '{}-archive{}'.format(*os.path.splitext(Config.DATABASE_PATH)))
+ARCHIVE_BATCH_SIZE = getattr(Config, 'ARCHIVE_BATCH_SIZE', 200)
+
+# Table -> rows that may be archived; events still being worked stay put.
+# Observations need a cutoff day: those created or edited since, going by
+# change_log, stay, and the cutoff may not be later than today, so the
+# race being run is never archived from under the consoles.
+ARCHIVE_WHERE = {
+    'events': f'NOT {UNRESOLVED_EVENTS}',
+    'observations': '1',
+}
+ARCHIVE_NEEDS_CUTOFF = ('observations',)
+
+ARCHIVED_ROWS = Counter('ndart_archived_rows_total', 'Rows moved to the archive database', labels=('table',))
+
+# Job name -> its progress
+jobs = {}
+
+
+def start_job(name, fn, **details):
+    """Run fn(job) as a background task; None if name is already running"""
+    job = jobs.get(name)
+    if job and job['running']:
+        return None
+    job = jobs[name] = {'running': True, 'started_at': time.time(), 'finished_at': None, 'error': None, **details}
+
+    def run():
+        try:
+            fn(job)
+        except Exception as e:
+            job['error'] = str(e)
+            print(f"{name} failed: {e}", file=sys.stderr)
+        finally:
+            job['running'] = False
+            job['finished_at'] = time.time()
+
+    socketio.start_background_task(run)
+    return job
+
+
+def take_snapshot(job):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+
+    def progress(remaining, total):
+        job['pages'], job['remaining'] = total, remaining
+        eventlet.sleep(0)
+
+    snapshot(job['path'], progress=progress)
+
+
+def archive_columns(cursor, table):
+    """Create or widen archive.<table> to hold every column of table"""
+    columns = table_columns(table)
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS archive.{table} (
+                       id INTEGER PRIMARY KEY,
+                       archived_at REAL NOT NULL
+                    )''')
+    existing = {column[1] for column in cursor.execute(f'PRAGMA archive.table_info({table})')}
+    for column in columns:
+        if column not in existing:
+            cursor.execute(f'ALTER TABLE archive.{table} ADD {column}')
+    return columns
+
+
+def archive_batch(table, where, params, after, upto):
+    """Move the next batch of rows with after < id <= upto; returns their ids
+
+    SQLite does not commit WAL databases together atomically, so a crash
+    may leave a batch in both; archiving it again replaces the copy.
+    """
+    with db_connect(write=True, attach={'archive': ARCHIVE_PATH}) as conn:
+        cursor = conn.cursor()
+        columns = ', '.join(archive_columns(cursor, table))
+        cursor.execute(f'SELECT id FROM main.{table} WHERE id > ? AND id <= ? AND {where} ORDER BY id LIMIT ?',
+                       (after, upto, *params, ARCHIVE_BATCH_SIZE))
+        ids = [row[0] for row in cursor.fetchall()]
+        if not ids:
+            return ids
+        placeholders = ', '.join('?' * len(ids))
+        cursor.execute(f'SELECT * FROM main.{table} WHERE id IN ({placeholders}) ORDER BY id', ids)
+        rows = [dict(zip(cursor_columns(cursor), values)) for values in cursor.fetchall()]
+        cursor.execute(f'''INSERT OR REPLACE INTO archive.{table} ({columns}, archived_at)
+                           SELECT {columns}, ? FROM main.{table} WHERE id IN ({placeholders})''', (time.time(), *ids))
+        cursor.execute(f'DELETE FROM main.{table} WHERE id IN ({placeholders})', ids)
+        first_revision = log_changes(cursor, table, 'remove', ids)
+
+        buckets = None
+        if table == 'observations':
+            deltas = {}
+            for row in rows:
+                for key, change in summary_deltas(row, None).items():
+                    deltas[key] = deltas.get(key, 0) + change
+            buckets = tally_observations(cursor, deltas)
+    changes = [(row['id'], first_revision + n, row, None, None) for n, row in enumerate(rows)]
+    changes[-1] = changes[-1][:4] + (buckets,)
+    publish_changes(table, 'remove', changes)
+    ARCHIVED_ROWS.inc(len(ids), table=table)
+    return ids
+
+
+def archive_rows(job):
+    """Move every archivable row of the job's table that existed when it started"""
+    table = job['table']
+    where, params = ARCHIVE_WHERE[table], []
+    with db_connect() as conn:
+        upto = conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {table}').fetchone()[0]
+        if job.get('before') and table == 'events':
+            where += ' AND time_in_at < ?'
+            params.append(job['before'])
+        elif job.get('before'):
+            # Revisions only grow, so every change since the cutoff is at or after the first one logged then
+            changed_at = datetime.datetime.fromtimestamp(job['before'], datetime.timezone.utc)
+            boundary = conn.execute('''SELECT COALESCE(MIN(revision), ?) FROM change_log
+                                       WHERE table_name = ? AND changed_at >= ?''',
+                                    (current_revision(table) + 1, table,
+                                     changed_at.strftime('%Y-%m-%d %H:%M:%S'))).fetchone()[0]
+            where += f''' AND id NOT IN (SELECT row_id FROM change_log
+                                         WHERE table_name = '{table}' AND revision >= ? AND row_id IS NOT NULL)'''
+            params.append(boundary)
+    after = 0
+    while True:
+        ids = archive_batch(table, where, params, after, upto)
+        if not ids:
+            break
+        after = ids[-1]
+        job['archived'] += len(ids)
+        eventlet.sleep(0) # Let the live writers in between batches
+
+
+def start_snapshot():
+    name = f"ndart-{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+    return start_job('snapshot', take_snapshot, path=os.path.join(SNAPSHOT_DIR, name), pages=None, remaining=None)
+
+
+def start_archive(table, before=None):
+    """Start archiving table; before (YYYY-MM-DD) keeps rows from that day on
+
+    Raises ValueError for a table or date that cannot be archived.
+    """
+    if table not in ARCHIVE_WHERE:
+        raise ValueError(f'Cannot archive {table}')
+    if not before and table in ARCHIVE_NEEDS_CUTOFF:
+        raise ValueError(f'Archiving {table} needs a before date')
+    cutoff = None
+    if before:
+        try:
+            day = datetime.date.fromisoformat(before)
+        except ValueError:
+            raise ValueError(f'before must be YYYY-MM-DD, got {before!r}')
+        if table in ARCHIVE_NEEDS_CUTOFF and day > datetime.date.today():
+            raise ValueError(f'{table} changed today cannot be archived; before may be today at the latest')
+        cutoff = int(datetime.datetime.combine(day, datetime.time()).timestamp())
+    return start_job('archive', archive_rows, table=table, before=cutoff, archived=0, path=ARCHIVE_PATH)
+
+
+def job_message(name, job):
+    """What the admin page shows for a job it started"""
+    if job is None:
+        return f'A {name} is already running, see /api/{name}.'
+    return f"{name.capitalize()} started, writing to {job['path']}; see /api/{name} for progress."
+
+
+def job_response(name, job):
+    if job is None:
+        return jsonify({ 'error': f'A {name} is already running', **jobs[name] }), 409
+    return jsonify(job), 202
+
+
+@app.route('/api/snapshot', methods=['GET', 'POST'])
+@login_required
+def api_snapshot():
+    if not current_user.is_admin:
+        abort(403)
+    if request.method == 'POST':
+        return job_response('snapshot', start_snapshot())
+    return jsonify(jobs.get('snapshot') or {})
+
+
+@app.route('/api/archive', methods=['GET', 'POST'])
+@login_required
+def api_archive():
+    if not current_user.is_admin:
+        abort(403)
+    if request.method == 'POST':
+        try:
+            job = start_archive(request.form.get('table', ''), request.form.get('before', '').strip() or None)
+        except ValueError as e:
+            return jsonify({ 'error': str(e) }), 400
+        return job_response('archive', job)
+    return jsonify(jobs.get('archive') or {})
+
+
+# *====================================================================*
+#         METRICS
+# *====================================================================*
+# Request latency per route, plus whatever db.py and the Socket.IO
+# emits record, in the Prometheus text format.  Scrapers send
+# METRICS_TOKEN as a bearer token instead of logging in; behind a reverse
+# proxy every request comes from its address, so addresses prove nothing.
+# An admin can run the sampling profiler for a while to see where a busy
+# worker spends its time.
+METRICS_TOKEN = getattr(Config, 'METRICS_TOKEN', None)
+PROFILE_MAX_SECONDS = getattr(Config, 'PROFILE_MAX_SECONDS', 300)
+
+REQUEST_SECONDS = Histogram('ndart_request_seconds', 'Time to handle a request, until its response starts',
+                            labels=('route', 'method', 'status'))
+REQUESTS_IN_FLIGHT = Gauge('ndart_requests_in_flight', 'Requests being handled')
+
+profiler = Profiler()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+
+@app.after_request
+def record_request(response):
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(time.perf_counter() - started, route=route, method=request.method,
+                                status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_request(exc):
+    # Socket.IO handlers get a request context but never start the timer
+    if g.pop('request_started', None) is not None:
+        REQUESTS_IN_FLIGHT.dec()
+
+
+def metrics_token_valid():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return bool(METRICS_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(token.strip(), METRICS_TOKEN)
+
+
+@app.route('/metrics')
+def metrics():
+    if not (metrics_token_valid() or (current_user.is_authenticated and current_user.is_admin)):
+        abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/metrics/profile', methods=['GET', 'POST'])
+@login_required
+def api_metrics_profile():
+    """Start or stop the profiler (POST action=start|stop), or GET its collapsed stacks"""
+    if not current_user.is_admin:
+        abort(403)
+    if request.method == 'POST':
+        action = request.form.get('action', '').lower()
+        if action == 'start':
+            seconds = min(request.form.get('seconds', 30, type=float), PROFILE_MAX_SECONDS)
+            interval = max(request.form.get('interval', 0.005, type=float), 0.001)
+            if not profiler.start(interval=interval, seconds=seconds):
+                return jsonify({ 'error': 'The profiler is already running' })
+        elif action == 'stop':
+            profiler.stop()
+        else:
+            return jsonify({ 'error': 'Ahhh I dont know what to do, please provide an action'})
+        return jsonify(profiler.status())
+    return Response(profiler.collapsed(), mimetype='text/plain')
+
 
 # *====================================================================*
 #         SocketIO API
 # *====================================================================*
-# Handler for a message recieved over 'connect' channel
+# Handler for a message recieved over 'connect' channel; changes carry
+# whole rows, so only logged in users may listen
 @socketio.on('connect', namespace="/api")
 def test_connect():
+    if not current_user.is_authenticated:
+        return False
+    for room in console_rooms(current_user):
+        join_room(room)
     emit('after connect',  {'data':'Lets dance'})
 
+@socketio.on('disconnect', namespace="/api")
+def api_disconnect(*args):
+    broadcaster.forget(request.sid)
+
+# Queued for the broadcaster's next batch rather than sent from the request;
+# room may be a tuple of rooms, each console in any of them getting it once
 def send_sio_msg(msg_type, msg, room=None):
-    broadcast = room is None
-    socketio.emit(msg_type, namespace='/api')
+    broadcaster.send(msg_type, msg, namespace='/api', room=room)
+
+
+@app.route('/api/broadcast/stats')
+@login_required
+def api_broadcast_stats():
+    return jsonify(broadcaster.stats())
 
 # *====================================================================*
 #         SocketIO Chat
 # *====================================================================*
+@socketio.on('connect', namespace='/chat')
+def chat_connect():
+    if not current_user.is_authenticated:
+        return False
+
+
 @socketio.on('joined', namespace='/chat')
 def joined(message):
     """Sent by clients when they enter a room.
-    A status message is broadcast to all people in the room."""
+    The recent window is replayed to the client, then a status message is
+    broadcast to all people in the room."""
     room = 'chat'
     join_room(room)
-    emit('status', {'msg': current_user.name + ' has entered the room.'}, room=room)
+    emit('history', {'lines': chat_log.replay(room)})
+    line = chat_log.add(room, 'status', current_user.name, current_user.name + ' has entered the room.')
+    emit('status', {'msg': line['msg'], 'sent_at': line['sent_at']}, room=room)
 
 
 @socketio.on('text', namespace='/chat')
@@ -608,7 +2250,8 @@ def text(message):
     """Sent by a client when the user entered a new message.
     The message is sent to all people in the room."""
     room = 'chat'
-    emit('message', {'msg': current_user.name + ':' + message['msg']}, room=room)
+    line = chat_log.add(room, 'message', current_user.name, current_user.name + ':' + message['msg'])
+    emit('message', {'msg': line['msg'], 'sent_at': line['sent_at']}, room=room)
 
 
 @socketio.on('left', namespace='/chat')
@@ -617,13 +2260,28 @@ def left(message):
     A status message is broadcast to all people in the room."""
     room = 'chat'
     leave_room(room)
-    emit('status', {'msg': current_user.name + ' has left the room.'}, room=room)
+    line = chat_log.add(room, 'status', current_user.name, current_user.name + ' has left the room.')
+    emit('status', {'msg': line['msg'], 'sent_at': line['sent_at']}, room=room)
+
+
+@app.route('/api/chat/history')
+@login_required
+def api_chat_history():
+    """Chat lines sent before the 'before' timestamp, a page at a time"""
+    lines = chat_log.history('chat', before=request.args.get('before'), limit=request.args.get('limit', type=int))
+    return jsonify({ 'lines': lines })
 
 
 
 
 if __name__ == '__main__':
+    # Each worker behind a load balancer gets its own --port
+    parser = argparse.ArgumentParser(description='nDART net control server')
+    parser.add_argument('--host', default=Config.HOST)
+    parser.add_argument('--port', type=int, default=Config.PORT)
+    args = parser.parse_args()
+
     create_database()
-    socketio.run(app, debug=Config.DEBUG, host=Config.HOST, port=Config.PORT)
+    socketio.run(app, debug=Config.DEBUG, host=args.host, port=args.port)
 
     
@@ -0,0 +1,121 @@
+"""
+Response time analytics: pandas over the typed clocks vs a row-by-row pass
+
+"pandas" is response_times(), the /api/events/analytics body: the
+*_at columns read into a DataFrame and described per agency and
+location.  "rows" is what the spreadsheet did: every event fetched,
+its HH:mm clocks parsed and the intervals summarized one row at a time.
+"backfill" times migration 9's stamping of every event.
+
+    python bench/analytics.py --events 5000 50000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from common import latency_summary, report, temp_database
+
+from config import Config
+
+AGENCIES = ('EMS', 'Fire', 'Police', 'Other')
+
+
+def clock(minutes):
+    return f'{minutes // 60 % 24:02d}:{minutes % 60:02d}'
+
+
+def populate(path, events, rng):
+    rows = []
+    for n in range(events):
+        start = rng.randint(7 * 60, 15 * 60)
+        notified = start + rng.randint(0, 5)
+        arrival = notified + rng.randint(2, 20)
+        resolved = arrival + rng.randint(5, 60)
+        rows.append((clock(start), str(n), f'MM{n % 26}', rng.choice(AGENCIES), clock(notified),
+                     clock(arrival), clock(resolved) if rng.random() < 0.9 else None))
+    conn = sqlite3.connect(path)
+    conn.executemany('''INSERT INTO events (time_in, bib, location, agency, agency_notified, agency_arrival, resolved)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)''', rows)
+    conn.commit()
+    conn.close()
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {'count': 0}
+    return {'count': len(values), 'mean': statistics.mean(values), 'p50': values[len(values) // 2],
+            'p90': values[int(len(values) * 0.9)], 'max': values[-1]}
+
+
+def row_by_row(app):
+    """Parse each event's clocks and summarize, one row at a time"""
+    def minutes(text):
+        hours, _, mins = (text or '').partition(':')
+        return int(hours) * 60 + int(mins) if hours.isdigit() and mins.isdigit() else None
+
+    groups = {}
+    for row in app.zip_table('events')['data']:
+        notified, arrival, resolved = (minutes(row[col]) for col in ('agency_notified', 'agency_arrival', 'resolved'))
+        for group in app.RESPONSE_GROUPS:
+            intervals = groups.setdefault(group, {}).setdefault(row[group] or '', ([], []))
+            if notified is not None and arrival is not None:
+                intervals[0].append((arrival - notified) % 1440)
+            if arrival is not None and resolved is not None:
+                intervals[1].append((resolved - arrival) % 1440)
+    return {group: {key: [summarize(values) for values in intervals] for key, intervals in keys.items()}
+            for group, keys in groups.items()}
+
+
+def time_calls(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, nargs='+', default=[5000, 50000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    app.create_database()
+
+    results = {}
+    loaded = 0
+    for events in sorted(args.events):
+        populate(Config.DATABASE_PATH, events - loaded, rng)
+        loaded = events
+
+        def backfill():
+            with app.db_connect(write=True) as conn:
+                app.add_event_stamps(conn.cursor())
+
+        def pandas():
+            with app.db_connect() as conn:
+                return app.response_times(conn)
+
+        results[events] = {
+            'backfill': time_calls(backfill, 1),
+            'pandas': time_calls(pandas, args.repeat),
+            'rows': time_calls(lambda: row_by_row(app), args.repeat),
+        }
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+A runner's timeline: the bib index vs matching bibs in SQL
+
+"index" is bib_timeline(): ids from bib_index, then a primary key fetch
+per table.  "scan" matches the normalized bib in SQL over both tables,
+which no index can serve.  "exact" uses the bib COLLATE NOCASE indexes,
+fast but blind to ' 0123' vs '#123' vs '123'.  Each runner has a few
+events and about ten observations, bibs typed in assorted ways.
+
+    python bench/bib.py --runners 10000 30000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common import latency_summary, report, temp_database
+
+from config import Config
+
+# How a station might type bib 123
+SPELLINGS = ('{}', '{}', '{}', '#{}', '0{}', ' {} ')
+
+SCAN = '''SELECT * FROM {table}
+          WHERE CASE WHEN ltrim(replace(upper(trim(bib)), '#', ''), '0') GLOB '[0-9]*'
+                     THEN ltrim(replace(upper(trim(bib)), '#', ''), '0')
+                     ELSE replace(upper(trim(bib)), '#', '') END = ?'''
+
+
+def populate(path, first, runners, rng):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO observations (time, bib, location, category) VALUES (?, ?, ?, ?)',
+                     ((f'{8 + n % 6:02d}:{n % 60:02d}', rng.choice(SPELLINGS).format(bib), f'MM{n % 26}', 'Male')
+                      for bib in range(first, first + runners) for n in range(rng.randint(5, 15))))
+    conn.executemany('INSERT INTO events (time_in, bib, location, notes) VALUES (?, ?, ?, ?)',
+                     ((f'{9 + n:02d}:{bib % 60:02d}', rng.choice(SPELLINGS).format(bib), f'MM{bib % 26}', 'cramps')
+                      for bib in range(first, first + runners) if bib % 10 == 0 for n in range(3)))
+    conn.commit()
+    conn.close()
+
+
+def time_calls(fn, bibs):
+    samples = []
+    for bib in bibs:
+        start = time.perf_counter()
+        fn(bib)
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runners', type=int, nargs='+', default=[10000, 30000])
+    parser.add_argument('--lookups', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    app.create_database()
+
+    def scan(bib):
+        with app.db_connect() as conn:
+            return [conn.execute(SCAN.format(table=table), (bib,)).fetchall() for table in app.BIB_TABLES]
+
+    def exact(bib):
+        with app.db_connect() as conn:
+            return [conn.execute(f'SELECT * FROM {table} WHERE bib = ? COLLATE NOCASE', (bib,)).fetchall()
+                    for table in app.BIB_TABLES]
+
+    results = {}
+    loaded = 0
+    for runners in sorted(args.runners):
+        populate(Config.DATABASE_PATH, loaded, runners - loaded, rng)
+        loaded = runners
+
+        start = time.perf_counter()
+        app.bib_index.rebuild()
+        rebuild_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        bibs = [str(rng.randrange(runners)) for _ in range(args.lookups)]
+        found = sum(len(app.bib_timeline(bib)[1]) for bib in bibs)
+        results[runners] = {
+            'rows': {table: stats['rows'] for table, stats in app.bib_index.stats().items()},
+            'rebuild_ms': rebuild_ms,
+            'index': time_calls(app.bib_timeline, bibs),
+            'scan': time_calls(scan, bibs[:max(1, args.lookups // 10)]),
+            'exact': time_calls(exact, bibs),
+            'index_rows_found': found,
+            'exact_rows_found': sum(len(rows) for bib in bibs for rows in exact(bib)),
+        }
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Shared helpers for the nDART benchmarks
+
+Benchmarks run from a checkout with a config.py in place, e.g.
+    python bench/db_pool.py --workers 16
+and print their results as JSON so runs can be diffed.  The helpers at the
+end start app.py as a real server, for the benchmarks that need sockets.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+def latency_summary(samples):
+    """p50/p95/p99/max of latencies given in seconds, reported in ms"""
+    return {
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'max_ms': round(max(samples, default=0) * 1000, 3),
+    }
+
+
+def temp_database(name='bench.db'):
+    """Path to a database file in a fresh temporary directory"""
+    return os.path.join(tempfile.mkdtemp(prefix='ndart-bench-'), name)
+
+
+def report(results):
+    print(json.dumps(results, indent=2))
+
+
+# *====================================================================*
+#         SERVER PROCESSES
+# *====================================================================*
+CONFIG_SHIM = '''
+import runpy
+Config = runpy.run_path({config!r})['Config']
+Config.DEBUG = False
+for name, value in {overrides!r}.items():
+    setattr(Config, name, value)
+'''
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Nothing listening on port {port}')
+
+
+def config_shim(directory, **overrides):
+    """Write a config.py to directory that loads the real one with overrides"""
+    import importlib.util
+    spec = importlib.util.find_spec('config')
+    if spec is None:
+        raise SystemExit('config.py not found')
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'config.py'), 'w') as f:
+        f.write(CONFIG_SHIM.format(config=spec.origin, overrides=overrides))
+    return directory
+
+
+def start_app(port, shim_dir, workdir):
+    """Run app.py on port with the config in shim_dir; returns once it listens"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([shim_dir, REPO_ROOT]))
+    log = open(os.path.join(workdir, 'server.log'), 'a')
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'app.py'), '--port', str(port)],
+                               cwd=workdir, env=env, stdout=log, stderr=log)
+    wait_for_port(port)
+    return process
+
+
+def accounts():
+    """(username, password) for every configured account"""
+    from config import Config
+    return [(name, account.get('password') or Config.USER_PASSWORD)
+            for name, account in Config.USER_ACCOUNTS.items()]
+
+
+def login(base_url, username, password):
+    """A requests session logged in to the server at base_url"""
+    import requests
+    session = requests.Session()
+    session.post(f'{base_url}/login', data={'username': username, 'password': password})
+    return session
@@ -0,0 +1,131 @@
+"""
+Concurrent create/edit benchmark: per-request sqlite3.connect vs the pool
+
+Each worker alternates creating an event and editing a random one,
+logging the change the way api_events does.  The "legacy" run opens a new
+rollback-journal connection per request as app.py used to; the "pooled"
+run goes through db.db_connect with WAL and the busy retry policy.
+Workers are eventlet green threads, monkey-patched as app.py runs, so
+pool waits and lock back-offs yield to each other the way they do in
+the server.
+
+    python bench/db_pool.py --workers 16 --ops 500
+"""
+
+import eventlet
+eventlet.monkey_patch()
+
+import argparse
+import random
+import sqlite3
+import time
+
+from common import latency_summary, report, temp_database
+
+import db
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS events (
+           id INTEGER PRIMARY KEY AUTOINCREMENT, time_in TEXT, bib TEXT, reporter TEXT,
+           location TEXT, agency TEXT, agency_notified TEXT, agency_arrival TEXT,
+           resolved TEXT, notes TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS change_log (
+           table_name TEXT NOT NULL, revision INTEGER NOT NULL, row_id INTEGER,
+           action TEXT NOT NULL, changed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+           PRIMARY KEY (table_name, revision))''',
+)
+
+LOG_CHANGE = '''INSERT INTO change_log (table_name, revision, row_id, action)
+                SELECT 'events', COALESCE(MAX(revision), 0) + 1, ?, ?
+                FROM change_log WHERE table_name = 'events\''''
+
+
+def write(cursor, rng, max_id):
+    if max_id and rng.random() < 0.5:
+        row_id = rng.randint(1, max_id)
+        cursor.execute(f"UPDATE events SET notes='note {rng.random()}' WHERE id={row_id}")
+        cursor.execute(LOG_CHANGE, (row_id, 'edit'))
+    else:
+        cursor.execute(f"INSERT INTO events (time_in, bib, location) "
+                       f"VALUES ('10:{rng.randint(10, 59)}', '{rng.randint(1, 30000)}', 'MM20')")
+        cursor.execute(LOG_CHANGE, (cursor.lastrowid, 'create'))
+
+
+def legacy_op(path, rng, max_id):
+    conn = sqlite3.connect(path)
+    try:
+        write(conn.cursor(), rng, max_id)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def pooled_op(path, rng, max_id):
+    with db.db_connect(write=True, path=path) as conn:
+        write(conn.cursor(), rng, max_id)
+
+
+def run(op, path, workers, ops, seed_rows):
+    latencies = []
+    errors = []
+
+    def worker(n):
+        rng = random.Random(n)
+        local = []
+        for _ in range(ops):
+            start = time.perf_counter()
+            try:
+                op(path, rng, seed_rows)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+                continue
+            local.append(time.perf_counter() - start)
+        latencies.extend(local)
+
+    pool = eventlet.GreenPool(workers)
+    start = time.perf_counter()
+    for n in range(workers):
+        pool.spawn_n(worker, n)
+    pool.waitall()
+    elapsed = time.perf_counter() - start
+
+    result = {'ops': len(latencies), 'errors': len(errors), 'seconds': round(elapsed, 3),
+              'ops_per_sec': round(len(latencies) / elapsed, 1)}
+    result.update(latency_summary(latencies))
+    return result
+
+
+def setup(path, rows, wal):
+    conn = sqlite3.connect(path)
+    if wal:
+        conn.execute('PRAGMA journal_mode = WAL')
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.executemany("INSERT INTO events (time_in, bib, location) VALUES ('10:00', ?, 'MM20')",
+                     ((str(n),) for n in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--ops', type=int, default=300, help='operations per worker')
+    parser.add_argument('--rows', type=int, default=5000, help='events seeded before the run')
+    args = parser.parse_args()
+
+    legacy_path = temp_database('legacy.db')
+    setup(legacy_path, args.rows, wal=False)
+    pooled_path = temp_database('pooled.db')
+    setup(pooled_path, args.rows, wal=True)
+
+    report({
+        'workers': args.workers,
+        'ops_per_worker': args.ops,
+        'legacy': run(legacy_op, legacy_path, args.workers, args.ops, args.rows),
+        'pooled': run(pooled_op, pooled_path, args.workers, args.ops, args.rows),
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Memory, time and hub blocking of the CSV and XLSX exports
+
+"csv" consumes app.csv_chunks as the WSGI server would and "xlsx" runs
+app.write_xlsx to a temporary file.  longest_block_ms is the longest
+stretch in which a green thread ticking every millisecond could not run,
+i.e. how long other consoles could be kept waiting.  Peak Python heap
+comes from a second run under tracemalloc.  With --baseline the same export is also done the
+buffered way, reading the whole table into a pandas DataFrame first.
+
+    python bench/export.py --rows 1000000
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from common import report, temp_database
+
+from config import Config
+
+
+def populate(path, rows):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO observations (time, bib, location, category) VALUES (?, ?, ?, ?)',
+                     ((f'{8 + n // 3600 % 6:02d}:{n // 60 % 60:02d}', str(n), f'MM{n % 26}', 'Male')
+                      for n in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+class HubWatch:
+    """Records the longest stretch the hub went without running a ticking green thread"""
+
+    def __init__(self, eventlet):
+        self.eventlet = eventlet
+
+    def __enter__(self):
+        self.longest = 0.0
+        self.running = True
+        self.last = time.perf_counter()
+
+        def tick():
+            while self.running:
+                self.eventlet.sleep(0.001)
+                now = time.perf_counter()
+                self.longest = max(self.longest, now - self.last)
+                self.last = now
+
+        self.ticker = self.eventlet.spawn(tick)
+        return self
+
+    def __exit__(self, *exc):
+        self.longest = max(self.longest, time.perf_counter() - self.last)
+        self.running = False
+        self.ticker.wait()
+
+
+def measure(app, run):
+    with HubWatch(app.eventlet) as watch:
+        start = time.perf_counter()
+        size = run()
+        elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'seconds': round(elapsed, 2), 'longest_block_ms': round(watch.longest * 1000, 1),
+            'peak_mb': round(peak / 2 ** 20, 1), 'size_mb': round(size / 2 ** 20, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--baseline', action='store_true', help='also time the buffered pandas export')
+    args = parser.parse_args()
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    app.create_database()
+    populate(Config.DATABASE_PATH, args.rows)
+    xlsx_path = os.path.join(os.path.dirname(Config.DATABASE_PATH), 'export.xlsx')
+
+    def csv_export():
+        return sum(len(chunk) for chunk in app.csv_chunks('observations'))
+
+    def xlsx_export():
+        app.write_xlsx(xlsx_path, 'observations')
+        return os.path.getsize(xlsx_path)
+
+    def pandas_frame():
+        with app.db_connect() as conn:
+            return app.pd.read_sql_query('SELECT * FROM observations ORDER BY time, id', conn)
+
+    def pandas_csv():
+        return len(pandas_frame().to_csv(index=False))
+
+    def pandas_xlsx():
+        pandas_frame().to_excel(xlsx_path, index=False, engine='xlsxwriter')
+        return os.path.getsize(xlsx_path)
+
+    results = {'rows': args.rows,
+               'csv': measure(app, csv_export),
+               'xlsx': measure(app, xlsx_export)}
+    if args.baseline:
+        results['baseline'] = {'csv': measure(app, pandas_csv), 'xlsx': measure(app, pandas_xlsx)}
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
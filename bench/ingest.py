@@ -0,0 +1,63 @@
+"""
+Observation ingest rate: one Editor POST per row vs the bulk endpoint
+
+"single" pushes each row through app.editor_action the way a console's
+create does (one transaction, change-log row, read-back and broadcast
+per observation).  "bulk" sends the same rows through app.bulk_insert in
+batches, as POST /api/observations/bulk does.
+
+    python bench/ingest.py --rows 20000 --batch 1000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from common import report, temp_database
+
+from config import Config
+
+
+def observations(count):
+    return [{'time': f'{9 + n // 3600 % 6:02d}:{n // 60 % 60:02d}', 'bib': str(n),
+             'location': ('MM20', 'FS2', 'MM26')[n % 3], 'category': ('Male', 'Female', 'Wheelchair')[n % 3]}
+            for n in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--single-rows', type=int, default=2000,
+                        help='rows for the one-at-a-time run, which is much slower')
+    parser.add_argument('--batch', type=int, default=1000)
+    args = parser.parse_args()
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    app.create_database()
+
+    rows = observations(args.single_rows)
+    start = time.perf_counter()
+    for row in rows:
+        app.editor_action('observations', 'create', {0: dict(row)})
+    single = time.perf_counter() - start
+
+    rows = observations(args.rows)
+    start = time.perf_counter()
+    for n in range(0, len(rows), args.batch):
+        app.bulk_insert('observations', rows[n:n + args.batch])
+    bulk = time.perf_counter() - start
+
+    report({
+        'single': {'rows': args.single_rows, 'seconds': round(single, 3),
+                   'rows_per_sec': round(args.single_rows / single, 1)},
+        'bulk': {'rows': args.rows, 'batch': args.batch, 'seconds': round(bulk, 3),
+                 'rows_per_sec': round(args.rows / bulk, 1)},
+    })
+
+
+if __name__ == '__main__':
+    main()
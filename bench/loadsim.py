@@ -0,0 +1,336 @@
+"""
+Race-day load against a real nDART server
+
+Starts app.py on a fresh database and for --seconds:
+  - --clients processes, each logged in as the next of the configured
+    USER_ACCOUNTS, loop over a weighted mix of requests (MIX, or
+    --mix name=weight ...) with --think seconds between them,
+  - --sockets Socket.IO clients hold /api and /chat open.  Every event
+    write and chat line carries the time it was sent, so each client
+    measures the fan-out delay from sending the write to receiving its
+    broadcast; --chatters of them also send a chat line every
+    --chat-interval seconds,
+  - the server's RSS is sampled every half second.
+
+Results are printed as JSON.  --save writes them to a file and
+--baseline compares a run with a saved one, e.g. before and after a
+performance change:
+
+    python bench/loadsim.py --save before.json
+    python bench/loadsim.py --baseline before.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import threading
+import time
+
+import socketio
+
+from common import accounts, config_shim, free_port, latency_summary, login, report, start_app
+
+# Request name -> relative weight; roughly what the consoles do on race day
+MIX = {
+    'create_observation': 40,
+    'create_event': 5,
+    'edit_event': 10,
+    'page_observations': 20,
+    'page_events': 10,
+    'load_events': 10,
+    'load_lookups': 5,
+}
+
+LOCATIONS = [f'MM{n}' for n in range(1, 27)]
+CATEGORIES = ('Male', 'Female', 'Wheelchair')
+STAMP = 'loadsim '
+
+
+def clock(rng):
+    return f'{rng.randint(7, 14):02d}:{rng.randint(0, 59):02d}'
+
+
+def page_params(column):
+    return {'draw': 1, 'start': 0, 'length': 25, 'order[0][column]': 0, 'order[0][dir]': 'desc',
+            'columns[0][data]': column}
+
+
+class Console:
+    """One HTTP client, issuing the requests in MIX"""
+
+    def __init__(self, base_url, username, password, seed):
+        self.base_url = base_url
+        self.session = login(base_url, username, password)
+        self.rng = random.Random(seed)
+        self.event_ids = []
+        self.etags = {}
+
+    def create_observation(self):
+        return self.session.post(f'{self.base_url}/api/observations/', data={
+            'action': 'create', 'data[0][time]': clock(self.rng), 'data[0][bib]': str(self.rng.randint(1, 30000)),
+            'data[0][location]': self.rng.choice(LOCATIONS), 'data[0][category]': self.rng.choice(CATEGORIES)})
+
+    def create_event(self):
+        response = self.session.post(f'{self.base_url}/api/events/', data={
+            'action': 'create', 'data[0][time_in]': clock(self.rng), 'data[0][bib]': str(self.rng.randint(1, 30000)),
+            'data[0][location]': self.rng.choice(LOCATIONS), 'data[0][notes]': f'{STAMP}{time.time()}'})
+        if response.ok:
+            self.event_ids.extend(row['id'] for row in response.json().get('data', []))
+        return response
+
+    def edit_event(self):
+        if not self.event_ids:
+            return self.create_event()
+        id = self.rng.choice(self.event_ids)
+        return self.session.post(f'{self.base_url}/api/events/', data={
+            'action': 'edit', f'data[{id}][notes]': f'{STAMP}{time.time()}',
+            f'data[{id}][agency_notified]': clock(self.rng)})
+
+    def page_observations(self):
+        return self.session.get(f'{self.base_url}/api/observations/', params=page_params('time'))
+
+    def page_events(self):
+        return self.session.get(f'{self.base_url}/api/events/', params=page_params('time_in'))
+
+    def load_events(self):
+        """A console reload: the whole listing, revalidated with the last ETag"""
+        return self.revalidate('/api/events/')
+
+    def load_lookups(self):
+        return self.revalidate(f'/api/lookups/{self.rng.choice(("locations", "agencies"))}')
+
+    def revalidate(self, path):
+        headers = {'If-None-Match': self.etags[path]} if path in self.etags else {}
+        response = self.session.get(f'{self.base_url}{path}', headers=headers)
+        if 'ETag' in response.headers:
+            self.etags[path] = response.headers['ETag']
+        return response
+
+
+def drive(args):
+    """One load process: weighted requests until the deadline"""
+    base_url, username, password, mix, seconds, think, seed = args
+    console = Console(base_url, username, password, seed)
+    names, weights = list(mix), list(mix.values())
+    samples = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        name = console.rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            response = getattr(console, name)()
+            response.content
+            ok = response.status_code < 400
+        except Exception:
+            ok = False
+        samples[name].append(time.perf_counter() - start)
+        if not ok:
+            errors[name] += 1
+        if think:
+            time.sleep(console.rng.uniform(0, 2 * think))
+    return samples, errors
+
+
+def listen(base_url, users, sockets, chatters, chat_interval, seconds, results):
+    """Hold sockets open, timing how long broadcasts take to arrive"""
+    lock = threading.Lock()
+    delays = {'events': [], 'chat': []}
+    received = {'batches': 0, 'resyncs': 0}
+    # Account -> [sockets, change messages received]
+    per_account = {}
+
+    def stamped(text):
+        start = text.rfind(STAMP)
+        try:
+            return float(text[start + len(STAMP):]) if start >= 0 else None
+        except ValueError:
+            return None
+
+    def on_batch(messages, username):
+        now = time.time()
+        with lock:
+            received['batches'] += 1
+            per_account[username][1] += len(messages)
+            for msg in messages:
+                change = msg['data'] if isinstance(msg['data'], dict) else {}
+                # Only event rows carry a stamp; summary buckets, removes and
+                # lookup changes have no row
+                if change.get('table') != 'events' or not isinstance(change.get('data'), dict):
+                    continue
+                sent = stamped(change['data'].get('notes') or '')
+                if sent is not None:
+                    delays['events'].append(now - sent)
+
+    def on_resync(data):
+        with lock:
+            received['resyncs'] += 1
+
+    def on_chat(data):
+        sent = stamped(data.get('msg', ''))
+        if sent is not None:
+            with lock:
+                delays['chat'].append(time.time() - sent)
+
+    clients = []
+    for n in range(sockets):
+        username, password = users[n % len(users)]
+        client = socketio.Client(http_session=login(base_url, username, password))
+        per_account.setdefault(username, [0, 0])[0] += 1
+        client.on('batch', lambda messages, username=username: on_batch(messages, username), namespace='/api')
+        client.on('resync', on_resync, namespace='/api')
+        client.on('message', on_chat, namespace='/chat')
+        client.connect(base_url, namespaces=['/api', '/chat'], transports=['websocket'])
+        client.emit('joined', {}, namespace='/chat')
+        clients.append(client)
+
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        for client in clients[:chatters]:
+            client.emit('text', {'msg': f'{STAMP}{time.time()}'}, namespace='/chat')
+        time.sleep(chat_interval)
+    # Let the last broadcasts land
+    time.sleep(1)
+    for client in clients:
+        client.disconnect()
+    results.put({'connected': len(clients), **received,
+                 'messages_per_socket': {username: round(count / sockets, 1)
+                                         for username, (sockets, count) in sorted(per_account.items())},
+                 'event_fanout': latency_summary(delays['events']), 'event_deliveries': len(delays['events']),
+                 'chat_fanout': latency_summary(delays['chat']), 'chat_deliveries': len(delays['chat'])})
+
+
+class RssSampler:
+    """Samples a process's resident set size from /proc while running"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def rss_mb(self):
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def run(self):
+        while self.running:
+            rss = self.rss_mb()
+            if rss is not None:
+                self.samples.append(rss)
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        if not self.samples:
+            return None
+        return {'start_mb': round(self.samples[0], 1), 'peak_mb': round(max(self.samples), 1),
+                'end_mb': round(self.samples[-1], 1)}
+
+
+def compare(baseline, results):
+    """Change of the headline numbers from baseline, as percentages"""
+    def headline(run):
+        numbers = {'requests_per_sec': run['requests_per_sec']}
+        for name, summary in run['requests'].items():
+            numbers[f'{name}.p95_ms'] = summary['latency']['p95_ms']
+        for name in ('event_fanout', 'chat_fanout'):
+            numbers[f'{name}.p95_ms'] = run['sockets'][name]['p95_ms']
+        if run.get('server_rss'):
+            numbers['server_rss.peak_mb'] = run['server_rss']['peak_mb']
+        return numbers
+
+    before, after = headline(baseline), headline(results)
+    changes = {}
+    for key in before.keys() & after.keys():
+        change = round((after[key] - before[key]) / before[key] * 100, 1) if before[key] else None
+        changes[key] = {'baseline': before[key], 'now': after[key], 'change_pct': change}
+    return dict(sorted(changes.items()))
+
+
+def parse_mix(pairs):
+    mix = {}
+    for pair in pairs:
+        name, _, weight = pair.partition('=')
+        if name not in MIX:
+            raise SystemExit(f'Unknown request {name!r}, expected one of {", ".join(MIX)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=30)
+    parser.add_argument('--clients', type=int, default=8, help='HTTP load processes')
+    parser.add_argument('--think', type=float, default=0.0, help='mean seconds between one client\'s requests')
+    parser.add_argument('--sockets', type=int, default=50, help='Socket.IO clients on /api and /chat')
+    parser.add_argument('--chatters', type=int, default=5, help='sockets that also send chat lines')
+    parser.add_argument('--chat-interval', type=float, default=1.0)
+    parser.add_argument('--mix', nargs='+', metavar='NAME=WEIGHT', help=f'requests to send, from {", ".join(MIX)}')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare with results saved by --save')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix) if args.mix else MIX
+
+    workdir = tempfile.mkdtemp(prefix='ndart-loadsim-')
+    shim_dir = config_shim(os.path.join(workdir, 'config'), DATABASE_PATH=os.path.join(workdir, 'ndart.db'))
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    server = start_app(port, shim_dir, workdir)
+    users = accounts()
+    try:
+        rss = RssSampler(server.pid)
+        socket_results = multiprocessing.Queue()
+        listener = multiprocessing.Process(target=listen, args=(
+            base_url, users, args.sockets, args.chatters, args.chat_interval, args.seconds, socket_results))
+        listener.start()
+        with multiprocessing.Pool(args.clients) as pool:
+            runs = pool.map(drive, [(base_url, *users[n % len(users)], mix, args.seconds, args.think, args.seed + n)
+                                    for n in range(args.clients)])
+        sockets = socket_results.get()
+        listener.join()
+        server_rss = rss.stop()
+    finally:
+        server.terminate()
+        server.wait()
+
+    requests = {}
+    for name in mix:
+        samples = [s for run in runs for s in run[0][name]]
+        requests[name] = {'count': len(samples), 'errors': sum(run[1][name] for run in runs),
+                          'per_sec': round(len(samples) / args.seconds, 1), 'latency': latency_summary(samples)}
+    total = sum(summary['count'] for summary in requests.values())
+    results = {
+        'settings': {'seconds': args.seconds, 'clients': args.clients, 'think': args.think, 'sockets': args.sockets,
+                     'chatters': args.chatters, 'chat_interval': args.chat_interval, 'mix': mix},
+        'requests_per_sec': round(total / args.seconds, 1),
+        'errors': sum(summary['errors'] for summary in requests.values()),
+        'latency': latency_summary([s for run in runs for samples in run[0].values() for s in samples]),
+        'requests': requests,
+        'sockets': sockets,
+        'server_rss': server_rss,
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            results['vs_baseline'] = compare(json.load(f), results)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
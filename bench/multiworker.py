@@ -0,0 +1,162 @@
+"""
+Run several nDART workers sharing one database and message queue
+
+Starts a local Redis (redis-server from PATH, or fakeredis's TCP server
+if that is installed), then for each worker count:
+  - starts that many `app.py --port ...` processes on one database,
+  - connects a Socket.IO client to every worker and checks that an event
+    created through the first worker reaches the clients on all of them,
+  - drives creates and page reads spread across the workers from
+    --clients load processes and reports requests per second.
+
+The workers use the checkout's config.py with DATABASE_PATH and
+SOCKETIO_MESSAGE_QUEUE overridden.
+
+    python bench/multiworker.py --workers 1 2 4 --seconds 10
+"""
+
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import socketio
+
+from common import accounts, config_shim, free_port, latency_summary, login, report, start_app, wait_for_port
+
+FAKE_REDIS = '''
+import sys
+from fakeredis import TcpFakeServer
+TcpFakeServer(('127.0.0.1', int(sys.argv[1])), server_type='redis').serve_forever()
+'''
+
+
+def start_redis(port):
+    if shutil.which('redis-server'):
+        command = ['redis-server', '--port', str(port), '--save', '', '--appendonly', 'no']
+    elif importlib.util.find_spec('fakeredis'):
+        command = [sys.executable, '-c', FAKE_REDIS, str(port)]
+    else:
+        raise SystemExit('Needs redis-server on PATH or the fakeredis package')
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    wait_for_port(port)
+    return process
+
+
+def start_workers(count, shim_dir, workdir):
+    ports = [free_port() for _ in range(count)]
+    # One at a time, so each worker finishes create_database before the next starts
+    return [start_app(port, shim_dir, workdir) for port in ports], ports
+
+
+def url(port):
+    return f'http://127.0.0.1:{port}'
+
+
+def check_delivery(ports, username, password, timeout=5.0):
+    """Create an event through the first worker and time its arrival everywhere"""
+    received = {port: threading.Event() for port in ports}
+    arrival = {}
+    clients = []
+    marker = f'bench-{time.time()}'
+    for port in ports:
+        client = socketio.Client(http_session=login(url(port), username, password))
+
+        def on_batch(messages, port=port):
+            for msg in messages:
+                if msg['type'] == 'new_event' and (msg['data'].get('data') or {}).get('notes') == marker:
+                    arrival[port] = time.perf_counter()
+                    received[port].set()
+
+        client.on('batch', on_batch, namespace='/api')
+        client.connect(url(port), namespaces=['/api'])
+        clients.append(client)
+
+    time.sleep(0.5)
+    start = time.perf_counter()
+    login(url(ports[0]), username, password).post(f'{url(ports[0])}/api/events/', data={
+        'action': 'create', 'data[0][bib]': '1', 'data[0][time_in]': '10:00', 'data[0][notes]': marker})
+    delivered = {port: received[port].wait(timeout) for port in ports}
+    for client in clients:
+        client.disconnect()
+    return {
+        'delivered_to': f'{sum(delivered.values())}/{len(ports)} workers',
+        'latency_ms': {str(port): round((arrival[port] - start) * 1000, 1) for port in arrival},
+    }
+
+
+def load(args):
+    """One load process: alternate creates and page reads across the workers"""
+    ports, username, password, seconds, offset = args
+    sessions = [login(url(port), username, password) for port in ports]
+    samples = {'create': [], 'read': []}
+    deadline = time.time() + seconds
+    n = offset
+    while time.time() < deadline:
+        session, port = sessions[n % len(ports)], ports[n % len(ports)]
+        start = time.perf_counter()
+        if n % 2:
+            session.post(f'{url(port)}/api/observations/', data={
+                'action': 'create', 'data[0][time]': '10:00', 'data[0][bib]': str(n),
+                'data[0][location]': 'MM20', 'data[0][category]': 'Male'})
+            samples['create'].append(time.perf_counter() - start)
+        else:
+            session.get(f'{url(port)}/api/observations/', params={
+                'draw': 1, 'start': 0, 'length': 25, 'order[0][column]': 1, 'order[0][dir]': 'desc',
+                'columns[1][data]': 'time'})
+            samples['read'].append(time.perf_counter() - start)
+        n += 1
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=16, help='load processes')
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    username, password = accounts()[0]
+
+    workdir = tempfile.mkdtemp(prefix='ndart-multi-')
+    redis_port = free_port()
+    redis = start_redis(redis_port)
+    results = {}
+    try:
+        for count in args.workers:
+            shim_dir = os.path.join(workdir, f'{count}-workers')
+            config_shim(shim_dir, DATABASE_PATH=os.path.join(shim_dir, 'ndart.db'),
+                        SOCKETIO_MESSAGE_QUEUE=f'redis://127.0.0.1:{redis_port}/0')
+            workers, ports = start_workers(count, shim_dir, workdir)
+            try:
+                delivery = check_delivery(ports, username, password)
+                with multiprocessing.Pool(args.clients) as pool:
+                    runs = pool.map(load, [(ports, username, password, args.seconds, n) for n in range(args.clients)])
+                creates = [s for run in runs for s in run['create']]
+                reads = [s for run in runs for s in run['read']]
+                results[count] = {
+                    'delivery': delivery,
+                    'requests_per_sec': round((len(creates) + len(reads)) / args.seconds, 1),
+                    'creates_per_sec': round(len(creates) / args.seconds, 1),
+                    'reads_per_sec': round(len(reads) / args.seconds, 1),
+                    'create_latency': latency_summary(creates),
+                    'read_latency': latency_summary(reads),
+                }
+            finally:
+                for worker in workers:
+                    worker.terminate()
+                for worker in workers:
+                    worker.wait()
+    finally:
+        redis.terminate()
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Check that the hot queries stay index-backed
+
+Builds a fresh database through app.create_database (so every migration
+runs) and asserts that EXPLAIN QUERY PLAN for each lookup pattern the
+app depends on names the index meant to serve it.  Exits non-zero and
+prints the plan of any query that has fallen back to a table scan.
+
+    python bench/query_plans.py
+"""
+
+import os
+import sys
+import tempfile
+
+from common import temp_database
+
+from config import Config
+
+# (description, query, parameters, index the plan must use)
+HOT_QUERIES = [
+    ('events by bib', 'SELECT * FROM events WHERE bib = ? COLLATE NOCASE', ('1234',), 'events_bib'),
+    ('observations by bib', 'SELECT * FROM observations WHERE bib = ? COLLATE NOCASE', ('1234',),
+     'observations_bib'),
+    ('events at a location over a time range',
+     'SELECT * FROM events WHERE location = ? AND time_in BETWEEN ? AND ?', ('MM20', '09:00', '10:00'),
+     'events_location_time'),
+    ('observations at a location over a time range',
+     'SELECT * FROM observations WHERE location = ? AND time BETWEEN ? AND ?', ('MM20', '09:00', '10:00'),
+     'observations_location_time'),
+    ('unresolved events', 'SELECT * FROM events WHERE {unresolved}', (), 'events_unresolved'),
+    ('latest events page', 'SELECT * FROM events ORDER BY time_in_at DESC, id DESC LIMIT 25', (),
+     'events_time_in_at'),
+    ('latest observations page', 'SELECT * FROM observations ORDER BY time DESC, id DESC LIMIT 25', (),
+     'observations_time'),
+    ('observation search by location prefix',
+     "SELECT * FROM observations WHERE location LIKE ? ESCAPE '\\'", ('mm2%',), 'observations_location'),
+    ("a station's observations",
+     'SELECT COUNT(*) FROM observations WHERE (location COLLATE NOCASE IN (?))', ('MM20',),
+     'observations_location'),
+    ('events by note words',
+     'SELECT events.* FROM events_fts JOIN events ON events.id = events_fts.rowid WHERE events_fts MATCH ? '
+     'ORDER BY events_fts.rank', ('"chest"* "pain"*',), 'events_fts VIRTUAL TABLE INDEX'),
+    ('changes since a revision',
+     "SELECT row_id FROM change_log WHERE table_name = 'events' AND revision > ?", (10,),
+     'sqlite_autoindex_change_log_1'),
+]
+
+
+def main():
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-plans-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    import db
+    app.create_database()
+
+    failures = 0
+    for description, query, params, index in HOT_QUERIES:
+        query = query.format(unresolved=app.UNRESOLVED_EVENTS)
+        plan = db.explain(query, params)
+        ok = any(index in line for line in plan)
+        print(f'{"ok  " if ok else "FAIL"} {description}: {" / ".join(plan)}')
+        failures += not ok
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
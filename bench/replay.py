@@ -0,0 +1,67 @@
+"""
+Flushing a reconnecting console's queued writes: one POST each vs /api/replay
+
+"single" sends every queued observation as its own Editor create, the
+way the consoles retried before.  "replay" sends the whole queue to
+/api/replay, which applies it in one transaction.  "retry" sends the
+same queue again, answered from the stored results without writing.
+
+    python bench/replay.py --writes 50 200 500
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from common import report, temp_database
+
+from config import Config
+
+
+def queue(writes, prefix):
+    return [{'request_id': f'{prefix}-{n}', 'table': 'observations', 'action': 'create',
+             'data': {'0': {'time': f'{8 + n // 60 % 6:02d}:{n % 60:02d}', 'bib': str(n),
+                            'location': f'MM{n % 26}', 'category': 'Male'}}}
+            for n in range(writes)]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--writes', type=int, nargs='+', default=[50, 200, 500])
+    args = parser.parse_args()
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    app.create_database()
+    app.app.config['LOGIN_DISABLED'] = True
+    client = app.app.test_client()
+
+    def single(writes):
+        for write in writes:
+            form = {f'data[0][{field}]': value for field, value in write['data']['0'].items()}
+            client.post('/api/observations/', data=dict(form, action='create', request_id=write['request_id']))
+
+    results = {}
+    for count in args.writes:
+        before = app.current_revision('observations')
+        replayed = queue(count, f'replay{count}')
+        results[count] = {
+            'single_ms': timed(lambda: single(queue(count, f'single{count}'))),
+            'replay_ms': timed(lambda: client.post('/api/replay', json={'writes': replayed})),
+            'retry_ms': timed(lambda: client.post('/api/replay', json={'writes': replayed})),
+            'rows_written': app.current_revision('observations') - before,
+        }
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
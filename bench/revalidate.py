@@ -0,0 +1,68 @@
+"""
+Cost of an idle console re-polling a listing, with and without its ETag
+
+"full" fetches /api/observations/ the way a console did on every reload.
+"revalidated" sends the ETag from the previous fetch as If-None-Match and
+gets 304 Not Modified, which is answered from the table's revision alone.
+
+    python bench/revalidate.py --rows 10000 100000
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from common import latency_summary, report, temp_database
+
+from config import Config
+
+
+def populate(path, rows):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO observations (time, bib, location, category) VALUES (?, ?, ?, ?)',
+                     ((f'{8 + n % 6:02d}:{n % 60:02d}', str(n), f'MM{n % 26}', 'Male') for n in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def time_gets(client, repeat, headers=None):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get('/api/observations/', headers=headers)
+        response.get_data()
+        samples.append(time.perf_counter() - start)
+    return response.status_code, latency_summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    app.create_database()
+    app.app.config['LOGIN_DISABLED'] = True
+    client = app.app.test_client()
+
+    results = {}
+    loaded = 0
+    for rows in sorted(args.rows):
+        populate(Config.DATABASE_PATH, rows - loaded)
+        loaded = rows
+        etag = client.get('/api/observations/').headers['ETag']
+        full_status, full = time_gets(client, args.repeat)
+        cached_status, cached = time_gets(client, args.repeat, {'If-None-Match': etag})
+        results[rows] = {'full': dict(full, status=full_status),
+                         'revalidated': dict(cached, status=cached_status)}
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Searching event notes: the FTS5 index vs LIKE vs downloading the table
+
+"fts" is /api/events/search's query, a ranked page of 25.  "page" is
+the events console's server-side search box, which also matches notes
+through the index.  "like" finds the same rows with LIKE '%word%', which
+reads every note.  Common words match about a fifth of the events, rare
+ones about one in a thousand.  "download" is what searching in the
+browser cost: the whole listing serialized, with its size.
+
+    python bench/search.py --events 10000 100000
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from common import latency_summary, report, temp_database
+
+from config import Config
+
+WORDS = ('chest pain', 'heat exhaustion', 'cramps', 'blister', 'dizzy', 'fell', 'knee', 'ankle', 'nausea',
+         'red shirt', 'blue shirt', 'yellow hat', 'wheelchair', 'transported', 'refused care', 'family looking')
+# Rare notes name one of these, about one event in a thousand
+RARE = ('helicopter', 'hypothermia', 'seizure', 'separated child')
+COMMON_QUERIES = ('chest pain', 'heat', 'red shirt', 'famil', 'ankle knee', 'transp')
+RARE_QUERIES = ('helicopter', 'hypoth', 'seizure', 'separated child')
+
+
+def populate(path, first, events, rng):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO events (time_in, bib, location, reporter, notes) VALUES (?, ?, ?, ?, ?)',
+                     ((f'{8 + n % 7:02d}:{n % 60:02d}', str(n), f'MM{n % 26}', f'MM{(n + 1) % 26}',
+                       ', '.join(rng.sample(WORDS, 3) + ([rng.choice(RARE)] if n % 1000 == 7 else []))
+                       + f' near mile {n % 26}')
+                      for n in range(first, first + events)))
+    conn.commit()
+    conn.close()
+
+
+def time_calls(fn, queries, repeat):
+    samples = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            fn(query)
+            samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    import db
+    app.create_database()
+
+    def fts(text):
+        return db.search_table('events', 'events_fts', db.fts_query(text), 0, 25)
+
+    def page(text):
+        return db.page_table('events', 0, 25, [('time_in_at', True)], text, app.SEARCH_COLUMNS['events'],
+                             full_text=('events_fts', db.fts_query(text)))
+
+    def like(text):
+        words = text.split()
+        where = ' AND '.join('notes LIKE ?' for _ in words)
+        params = [f'%{word}%' for word in words]
+        with db.db_connect() as conn:
+            count = conn.execute(f'SELECT COUNT(*) FROM events WHERE {where}', params).fetchone()[0]
+            return count, conn.execute(f'SELECT * FROM events WHERE {where} ORDER BY id DESC LIMIT 25',
+                                       params).fetchall()
+
+    results = {}
+    loaded = 0
+    for events in sorted(args.events):
+        populate(Config.DATABASE_PATH, loaded, events - loaded, rng)
+        loaded = events
+        with db.db_connect(write=True) as conn:
+            start = time.perf_counter()
+            conn.execute("INSERT INTO events_fts (events_fts) VALUES ('rebuild')")
+            rebuild_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        start = time.perf_counter()
+        size = len(json.dumps(db.zip_table('events')))
+        results[events] = {
+            'rebuild_ms': rebuild_ms,
+            'download': {'ms': round((time.perf_counter() - start) * 1000, 1), 'mb': round(size / 2 ** 20, 1)},
+        }
+        for kind, queries in (('common', COMMON_QUERIES), ('rare', RARE_QUERIES)):
+            results[events][kind] = {
+                'fts': time_calls(fts, queries, args.repeat),
+                'page': time_calls(page, queries, args.repeat),
+                'like': time_calls(like, queries, args.repeat),
+                'matches': {query: fts(query)[0] for query in queries},
+            }
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
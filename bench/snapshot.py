@@ -0,0 +1,115 @@
+"""
+Snapshots and archiving vs the blocking ways to do the same, under live writes
+
+While each operation runs, a green thread writes an observation every
+--write-interval seconds and another ticks every 5 ms, so the report
+shows how long writes waited and the longest the hub went unanswered.
+
+  - "snapshot": db.snapshot a few pages a step, yielding between steps
+  - "backup_one_step": the same backup copied in a single step
+  - "archive": archive_rows moving every observation unchanged since
+    midnight (all but the writer's), a batch at a time
+  - "remove_all_rows": the admin page's DELETE of the whole table
+
+    python bench/snapshot.py --rows 300000
+"""
+
+import argparse
+import datetime
+import os
+import sqlite3
+import tempfile
+import time
+
+from common import latency_summary, report, temp_database
+
+from config import Config
+
+
+def populate(path, rows):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO observations (time, bib, location, category) VALUES (?, ?, ?, ?)',
+                     ((f'{8 + n % 6:02d}:{n % 60:02d}', str(n), f'MM{n % 26}', 'Male') for n in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=300000)
+    parser.add_argument('--write-interval', type=float, default=0.02)
+    args = parser.parse_args()
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    import db
+    app.create_database()
+    eventlet = app.eventlet
+
+    def under_load(operation):
+        writes, gaps = [], []
+        state = {'running': True}
+
+        def writer():
+            n = 0
+            while state['running']:
+                start = time.perf_counter()
+                app.editor_action('observations', 'create',
+                                  {0: {'time': '10:00', 'bib': f'w{n}', 'location': 'MM1', 'category': 'Male'}})
+                writes.append(time.perf_counter() - start)
+                n += 1
+                eventlet.sleep(args.write_interval)
+
+        def ticker():
+            last = time.perf_counter()
+            while state['running']:
+                eventlet.sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        threads = [eventlet.spawn(writer), eventlet.spawn(ticker)]
+        eventlet.sleep(0.1)
+        start = time.perf_counter()
+        detail = operation()
+        seconds = time.perf_counter() - start
+        state['running'] = False
+        for thread in threads:
+            thread.wait()
+        return {'seconds': round(seconds, 2), 'writes': len(writes), 'write_latency': latency_summary(writes),
+                'max_hub_gap_ms': round(max(gaps, default=0) * 1000, 1), **(detail or {})}
+
+    def snapshot(pages):
+        def run():
+            steps = [0]
+
+            def progress(remaining, total):
+                steps[0] += 1
+                eventlet.sleep(0)
+
+            target = os.path.join(tempfile.mkdtemp(prefix='ndart-bench-'), 'snapshot.db')
+            copied = db.snapshot(target, pages=pages, progress=progress)
+            return {'pages': copied, 'steps': steps[0],
+                    'snapshot_rows': sqlite3.connect(target).execute('SELECT COUNT(*) FROM observations').fetchone()[0]}
+        return run
+
+    def archive():
+        midnight = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        job = {'table': 'observations', 'archived': 0, 'before': int(midnight.timestamp())}
+        app.archive_rows(job)
+        return {'archived': job['archived']}
+
+    results = {}
+    populate(Config.DATABASE_PATH, args.rows)
+    results['snapshot'] = under_load(snapshot(db.SNAPSHOT_PAGES))
+    results['backup_one_step'] = under_load(snapshot(-1))
+    results['archive'] = under_load(archive)
+    populate(Config.DATABASE_PATH, args.rows)
+    results['remove_all_rows'] = under_load(lambda: app.remove_all_rows('observations'))
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
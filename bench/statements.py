@@ -0,0 +1,75 @@
+"""
+Per-request CPU cost of f-string SQL vs cached parameterized statements
+
+Replays a burst of bubble edits (one field per request, random rows and
+values) against the events table.  The "fstring" run builds the SQL text
+the way api_events used to, so every request is new SQL for SQLite to
+parse and plan; the "cached" run uses db.build_statement with bound
+parameters, so each pooled connection's statement cache gets hits.
+
+    python bench/statements.py --edits 50000
+"""
+
+import argparse
+import random
+import time
+
+from common import report, temp_database
+
+import db
+
+FIELDS = ('bib', 'location', 'reporter', 'agency', 'notes', 'agency_notified')
+
+
+def fstring_edit(conn, row_id, fields):
+    set_elem = [f" {col}='{fields[col]}'" for col in fields]
+    conn.execute(f"UPDATE events SET {', '.join(set_elem)} WHERE ID={row_id}")
+
+
+def cached_edit(conn, row_id, fields):
+    columns = tuple(sorted(fields))
+    query = db.build_statement('events', 'edit', columns)
+    conn.execute(query, [fields[col] for col in columns] + [row_id])
+
+
+def run(edit, path, edits, rows):
+    rng = random.Random(1)
+    with db.db_connect(path=path) as conn:
+        conn.execute('BEGIN')
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        for _ in range(edits):
+            field = rng.choice(FIELDS)
+            edit(conn, rng.randint(1, rows), {field: f'{field} {rng.randint(0, 10 ** 6)}'})
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - start_cpu
+        conn.execute('ROLLBACK')
+    return {'edits': edits, 'seconds': round(elapsed, 3),
+            'cpu_us_per_edit': round(cpu / edits * 10 ** 6, 2),
+            'edits_per_sec': round(edits / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--edits', type=int, default=50000)
+    parser.add_argument('--rows', type=int, default=5000)
+    args = parser.parse_args()
+
+    path = temp_database()
+    db.Config.DATABASE_PATH = path
+    with db.db_connect(write=True) as conn:
+        conn.execute('''CREATE TABLE events (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT, time_in TEXT, bib TEXT,
+                            reporter TEXT, location TEXT, agency TEXT, agency_notified TEXT,
+                            agency_arrival TEXT, resolved TEXT, notes TEXT)''')
+        conn.executemany("INSERT INTO events (time_in, bib) VALUES ('10:00', ?)",
+                         ((str(n),) for n in range(args.rows)))
+
+    report({
+        'fstring': run(fstring_edit, path, args.edits, args.rows),
+        'cached': run(cached_edit, path, args.edits, args.rows),
+    })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Memory and latency of buffered vs streamed observation listings
+
+"buffered" is what the listing route used to do: zip_table the whole
+table, then serialize it into one body.  "streamed" consumes
+app.json_listing chunk by chunk as the WSGI server would, and
+"streamed_gzip" adds gzip_chunks.  Timings come from a plain run;
+peak Python heap from a second run under tracemalloc.  first_rows_ms is
+the time until the first chunk holding row data is ready.
+
+    python bench/streaming.py --rows 100000 300000
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+from common import report, temp_database
+
+from config import Config
+
+
+def populate(path, rows):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO observations (time, bib, location, category) VALUES (?, ?, ?, ?)',
+                     ((f'{8 + n % 6:02d}:{n % 60:02d}', str(n), f'MM{n % 26}', 'Male') for n in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def consume(produce):
+    start = time.perf_counter()
+    first_rows = None
+    size = 0
+    for n, chunk in enumerate(produce()):
+        if first_rows is None and (n > 0 or len(chunk) > 64):
+            first_rows = time.perf_counter() - start
+        size += len(chunk)
+    return first_rows, time.perf_counter() - start, size
+
+
+def measure(produce):
+    first_rows, elapsed, size = consume(produce)
+    tracemalloc.start()
+    consume(produce)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'first_rows_ms': round(first_rows * 1000, 1), 'total_ms': round(elapsed * 1000, 1),
+            'peak_mb': round(peak / 2 ** 20, 1), 'body_mb': round(size / 2 ** 20, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 300000])
+    args = parser.parse_args()
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    app.create_database()
+
+    results = {}
+    loaded = 0
+    for rows in sorted(args.rows):
+        populate(Config.DATABASE_PATH, rows - loaded)
+        loaded = rows
+        with app.app.app_context():
+            results[rows] = {
+                'buffered': measure(lambda: [app.jsonify(app.zip_table('observations')).get_data()]),
+                'streamed': measure(lambda: app.json_listing('observations', revision=0)),
+                'streamed_gzip': measure(lambda: app.gzip_chunks(app.json_listing('observations', revision=0))),
+            }
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Observation counts from the summary table vs tallying every observation
+
+"tally" is what a dashboard had to do: fetch all observations and count
+them per location, category and 5 minute bucket.  "summary" reads
+observation_counts, which the write paths keep current.  "rebuild" and
+"verify" time the pandas backfill over the whole table.
+
+    python bench/summary.py --rows 100000 1000000
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+from collections import Counter
+
+from common import latency_summary, report, temp_database
+
+from config import Config
+
+
+def populate(path, rows):
+    conn = sqlite3.connect(path)
+    conn.executemany('INSERT INTO observations (time, bib, location, category) VALUES (?, ?, ?, ?)',
+                     ((f'{8 + n % 6:02d}:{n % 60:02d}', str(n), f'MM{n % 26}', ('Male', 'Female', 'Wheelchair')[n % 3])
+                      for n in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def time_calls(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    # app creates its db directory relative to the working directory
+    os.chdir(tempfile.mkdtemp(prefix='ndart-bench-'))
+    Config.DATABASE_PATH = temp_database()
+    import app
+    app.create_database()
+
+    def tally():
+        return Counter(app.summary_key(row) for row in app.zip_table('observations')['data'])
+
+    results = {}
+    loaded = 0
+    for rows in sorted(args.rows):
+        populate(Config.DATABASE_PATH, rows - loaded)
+        loaded = rows
+        start = time.perf_counter()
+        buckets = app.rebuild_observation_summary()
+        rebuild = time.perf_counter() - start
+        start = time.perf_counter()
+        mismatched = app.rebuild_observation_summary(verify=True)
+        verify = time.perf_counter() - start
+        results[rows] = {
+            'buckets': buckets,
+            'tally': time_calls(tally, args.repeat),
+            'summary': time_calls(app.observation_summary, args.repeat),
+            'rebuild_s': round(rebuild, 3),
+            'verify_s': round(verify, 3),
+            'mismatched': len(mismatched),
+        }
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+zip_table micro-benchmark at 10k, 100k and 1M observations
+
+"legacy" is zip_table as it used to be: a fresh connection, fetchall(),
+a PRAGMA table_info round trip and a dict per row appended in a loop.
+"current" is db.zip_table, which takes the column names from the cursor
+and builds the rows in one pass over it.  Both a full listing and the
+single-row read that follows every write are timed.
+
+    python bench/zip_table.py --sizes 10000 100000 1000000
+"""
+
+import argparse
+import sqlite3
+import time
+
+from common import latency_summary, report, temp_database
+
+import db
+
+
+def legacy_zip_table(path, table_name, where_clause=None):
+    where_clause = f' WHERE {where_clause}' if where_clause else ''
+    with sqlite3.connect(path) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT * FROM {table_name}{where_clause}')
+        rows = cursor.fetchall()
+        cursor.execute(f"PRAGMA table_info({table_name})")
+        columns = [column[1] for column in cursor.fetchall()]
+    data_list = []
+    for row in rows:
+        data_list.append(dict(zip(columns, row)))
+    return {'data': data_list}
+
+
+def populate(rows):
+    path = temp_database(f'zip_{rows}.db')
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE observations (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        time TEXT NOT NULL, bib TEXT, location TEXT, category TEXT)''')
+    conn.executemany('INSERT INTO observations (time, bib, location, category) VALUES (?, ?, ?, ?)',
+                     ((f'{8 + n % 6:02d}:{n % 60:02d}', str(n), f'MM{n % 26}', 'Male') for n in range(rows)))
+    conn.commit()
+    conn.close()
+    return path
+
+
+def time_calls(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return latency_summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    for rows in args.sizes:
+        path = populate(rows)
+        db.Config.DATABASE_PATH = path
+        db.load_schema()
+        row_id = f'id={rows // 2}'
+        results[rows] = {
+            'listing': {
+                'legacy': time_calls(lambda: legacy_zip_table(path, 'observations'), args.repeat),
+                'current': time_calls(lambda: db.zip_table('observations'), args.repeat),
+            },
+            'single_row': {
+                'legacy': time_calls(lambda: legacy_zip_table(path, 'observations', row_id), 1000),
+                'current': time_calls(lambda: db.zip_table('observations', row_id), 1000),
+            },
+        }
+    report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# -*- coding: ascii -*-
+
+"""
+Participant timeline index for nDART
+
+Bibs are typed in by hand, so ' 0123', '#123' and '123' all name the
+same runner.  normalize_bib() reduces each to one key.  BibIndex maps
+every key to the ids of the events and observations naming it, so a
+runner's history is a dict lookup and a primary key fetch per table
+instead of a scan of both tables.
+
+The index is loaded once at startup.  Writes on this worker are applied
+as they are published; a write it has not seen, e.g. one made on another
+worker, is picked up from change_log before the next lookup.  Ids are
+only added from change_log, never removed, so a lookup hands back
+candidates and the caller drops those whose row is gone or no longer
+names the bib (see discard).
+
+Changelog:
+    - 2026-10-18 - Initial BibIndex
+"""
+
+from array import array
+import re
+import threading
+
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_bib(value):
+    """The key a bib is indexed by, None for a blank bib
+
+    Whitespace and a leading '#' are dropped, letters upper-cased and an
+    all-digit bib loses its leading zeros.
+    """
+    if value is None:
+        return None
+    key = WHITESPACE.sub('', str(value)).lstrip('#').upper()
+    if key.isdigit():
+        key = key.lstrip('0') or '0'
+    return key or None
+
+
+class BibIndex:
+    """bib key -> ids of the rows naming it, per table
+
+    load(table) returns (revision, [(id, bib), ...]) and
+    revision(table) the table's latest revision; changes(table, since)
+    gives the rows changed after a revision in the form
+    app.changes_since returns them.
+    """
+
+    def __init__(self, tables, load, revision, changes):
+        self.tables = tuple(tables)
+        self.load_rows = load
+        self.current_revision = revision
+        self.changes = changes
+
+        self.lock = threading.Lock()
+        # table -> {key: array of ids}; an array keeps 8 bytes an id
+        self.ids = {table: {} for table in self.tables}
+        self.revisions = {table: 0 for table in self.tables}
+
+    def rebuild(self, table=None):
+        """Reload one table, every table if None, from the database"""
+        for table in (self.tables if table is None else (table,)):
+            revision, rows = self.load_rows(table)
+            ids = {}
+            for id, bib in rows:
+                key = normalize_bib(bib)
+                if key is not None:
+                    ids.setdefault(key, array('q')).append(id)
+            with self.lock:
+                self.ids[table] = ids
+                self.revisions[table] = revision
+
+    def add(self, table, id, key):
+        """Call with the lock held"""
+        if key is None:
+            return
+        ids = self.ids[table].setdefault(key, array('q'))
+        if id not in ids:
+            ids.append(id)
+
+    def remove(self, table, id, key):
+        """Call with the lock held"""
+        ids = self.ids[table].get(key)
+        if ids is not None and id in ids:
+            ids.remove(id)
+            if not ids:
+                del self.ids[table][key]
+
+    def apply(self, table, first_revision, revision, changes):
+        """Index committed writes logged as first_revision..revision
+
+        changes holds (id, row before, row after) with None for a missing
+        side.  Writes that do not directly follow what the index holds
+        are left for sync() to read from change_log.
+        """
+        if table not in self.ids:
+            return
+        with self.lock:
+            if first_revision != self.revisions[table] + 1:
+                return
+            for id, old, row in changes:
+                before = normalize_bib(old.get('bib')) if old else None
+                after = normalize_bib(row.get('bib')) if row else None
+                if before != after:
+                    self.remove(table, id, before)
+                self.add(table, id, after)
+            self.revisions[table] = revision
+
+    def clear(self, table, revision):
+        """table was emptied at revision"""
+        with self.lock:
+            if revision == self.revisions[table] + 1:
+                self.ids[table] = {}
+                self.revisions[table] = revision
+
+    def sync(self, table):
+        """Catch up with writes the index has not seen"""
+        with self.lock:
+            since = self.revisions[table]
+        if self.current_revision(table) == since:
+            return
+        data = self.changes(table, since)
+        if data.get('reload'):
+            self.rebuild(table)
+            return
+        with self.lock:
+            # Another green thread caught up first
+            if self.revisions[table] != since:
+                return
+            for row in data['data']:
+                self.add(table, row['id'], normalize_bib(row.get('bib')))
+            self.revisions[table] = data['revision']
+
+    def lookup(self, bib):
+        """(key, {table: candidate ids}) for bib, oldest id first"""
+        key = normalize_bib(bib)
+        found = {}
+        for table in self.tables:
+            self.sync(table)
+            with self.lock:
+                found[table] = sorted(self.ids[table].get(key, ())) if key is not None else []
+        return key, found
+
+    def discard(self, table, key, ids):
+        """Forget candidates that turned out not to name key"""
+        with self.lock:
+            for id in ids:
+                self.remove(table, id, key)
+
+    def stats(self):
+        with self.lock:
+            return {table: {'keys': len(ids), 'rows': sum(len(row_ids) for row_ids in ids.values()),
+                            'revision': self.revisions[table]}
+                    for table, ids in self.ids.items()}
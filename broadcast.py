@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: ascii -*-
+
+"""
+Coalescing Socket.IO broadcaster for nDART
+
+Writes hand their change messages to a Broadcaster instead of emitting
+them from the request.  A background task flushes each namespace's queue
+every FLUSH_INTERVAL seconds, or as soon as it holds FLUSH_SIZE messages.
+
+Each namespace has one queue in the order messages were sent.  A flush
+sends every run of consecutive messages for the same room(s) as a single
+'batch' message, runs in queue order, so a console in several rooms gets
+every change in the order it was made, whichever rooms it went to.
+
+Two kinds of backpressure keep a burst from stalling the server:
+    - a namespace whose queue passes ROOM_MAX_PENDING is collapsed to one
+      'resync' message per room naming the tables that changed;
+    - a client whose outbound queue is longer than CLIENT_MAX_QUEUE is
+      skipped, then sent one 'resync' once it has drained.
+Clients answer 'resync' by fetching ?since=<revision>.
+
+A message can go to several rooms at once (room given as a tuple); each
+client in any of them gets it once.
+
+Changelog:
+    - 2026-10-18 - Initial Broadcaster
+    - 2026-10-18 - Messages addressed to several rooms
+    - 2026-10-18 - One ordered queue per namespace
+"""
+
+from config import Config
+import sys
+import threading
+import time
+
+
+FLUSH_INTERVAL = getattr(Config, 'SIO_FLUSH_INTERVAL', 0.1)
+FLUSH_SIZE = getattr(Config, 'SIO_FLUSH_SIZE', 200)
+ROOM_MAX_PENDING = getattr(Config, 'SIO_ROOM_MAX_PENDING', 2000)
+CLIENT_MAX_QUEUE = getattr(Config, 'SIO_CLIENT_MAX_QUEUE', 500)
+
+
+class Broadcaster:
+    """Queues Socket.IO messages per namespace in send order and flushes them in batches"""
+
+    def __init__(self, socketio, interval=FLUSH_INTERVAL, flush_size=FLUSH_SIZE,
+                 room_max_pending=ROOM_MAX_PENDING, client_max_queue=CLIENT_MAX_QUEUE):
+        self.socketio = socketio
+        self.interval = interval
+        self.flush_size = flush_size
+        self.room_max_pending = room_max_pending
+        self.client_max_queue = client_max_queue
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.started = False
+
+        # namespace -> {'since': enqueue time of the oldest,
+        #               'messages': [(room, message), ...] in send order, None once collapsed,
+        #               'tables': {room: tables changed}}
+        self.buffers = {}
+        # sid -> (namespace, engine.io sid, tables it missed while skipped)
+        self.stale = {}
+
+        self.counters = {'messages': 0, 'batches': 0, 'collapsed': 0, 'skipped_clients': 0, 'resyncs': 0}
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.socketio.start_background_task(self.run)
+
+    def send(self, msg_type, msg, namespace='/api', room=None):
+        """Queue msg for room in the next flush of namespace"""
+        self.start()
+        table = msg.get('table') if isinstance(msg, dict) else None
+        with self.lock:
+            buffer = self.buffers.get(namespace)
+            if buffer is None:
+                buffer = self.buffers[namespace] = {'since': time.monotonic(), 'messages': [], 'tables': {}}
+            self.counters['messages'] += 1
+            tables = buffer['tables'].setdefault(room, set())
+            if table:
+                tables.add(table)
+            if buffer['messages'] is not None:
+                buffer['messages'].append((room, {'type': msg_type, 'data': msg}))
+                if len(buffer['messages']) > self.room_max_pending:
+                    # Too far behind to be worth replaying message by message
+                    buffer['messages'] = None
+                    self.counters['collapsed'] += 1
+            full = buffer['messages'] is not None and len(buffer['messages']) >= self.flush_size
+        if full:
+            self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Broadcast flush failed: {e}", file=sys.stderr)
+
+    def flush(self):
+        with self.lock:
+            buffers, self.buffers = self.buffers, {}
+        now = time.monotonic()
+        for namespace, buffer in buffers.items():
+            if buffer['messages'] is None:
+                for room, tables in buffer['tables'].items():
+                    slow = self.slow_clients(namespace, room, tables)
+                    self.emit('resync', {'tables': sorted(tables)}, namespace, room, slow)
+                    self.counters['resyncs'] += 1
+            else:
+                for room, messages in self.runs(buffer['messages']):
+                    tables = {msg['data']['table'] for msg in messages
+                              if isinstance(msg['data'], dict) and msg['data'].get('table')}
+                    slow = self.slow_clients(namespace, room, tables)
+                    self.emit('batch', messages, namespace, room, slow)
+                    self.counters['batches'] += 1
+            latency = now - buffer['since']
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+        self.resync_drained()
+
+    @staticmethod
+    def runs(queued):
+        """(room, [messages]) for each run of consecutive messages to the same room(s)"""
+        runs = []
+        for room, message in queued:
+            if runs and runs[-1][0] == room:
+                runs[-1][1].append(message)
+            else:
+                runs.append((room, [message]))
+        return runs
+
+    def emit(self, event, data, namespace, room, skip):
+        to = list(room) if isinstance(room, tuple) else room
+        self.socketio.emit(event, data, namespace=namespace, to=to, skip_sid=list(skip) or None)
+
+    def queue_length(self, eio_sid):
+        """Packets waiting to go out to a client, 0 if the server cannot tell us"""
+        try:
+            return self.socketio.server.eio.sockets[eio_sid].queue.qsize()
+        except Exception:
+            return 0
+
+    def slow_clients(self, namespace, room, tables):
+        """Clients in room too backed up to be sent more, now marked stale"""
+        slow = set()
+        participants = set()
+        try:
+            for each in (room if isinstance(room, tuple) else (room,)):
+                participants.update(self.socketio.server.manager.get_participants(namespace, each))
+        except Exception:
+            return slow
+        for sid, eio_sid in participants:
+            if sid in self.stale:
+                self.stale[sid][2].update(tables)
+            elif self.queue_length(eio_sid) > self.client_max_queue:
+                self.stale[sid] = (namespace, eio_sid, set(tables))
+                self.counters['skipped_clients'] += 1
+            else:
+                continue
+            slow.add(sid)
+        return slow
+
+    def resync_drained(self):
+        """Send a skipped client a single resync once its queue has drained"""
+        for sid, (namespace, eio_sid, tables) in list(self.stale.items()):
+            if self.queue_length(eio_sid) <= self.client_max_queue // 2:
+                del self.stale[sid]
+                self.socketio.emit('resync', {'tables': sorted(tables)}, namespace=namespace, to=sid)
+                self.counters['resyncs'] += 1
+
+    def forget(self, sid):
+        """Drop state kept for a client that disconnected"""
+        self.stale.pop(sid, None)
+
+    def stats(self):
+        with self.lock:
+            depth = {}
+            for namespace, buffer in self.buffers.items():
+                for room, _ in buffer['messages'] or ():
+                    key = f'{namespace}:{"+".join(room) if isinstance(room, tuple) else room or "*"}'
+                    depth[key] = depth.get(key, 0) + 1
+        stats = dict(self.counters)
+        stats.update({
+            'queue_depth': sum(depth.values()),
+            'queue_depth_by_room': depth,
+            'stale_clients': len(self.stale),
+            'last_flush_latency_ms': round(self.last_flush_latency * 1000, 3),
+            'max_flush_latency_ms': round(self.max_flush_latency * 1000, 3),
+        })
+        return stats
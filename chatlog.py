@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: ascii -*-
+
+"""
+Chat persistence for nDART
+
+ChatLog keeps the last WINDOW chat lines in memory, so a console joining
+mid-race gets them replayed in one message without touching SQLite.
+Lines are written to chat_messages by a background task, FLUSH_SIZE at a
+time or every FLUSH_INTERVAL seconds, so a chatty channel costs one
+transaction per flush rather than one per line.  Older lines are paged
+out of chat_messages by timestamp.  When several workers share the
+chat (shared=True) the replay window is read from chat_messages.
+
+Changelog:
+    - 2026-10-18 - Initial ChatLog
+    - 2026-10-18 - Shared mode for several workers
+"""
+
+from collections import deque
+from config import Config
+from db import db_connect
+import atexit
+import datetime
+import sys
+import threading
+
+
+WINDOW = getattr(Config, 'CHAT_WINDOW', 200)
+FLUSH_INTERVAL = getattr(Config, 'CHAT_FLUSH_INTERVAL', 1.0)
+FLUSH_SIZE = getattr(Config, 'CHAT_FLUSH_SIZE', 100)
+HISTORY_PAGE = getattr(Config, 'CHAT_HISTORY_PAGE', 100)
+
+COLUMNS = ('room', 'kind', 'name', 'msg', 'sent_at')
+
+
+class ChatLog:
+    """Ring buffer of recent chat lines, written to SQLite in batches"""
+
+    def __init__(self, socketio, window=WINDOW, interval=FLUSH_INTERVAL, flush_size=FLUSH_SIZE, shared=False):
+        self.socketio = socketio
+        self.shared = shared
+        self.interval = interval
+        self.flush_size = flush_size
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.started = False
+
+        # room -> recent lines, oldest first
+        self.window = window
+        self.recent = {}
+        self.pending = []
+
+    def start(self):
+        """Load the recent window from SQLite and start the flush task, once"""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        with db_connect() as conn:
+            cursor = conn.execute(f'''SELECT {', '.join(COLUMNS)} FROM (
+                                          SELECT *, ROW_NUMBER() OVER (PARTITION BY room ORDER BY sent_at DESC) AS n
+                                          FROM chat_messages)
+                                      WHERE n <= ? ORDER BY sent_at''', (self.window,))
+            rows = [dict(zip(COLUMNS, row)) for row in cursor]
+        with self.lock:
+            for line in rows:
+                self.buffer(line['room']).append(line)
+        self.socketio.start_background_task(self.run)
+        atexit.register(self.flush)
+
+    def buffer(self, room):
+        if room not in self.recent:
+            self.recent[room] = deque(maxlen=self.window)
+        return self.recent[room]
+
+    def add(self, room, kind, name, msg):
+        """Record a chat line and return it, stamped with the time sent"""
+        self.start()
+        line = {'room': room, 'kind': kind, 'name': name, 'msg': msg,
+                'sent_at': datetime.datetime.now().isoformat(timespec='microseconds')}
+        with self.lock:
+            self.buffer(room).append(line)
+            self.pending.append(line)
+            full = len(self.pending) >= self.flush_size
+        if full:
+            self.wake.set()
+        return line
+
+    def replay(self, room):
+        """The recent window for room, oldest first"""
+        self.start()
+        if self.shared:
+            return self.latest(room)
+        with self.lock:
+            return list(self.recent.get(room, ()))
+
+    def latest(self, room):
+        """The recent window for room read back from SQLite
+
+        With several workers each one only buffers the lines sent through
+        it, so the window comes from chat_messages instead; lines another
+        worker has not flushed yet appear within FLUSH_INTERVAL.
+        """
+        self.flush()
+        with db_connect() as conn:
+            cursor = conn.execute(f'''SELECT {", ".join(COLUMNS)} FROM chat_messages WHERE room = ?
+                                      ORDER BY sent_at DESC LIMIT ?''', (room, self.window))
+            return [dict(zip(COLUMNS, row)) for row in cursor][::-1]
+
+    def history(self, room, before=None, limit=None):
+        """Up to limit (at most HISTORY_PAGE) lines sent before the given timestamp, oldest first"""
+        limit = min(max(limit or HISTORY_PAGE, 1), HISTORY_PAGE)
+        self.flush()
+        query = f'SELECT {", ".join(COLUMNS)} FROM chat_messages WHERE room = ?'
+        params = [room]
+        if before:
+            query += ' AND sent_at < ?'
+            params.append(before)
+        with db_connect() as conn:
+            cursor = conn.execute(query + ' ORDER BY sent_at DESC LIMIT ?', params + [limit])
+            return [dict(zip(COLUMNS, row)) for row in cursor][::-1]
+
+    def run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Chat flush failed: {e}", file=sys.stderr)
+
+    def flush(self):
+        """Write pending lines in one transaction"""
+        with self.lock:
+            lines, self.pending = self.pending, []
+        if not lines:
+            return
+        try:
+            with db_connect(write=True) as conn:
+                conn.executemany(f'INSERT INTO chat_messages ({", ".join(COLUMNS)}) VALUES (?, ?, ?, ?, ?)',
+                                 [[line[col] for col in COLUMNS] for line in lines])
+        except Exception:
+            # Keep them for the next flush
+            with self.lock:
+                self.pending[:0] = lines
+            raise
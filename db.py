@@ -0,0 +1,596 @@
+#!/usr/bin/env python
+# -*- coding: ascii -*-
+
+"""
+SQLite access layer for nDART
+
+Connections are pooled and run in WAL mode so readers never wait on the
+aid stations writing.  sqlite3 calls block the eventlet hub while they
+run, so SQLite's own busy handler only gets a short timeout; waiting out
+a lock held by another writer is done here with a sleep that eventlet's
+monkey-patching turns into a cooperative yield.
+
+Changelog:
+    - 2026-10-18 - Pooled WAL connections
+    - 2026-10-18 - Cached, parameterized CRUD statements
+    - 2026-10-18 - Schema registry, zip_table reads column names from the cursor
+    - 2026-10-18 - iter_table for streaming listings
+    - 2026-10-18 - page_table for DataTables server-side processing
+    - 2026-10-18 - Versioned schema migrations
+    - 2026-10-18 - iter_batches for exports
+    - 2026-10-18 - Leases for single-worker background jobs
+    - 2026-10-18 - Pool, connection and lock-wait metrics
+    - 2026-10-18 - page_table can be limited to a set of locations
+    - 2026-10-18 - Stepped online snapshots, db_connect can attach databases
+    - 2026-10-18 - Full-text search through FTS5 indexes
+    - 2026-10-18 - iter_table borrows a connection per batch; PoolTimeout
+    - 2026-10-18 - iter_batches borrows a connection per batch too
+"""
+
+from config import Config
+from contextlib import contextmanager
+from functools import lru_cache
+from metrics import Counter, Gauge, Histogram
+import os
+import queue
+import random
+import re
+import sqlite3
+import threading
+import time
+
+
+POOL_SIZE = getattr(Config, 'DATABASE_POOL_SIZE', 8)
+STATEMENT_CACHE_SIZE = getattr(Config, 'STATEMENT_CACHE_SIZE', 256)
+STREAM_BATCH_SIZE = getattr(Config, 'STREAM_BATCH_SIZE', 500)
+POOL_TIMEOUT = getattr(Config, 'DATABASE_POOL_TIMEOUT', 10.0)
+
+# Milliseconds SQLite itself spins on a lock before we back off and retry
+BUSY_TIMEOUT = getattr(Config, 'DATABASE_BUSY_TIMEOUT', 25)
+BUSY_RETRIES = getattr(Config, 'DATABASE_BUSY_RETRIES', 50)
+BUSY_BACKOFF = getattr(Config, 'DATABASE_BUSY_BACKOFF', 0.005)
+
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -8000',
+    'PRAGMA mmap_size = 268435456',
+    'PRAGMA temp_store = MEMORY',
+    f'PRAGMA busy_timeout = {BUSY_TIMEOUT}',
+)
+
+# Per database settings for the files db_connect attaches
+ATTACHED_PRAGMAS = (
+    'journal_mode = WAL',
+    'synchronous = NORMAL',
+)
+
+
+DB_POOL_WAIT = Histogram('ndart_db_pool_wait_seconds', 'Time waiting for a pooled connection when none was idle')
+DB_CONNECTION = Histogram('ndart_db_connection_seconds',
+                          'Time a connection was borrowed by db_connect, its queries included', labels=('mode',))
+DB_BUSY = Counter('ndart_db_busy_total', 'Times SQLite reported the database locked and we backed off')
+DB_BUSY_WAIT = Counter('ndart_db_busy_wait_seconds_total', 'Seconds spent backing off from a locked database')
+DB_BUSY_FAILED = Counter('ndart_db_busy_failed_total', 'Statements that gave up on a locked database')
+
+
+def is_busy(error):
+    """True if error is SQLite reporting a lock held by someone else"""
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def retry_busy(fn, *args):
+    """Call fn, backing off and retrying while the database is locked"""
+    delay = BUSY_BACKOFF
+    for attempt in range(BUSY_RETRIES):
+        try:
+            return fn(*args)
+        except sqlite3.OperationalError as e:
+            if not is_busy(e):
+                raise
+            if attempt == BUSY_RETRIES - 1:
+                DB_BUSY_FAILED.inc()
+                raise
+        wait = delay * (1 + random.random())
+        DB_BUSY.inc()
+        DB_BUSY_WAIT.inc(wait)
+        time.sleep(wait)
+        delay = min(delay * 2, 0.25)
+
+
+class PoolTimeout(RuntimeError):
+    """No pooled connection came free within the pool timeout"""
+
+
+class ConnectionPool:
+    """Fixed-size pool of tuned SQLite connections to one database file"""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.opened = 0
+        self.lock = threading.Lock()
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE_SIZE)
+        for pragma in PRAGMAS:
+            retry_busy(conn.execute, pragma)
+        return conn
+
+    def acquire(self, timeout=POOL_TIMEOUT):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            grow = self.opened < self.size
+            if grow:
+                self.opened += 1
+        if grow:
+            try:
+                return self._open()
+            except Exception:
+                with self.lock:
+                    self.opened -= 1
+                raise
+        with DB_POOL_WAIT.time():
+            try:
+                return self.idle.get(timeout=timeout)
+            except queue.Empty:
+                raise PoolTimeout(f'No database connection free after {timeout} seconds') from None
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+            with self.lock:
+                self.opened -= 1
+
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def pool_connections():
+    with pools_lock:
+        current = list(pools.values())
+    opened = sum(pool.opened for pool in current)
+    idle = sum(pool.idle.qsize() for pool in current)
+    return {('open',): opened, ('in_use',): opened - idle}
+
+
+DB_POOL = Gauge('ndart_db_pool_connections', 'Pooled SQLite connections', labels=('state',),
+                collect=pool_connections)
+
+
+def get_pool(path=None):
+    """Pool for path, defaulting to Config.DATABASE_PATH"""
+    path = path or Config.DATABASE_PATH
+    with pools_lock:
+        if path not in pools:
+            pools[path] = ConnectionPool(path)
+        return pools[path]
+
+
+@contextmanager
+def db_connect(write=False, path=None, attach=None):
+    """Borrow a pooled connection for the duration of a with block
+
+    Connections are in autocommit mode, so plain reads need nothing else.
+    With write=True the block runs in a BEGIN IMMEDIATE transaction,
+    taken with retries so the write lock is held before any statement
+    runs, and committed on exit (rolled back if the block raises).
+    attach maps schema names to database files attached for the block.
+    """
+    pool = get_pool(path)
+    conn = pool.acquire()
+    borrowed = time.perf_counter()
+    attached = []
+    try:
+        for name, attach_path in (attach or {}).items():
+            retry_busy(conn.execute, 'ATTACH DATABASE ? AS ?', (attach_path, name))
+            attached.append(name)
+            for pragma in ATTACHED_PRAGMAS:
+                retry_busy(conn.execute, f'PRAGMA {name}.{pragma}')
+        if write:
+            retry_busy(conn.execute, 'BEGIN IMMEDIATE')
+        yield conn
+        if conn.in_transaction:
+            retry_busy(conn.commit)
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        for name in attached:
+            retry_busy(conn.execute, 'DETACH DATABASE ?', (name,))
+        pool.release(conn)
+        DB_CONNECTION.observe(time.perf_counter() - borrowed, mode='write' if write else 'read')
+
+
+# *====================================================================*
+#         SCHEMA
+# *====================================================================*
+# Column names of every table, loaded once by create_database and
+# dropped whenever the schema changes, so reads never ask SQLite again.
+schema = {}
+schema_lock = threading.Lock()
+
+
+def load_schema():
+    """Read every table's columns into the registry"""
+    with db_connect() as conn:
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+        loaded = {table: tuple(column[1] for column in conn.execute(f'PRAGMA table_info("{table}")'))
+                  for table in tables}
+    with schema_lock:
+        schema.clear()
+        schema.update(loaded)
+    build_statement.cache_clear()
+
+
+def invalidate_schema():
+    """Forget cached table metadata after a migration changes it"""
+    with schema_lock:
+        schema.clear()
+    build_statement.cache_clear()
+
+
+def table_columns(table):
+    """Column names of table in declaration order, empty if it does not exist"""
+    if not schema:
+        load_schema()
+    return schema.get(table, ())
+
+
+def cursor_columns(cursor):
+    """Column names of the result set the cursor is positioned on"""
+    return [column[0] for column in cursor.description]
+
+
+# Function to export participant data as a zipped dict
+def zip_table(table_name, where_clause=None):
+    if not table_columns(table_name):
+        raise ValueError(f'Unknown table {table_name}')
+    where_clause = f' WHERE {where_clause}' if where_clause else ''
+    with db_connect() as conn:
+        cursor = conn.execute(f'SELECT * FROM {table_name}{where_clause}')
+        columns = cursor_columns(cursor)
+        return {'data': [dict(zip(columns, row)) for row in cursor]}
+
+
+def iter_table(table_name, where_clause=None, batch_size=STREAM_BATCH_SIZE):
+    """Yield the rows zip_table would return, batch_size dicts at a time, in id order"""
+    for columns, rows in iter_batches(table_name, where_clause, batch_size=batch_size):
+        yield [dict(zip(columns, row)) for row in rows]
+
+
+def iter_batches(table_name, where_clause=None, params=(), order_by=None, batch_size=STREAM_BATCH_SIZE):
+    """Yield (columns, rows) for table_name, batch_size row tuples at a time
+
+    where_clause may use ? placeholders bound from params; order_by must
+    name a column of the table.  Rows come in (order_by, id) order, NULLs
+    first as SQLite sorts them, or in id order.  Each batch is read on a
+    connection borrowed just for it, picking up after the last row sent,
+    so a slow client holds neither a pooled connection nor a WAL snapshot
+    while it drains a batch.
+    """
+    columns = table_columns(table_name)
+    if not columns:
+        raise ValueError(f'Unknown table {table_name}')
+    if order_by is not None and order_by not in columns:
+        raise ValueError(f'Unknown column {order_by} for table {table_name}')
+    # (filter, keys) per pass; a row value compare would skip the NULLs, so they get a pass of their own
+    if order_by:
+        passes = ((f'{order_by} IS NULL', ('id',)), (f'{order_by} IS NOT NULL', (order_by, 'id')))
+    else:
+        passes = ((None, ('id',)),)
+    for condition, keys in passes:
+        after = None
+        while True:
+            where = [f'({clause})' for clause in (where_clause, condition) if clause]
+            if after is not None:
+                where.append(f"({', '.join(keys)}) > ({', '.join('?' * len(keys))})")
+            query = f'SELECT * FROM {table_name}'
+            if where:
+                query += ' WHERE ' + ' AND '.join(where)
+            query += f" ORDER BY {', '.join(keys)} LIMIT ?"
+            with db_connect() as conn:
+                cursor = conn.execute(query, (*params, *(after or ()), batch_size))
+                columns = cursor_columns(cursor)
+                rows = cursor.fetchall()
+            if not rows:
+                break
+            yield columns, rows
+            if len(rows) < batch_size:
+                break
+            after = tuple(rows[-1][columns.index(key)] for key in keys)
+
+
+def page_table(table_name, start=0, length=10, order=(), search='', search_columns=(),
+               records_total=None, within=None, full_text=None):
+    """One page of table_name for DataTables server-side processing
+
+    order is a sequence of (column, descending) pairs.  A non-empty search
+    is matched as a case-insensitive prefix of any of search_columns; give
+    each of those a COLLATE NOCASE index so the match is an index range.
+    within, a (columns, values) pair, limits the page and both counts to
+    rows where any of columns holds one of values, ignoring case.
+    records_total may be passed in when the caller already knows it.
+    full_text, an (FTS5 table, fts_query) pair, also lets the search
+    match rows through that full-text index.
+    Returns (records_total, records_filtered, rows).
+    """
+    columns = table_columns(table_name)
+    if not columns:
+        raise ValueError(f'Unknown table {table_name}')
+    unknown = [col for col, _ in order if col not in columns]
+    unknown += [col for col in search_columns if col not in columns]
+    unknown += [col for col in (within[0] if within else ()) if col not in columns]
+    if unknown:
+        raise ValueError(f'Unknown field(s) for {table_name}: {", ".join(unknown)}')
+
+    scope_clause = ''
+    scope_params = []
+    if within:
+        scope_columns, values = within
+        marks = ', '.join('?' * len(values))
+        scope_clause = ' WHERE (' + ' OR '.join(f'{col} COLLATE NOCASE IN ({marks})' for col in scope_columns) + ')'
+        scope_params = list(values) * len(scope_columns)
+
+    where_clause = scope_clause
+    params = list(scope_params)
+    if search and search_columns:
+        pattern = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        matches = ' OR '.join(f"{col} LIKE ? ESCAPE '\\'" for col in search_columns)
+        params += [pattern] * len(search_columns)
+        if full_text and full_text[1]:
+            matches += f' OR id IN (SELECT rowid FROM {full_text[0]} WHERE {full_text[0]} MATCH ?)'
+            params.append(full_text[1])
+        where_clause = f'{scope_clause} AND ({matches})' if scope_clause else f' WHERE {matches}'
+
+    order_by = [f'{col} {"DESC" if descending else "ASC"}' for col, descending in order]
+    order_by.append(f'id {"DESC" if order and order[0][1] else "ASC"}')
+
+    with db_connect() as conn:
+        if records_total is None:
+            records_total = conn.execute(f'SELECT COUNT(*) FROM {table_name}{scope_clause}',
+                                         scope_params).fetchone()[0]
+        if where_clause != scope_clause:
+            records_filtered = conn.execute(f'SELECT COUNT(*) FROM {table_name}{where_clause}',
+                                            params).fetchone()[0]
+        else:
+            records_filtered = records_total
+        cursor = conn.execute(f'SELECT * FROM {table_name}{where_clause} '
+                              f'ORDER BY {", ".join(order_by)} LIMIT ? OFFSET ?',
+                              params + [length, start])
+        columns = cursor_columns(cursor)
+        rows = [dict(zip(columns, row)) for row in cursor]
+    return records_total, records_filtered, rows
+
+
+# *====================================================================*
+#         FULL-TEXT SEARCH
+# *====================================================================*
+# An FTS5 index keeps an inverted index of its columns' words, so a
+# search reads the rows holding those words however many notes there are.
+SEARCH_TERM_PATTERN = re.compile(r'"([^"]*)"|(\w+)')
+
+
+def fts_query(text):
+    """FTS5 MATCH expression for what someone typed, None if it has no words
+
+    Every word, or "quoted phrase", must appear; the last word of each
+    may be the start of a longer one, so 'ches pai' finds 'chest pain'.
+    User text never reaches FTS5's query syntax unquoted.
+    """
+    terms = []
+    for phrase, word in SEARCH_TERM_PATTERN.findall(text or ''):
+        words = re.findall(r'\w+', phrase or word)
+        if words:
+            terms.append('"' + ' '.join(words) + '"*')
+    return ' '.join(terms) or None
+
+
+def search_table(table_name, fts_table, query, start=0, length=10, within=None):
+    """Rows of table_name matching an fts_query, best match first
+
+    fts_table must be an FTS5 index whose rowids are table_name's ids.
+    within limits the matches as it does for page_table.
+    Returns (records_filtered, rows).
+    """
+    columns = table_columns(table_name)
+    if not columns or not table_columns(fts_table):
+        raise ValueError(f'Unknown table {table_name if not columns else fts_table}')
+    unknown = [col for col in (within[0] if within else ()) if col not in columns]
+    if unknown:
+        raise ValueError(f'Unknown field(s) for {table_name}: {", ".join(unknown)}')
+
+    where_clause = f'{fts_table} MATCH ?'
+    params = [query]
+    if within:
+        scope_columns, values = within
+        marks = ', '.join('?' * len(values))
+        where_clause += ' AND (' + ' OR '.join(f'{table_name}.{col} COLLATE NOCASE IN ({marks})'
+                                               for col in scope_columns) + ')'
+        params += list(values) * len(scope_columns)
+    source = f'{fts_table} JOIN {table_name} ON {table_name}.id = {fts_table}.rowid'
+
+    with db_connect() as conn:
+        records_filtered = conn.execute(f'SELECT COUNT(*) FROM {source} WHERE {where_clause}', params).fetchone()[0]
+        cursor = conn.execute(f'SELECT {table_name}.* FROM {source} WHERE {where_clause} '
+                              f'ORDER BY {fts_table}.rank, {table_name}.id DESC LIMIT ? OFFSET ?',
+                              params + [length, start])
+        columns = cursor_columns(cursor)
+        rows = [dict(zip(columns, row)) for row in cursor]
+    return records_filtered, rows
+
+
+# *====================================================================*
+#         STATEMENTS
+# *====================================================================*
+# Writes are built once per (table, action, column set) as parameterized
+# SQL, so the text is stable and each pooled connection's sqlite3
+# statement cache skips re-parsing and re-planning it.
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def build_statement(table, action, columns=()):
+    """Parameterized SQL for action ('create', 'edit', 'remove' or 'select')
+
+    columns must be a tuple of column names; every one is checked against
+    the table's schema, and a ValueError names any that are not there.
+    Parameters are bound in columns order, followed by the row id.
+    """
+    allowed = table_columns(table)
+    if not allowed:
+        raise ValueError(f'Unknown table {table}')
+    unknown = [col for col in columns if col not in allowed or col == 'id']
+    if unknown:
+        raise ValueError(f'Unknown field(s) for {table}: {", ".join(unknown)}')
+
+    if action == 'create':
+        if not columns:
+            return f'INSERT INTO {table} DEFAULT VALUES'
+        placeholders = ', '.join('?' for _ in columns)
+        return f'INSERT INTO {table} ({", ".join(columns)}) VALUES ({placeholders})'
+    if action == 'edit':
+        if not columns:
+            raise ValueError(f'Nothing to update in {table}')
+        return f'UPDATE {table} SET {", ".join(f"{col} = ?" for col in columns)} WHERE id = ?'
+    if action == 'remove':
+        return f'DELETE FROM {table} WHERE id = ?'
+    if action == 'select':
+        return f'SELECT * FROM {table} WHERE id = ?'
+    raise ValueError(f'Unknown action {action}')
+
+
+# *====================================================================*
+#         MIGRATIONS
+# *====================================================================*
+# Schema changes after the base tables are numbered and run once each, in
+# order, at startup.  Register new ones with @migration at the end of
+# the list; never change one that has shipped.
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register fn(cursor) as schema migration number version"""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def schema_version(conn):
+    """Highest migration applied to the database behind conn"""
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+                        version INTEGER PRIMARY KEY,
+                        description TEXT,
+                        applied_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    )''')
+    return conn.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version').fetchone()[0]
+
+
+def run_migrations():
+    """Apply every registered migration the database has not seen yet
+
+    Each one runs in its own write transaction together with its
+    schema_version row, so a failure leaves the database at the last good
+    version and another process starting at the same time cannot apply
+    the same migration twice.
+    """
+    applied = []
+    for version, description, fn in MIGRATIONS:
+        with db_connect(write=True) as conn:
+            if schema_version(conn) >= version:
+                continue
+            fn(conn.cursor())
+            conn.execute('INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                         (version, description))
+        applied.append(version)
+    if applied:
+        invalidate_schema()
+    return applied
+
+
+def explain(query, params=()):
+    """EXPLAIN QUERY PLAN detail lines for query"""
+    with db_connect() as conn:
+        return [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}', params)]
+
+
+# *====================================================================*
+#         LEASES
+# *====================================================================*
+# A background job that must run in only one worker process (e.g. the
+# escalation timers) holds a named lease, renewing it well within ttl.
+# If its worker dies the lease expires and another worker takes over.
+# The leases table is created by a migration.
+def acquire_lease(name, holder, ttl):
+    """Take or renew lease name for holder; True while holder owns it"""
+    now = time.time()
+    # Workers that cannot take it only read
+    with db_connect() as conn:
+        held = conn.execute('SELECT holder, expires_at FROM leases WHERE name = ?', (name,)).fetchone()
+    if held is not None and held[0] != holder and held[1] >= now:
+        return False
+    with db_connect(write=True) as conn:
+        conn.execute('INSERT OR IGNORE INTO leases (name, holder, expires_at) VALUES (?, ?, 0)', (name, holder))
+        cursor = conn.execute('''UPDATE leases SET holder = ?, expires_at = ?
+                                WHERE name = ? AND (holder = ? OR expires_at < ?)''',
+                             (holder, now + ttl, name, holder, now))
+        return cursor.rowcount == 1
+
+
+# *====================================================================*
+#         SNAPSHOTS
+# *====================================================================*
+SNAPSHOT_PAGES = getattr(Config, 'SNAPSHOT_PAGES', 256)
+
+
+def snapshot(target, pages=SNAPSHOT_PAGES, progress=None, path=None):
+    """Copy the database to the file target with SQLite's online backup API
+
+    The copy is made pages at a time; progress(remaining, total) is called
+    after every step, so it can yield to other green threads.  A read
+    transaction is held on the source throughout, so the copy is the
+    database as of the start, writers carry on in WAL, and their commits
+    never restart the backup.  The file only appears at target once it
+    is complete.  Returns the number of pages copied.
+    """
+    partial = f'{target}.partial'
+    source = sqlite3.connect(path or Config.DATABASE_PATH, isolation_level=None, check_same_thread=False)
+    dest = sqlite3.connect(partial, isolation_level=None, check_same_thread=False)
+    copied = [0]
+
+    def step(status, remaining, total):
+        copied[0] = total
+        if progress is not None:
+            progress(remaining, total)
+
+    try:
+        retry_busy(source.execute, f'PRAGMA busy_timeout = {BUSY_TIMEOUT}')
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(dest, pages=pages, progress=step)
+        source.rollback()
+    except BaseException:
+        dest.close()
+        os.remove(partial)
+        raise
+    finally:
+        dest.close()
+        source.close()
+    os.replace(partial, target)
+    return copied[0]
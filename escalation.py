@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: ascii -*-
+
+"""
+Event escalation timers for nDART
+
+An event escalates while an agency has been notified but has not arrived,
+or has arrived but the event is not resolved.  The clock starts at
+agency_notified or agency_arrival, read from their unix time stamps
+(agency_notified_at, agency_arrival_at) so an event notified before
+midnight keeps escalating after it; past WARN_MINUTES the event is at
+'warn', past ALERT_MINUTES at 'alert'.
+
+Escalations keeps a heap keyed on each event's next deadline and a
+background task that sleeps until the earliest one, so a transition is
+pushed (event_warn / event_alert / event_clear) the moment it happens
+rather than whenever a console redraws.  A stale heap entry is skipped
+by its version number.
+
+With several workers only the one holding the 'escalations' lease runs
+the timers.  It follows event writes from every worker through
+change_log; a write on this worker pokes it to look straight away.
+
+Changelog:
+    - 2026-10-18 - Initial Escalations
+    - 2026-10-18 - Leader lease and change_log sync for several workers
+    - 2026-10-18 - Transitions sent to the rooms covering the event
+    - 2026-10-18 - Deadlines from the events' unix time stamps
+    - 2026-10-18 - Lease renewed at half its ttl
+"""
+
+from config import Config
+from db import acquire_lease
+import heapq
+import itertools
+import os
+import socket
+import sys
+import threading
+import time
+
+
+WARN_MINUTES = getattr(Config, 'ESCALATION_WARN_MINUTES', 10)
+ALERT_MINUTES = getattr(Config, 'ESCALATION_ALERT_MINUTES', 15)
+
+# Seconds between checks for event writes made by other workers
+SYNC_INTERVAL = getattr(Config, 'ESCALATION_SYNC_INTERVAL', 1.0)
+# Seconds the escalation lease is held without being renewed
+LEASE_TTL = getattr(Config, 'ESCALATION_LEASE_TTL', 5.0)
+
+LEVEL_MSGS = {
+    'warn': 'event_warn',
+    'alert': 'event_alert',
+    None: 'event_clear',
+}
+
+
+def escalation_start(row):
+    """When the event's escalation clock started, None if it is not running"""
+    if row.get('agency_notified') and not row.get('agency_arrival'):
+        return row.get('agency_notified_at')
+    if row.get('agency_arrival') and not row.get('resolved'):
+        return row.get('agency_arrival_at')
+    return None
+
+
+def escalation_level(row, now, warn=WARN_MINUTES, alert=ALERT_MINUTES):
+    """(level, next deadline) for row at now; either may be None"""
+    start = escalation_start(row)
+    if start is None:
+        return None, None
+    if now >= start + alert * 60:
+        return 'alert', None
+    if now >= start + warn * 60:
+        return 'warn', start + alert * 60
+    return None, start + warn * 60
+
+
+def current_levels(rows, now=None, warn=WARN_MINUTES, alert=ALERT_MINUTES):
+    """Escalated events among rows as {id: level}"""
+    now = time.time() if now is None else now
+    levels = {}
+    for row in rows:
+        level = escalation_level(row, now, warn, alert)[0]
+        if level:
+            levels[row['id']] = level
+    return levels
+
+
+class Escalations:
+    """Tracks each event's escalation level and pushes its transitions
+
+    load() returns (revision, open events) and changes(since) the events
+    changed after a revision in the form app.changes_since gives them.
+    audience(row), if given, names the room(s) to send an event's
+    transitions to.
+    """
+
+    def __init__(self, socketio, send, load, changes, warn=WARN_MINUTES, alert=ALERT_MINUTES, audience=None):
+        self.socketio = socketio
+        self.send = send
+        self.audience = audience
+        self.load_events = load
+        self.changes = changes
+        self.warn = warn
+        self.alert = alert
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.started = False
+        self.lease = 'escalations'
+        self.holder = f'{socket.gethostname()}:{os.getpid()}:{id(self)}'
+        self.leading = False
+        self.renew_at = 0   # when a held lease is next renewed
+        self.revision = 0
+
+        self.rows = {}      # event id -> row as last written
+        self.levels = {}    # event id -> 'warn' / 'alert' while escalated
+        self.versions = {}  # event id -> version of its live heap entry
+        self.heap = []      # (deadline, event id, version)
+        self.counter = itertools.count(1)
+
+    def start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        self.socketio.start_background_task(self.run)
+
+    def poke(self):
+        """Check for new event writes now rather than at the next sync"""
+        self.wake.set()
+
+    def load(self, rows, revision=0):
+        """Replace all state with rows, e.g. the open events, without notifying"""
+        with self.lock:
+            self.rows, self.levels, self.versions, self.heap = {}, {}, {}, []
+            self.revision = revision
+        for row in rows:
+            self.update(row, notify=False)
+
+    def sync(self):
+        """Apply the event writes made since the last sync, by any worker"""
+        changes = self.changes(self.revision)
+        if changes.get('reload'):
+            revision, rows = self.load_events()
+            self.load(rows, revision)
+            return
+        for event_id in changes['removed']:
+            self.remove(event_id)
+        for row in changes['data']:
+            self.update(row)
+        self.revision = changes['revision']
+
+    def update(self, row, notify=True):
+        """Recompute an event after it was created or edited"""
+        now = time.time()
+        with self.lock:
+            self.rows[row['id']] = row
+            changed = self.schedule(row['id'], now)
+        if changed and notify:
+            self.notify(row, changed[1])
+
+    def remove(self, event_id):
+        """Forget a removed event, clearing it on the consoles if escalated"""
+        with self.lock:
+            row = self.rows.pop(event_id, None)
+            self.versions.pop(event_id, None)
+            level = self.levels.pop(event_id, None)
+        if level:
+            self.notify(row or {'id': event_id}, None)
+
+    def schedule(self, event_id, now):
+        """Set an event's level and push its next deadline; caller holds the lock
+
+        Returns (old level, new level) when the level changed, else None.
+        """
+        level, deadline = escalation_level(self.rows[event_id], now, self.warn, self.alert)
+        version = next(self.counter)
+        self.versions[event_id] = version
+        if deadline is not None:
+            heapq.heappush(self.heap, (deadline, event_id, version))
+        elif level is None:
+            # Nothing more can happen to this event until it is written again
+            del self.rows[event_id]
+            del self.versions[event_id]
+
+        old = self.levels.get(event_id)
+        if level:
+            self.levels[event_id] = level
+        else:
+            self.levels.pop(event_id, None)
+        return (old, level) if old != level else None
+
+    def due(self, now):
+        """Reschedule every event whose deadline has passed; return the transitions"""
+        transitions = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                deadline, event_id, version = heapq.heappop(self.heap)
+                if self.versions.get(event_id) != version:
+                    continue # Superseded by a later write
+                row = self.rows[event_id]
+                changed = self.schedule(event_id, now)
+                if changed:
+                    transitions.append((row, changed[1]))
+            next_deadline = self.heap[0][0] if self.heap else None
+        return transitions, next_deadline
+
+    def lead(self):
+        """Take or keep the lease so only one worker pushes transitions
+
+        A held lease is renewed once half its ttl has passed rather than
+        on every wake, which would add a write to every event write.
+        """
+        now = time.time()
+        if self.leading and now < self.renew_at:
+            return True
+        leading = acquire_lease(self.lease, self.holder, LEASE_TTL)
+        if leading:
+            self.renew_at = now + LEASE_TTL / 2
+            if not self.leading:
+                revision, rows = self.load_events()
+                self.load(rows, revision)
+        self.leading = leading
+        return leading
+
+    def run(self):
+        while True:
+            next_deadline = None
+            try:
+                if self.lead():
+                    self.sync()
+                    transitions, next_deadline = self.due(time.time())
+                    for row, level in transitions:
+                        self.notify(row, level)
+            except Exception as e:
+                print(f"Escalation timer failed: {e}", file=sys.stderr)
+            timeout = SYNC_INTERVAL
+            if next_deadline is not None:
+                timeout = min(max(next_deadline - time.time(), 0), SYNC_INTERVAL)
+            self.wake.wait(timeout)
+            self.wake.clear()
+
+    def notify(self, row, level):
+        room = self.audience(row) if self.audience else None
+        self.send(LEVEL_MSGS[level], {'table': 'events', 'id': row['id'], 'level': level}, room=room)
+
+    def snapshot(self, rows):
+        """Escalated events among rows (the open events) as {id: level}
+
+        Computed from the rows rather than this worker's state, which is
+        only kept by the worker holding the lease.
+        """
+        return current_levels(rows, warn=self.warn, alert=self.alert)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: ascii -*-
+
+"""
+Metrics for nDART
+
+Counters, gauges and histograms are kept in process and rendered in the
+Prometheus text format by render(), which the app serves at /metrics.
+Each worker process keeps its own, so scrape every worker.  Recording a
+sample is a dict update under a lock, cheap enough for the hot paths.
+
+Profiler samples the stack of the thread running the eventlet hub from
+a real OS thread, so it sees whichever green thread holds the hub.  It
+is started and stopped while the server runs and its result is in the
+collapsed-stack format flame graph tools read.
+
+Changelog:
+    - 2026-10-18 - Initial metrics and sampling profiler
+"""
+
+from collections import Counter as Tally
+from contextlib import contextmanager
+from eventlet.patcher import original
+import bisect
+import math
+import os
+import sys
+import threading
+import time
+
+
+# Seconds; from a cached lookup to a slow export
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every metric created, in the order /metrics lists them
+registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    """A named family of samples, one per combination of label values"""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def samples(self):
+        """(name suffix, label pairs, value) for each sample"""
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield '', list(zip(self.labels, key)), value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for suffix, pairs, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(pairs)} {format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down; with collect, read when rendered
+
+    collect() returns {tuple of label values: value}.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.collect is None:
+            yield from super().samples()
+            return
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Metric {self.name} failed: {e}", file=sys.stderr)
+            return
+        for key, value in sorted(values.items()):
+            yield '', list(zip(self.labels, key)), value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                # Per bucket counts (the last is +Inf), sum, count
+                state = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with block took, in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self.values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            pairs = list(zip(self.labels, key))
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                yield '_bucket', pairs + [('le', format_value(float(bound)))], cumulative
+            yield '_sum', pairs, total
+            yield '_count', pairs, count
+
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+# *====================================================================*
+#         PROFILER
+# *====================================================================*
+class Profiler:
+    """Sampling profiler for the thread running the eventlet hub
+
+    The sampler is a real OS thread, not a green one, so it keeps
+    sampling while a green thread hogs the hub; those are the stacks
+    worth seeing.
+    """
+
+    def __init__(self):
+        self.lock = original('threading').Lock()
+        self.running = False
+        self.stacks = Tally()
+        self.samples = 0
+        self.interval = None
+        self.started_at = None
+        self.stopped_at = None
+        self.sampler = None
+
+    def start(self, interval=0.005, seconds=30):
+        """Sample every interval seconds for at most seconds; False if already running"""
+        with self.lock:
+            if self.running or (self.sampler and self.sampler.is_alive()):
+                return False
+            self.running = True
+            self.stacks = Tally()
+            self.samples = 0
+            self.interval = interval
+            self.started_at = time.time()
+            self.stopped_at = None
+        # The calling thread's OS id; green threads all share it
+        target = original('_thread').get_ident()
+        self.sampler = original('threading').Thread(target=self.run, name='ndart-profiler', daemon=True,
+                                                    args=(target, interval, time.monotonic() + seconds))
+        self.sampler.start()
+        return True
+
+    def stop(self):
+        with self.lock:
+            if self.running:
+                self.running = False
+                self.stopped_at = time.time()
+
+    def run(self, target, interval, deadline):
+        sleep = original('time').sleep
+        while self.running and time.monotonic() < deadline:
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                with self.lock:
+                    self.stacks[';'.join(reversed(stack))] += 1
+                    self.samples += 1
+            sleep(interval)
+        with self.lock:
+            self.running = False
+            self.stopped_at = self.stopped_at or time.time()
+
+    def status(self):
+        with self.lock:
+            return {'running': self.running, 'samples': self.samples, 'interval': self.interval,
+                    'started_at': self.started_at, 'stopped_at': self.stopped_at}
+
+    def collapsed(self):
+        """One 'frame;frame;... count' line per distinct stack, most sampled first"""
+        with self.lock:
+            stacks = self.stacks.most_common()
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
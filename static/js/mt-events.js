@@ -6,16 +6,15 @@ function getCurrentTime() {
     return `${hours}:${minutes}`;
 }
 
-function timeStringToDate(timeString) {
-    const [hours, minutes] = timeString.split(':').map(Number);
-    const date = new Date();
+let eventsTable;
 
-    date.setHours(hours, minutes, 0, 0); // Set hours, minutes, seconds, and milliseconds to 0
+// Escalated events as {id: 'warn' | 'alert'}, kept current by the server
+let escalations = {};
 
-    return date;
+function showEscalation(row, level) {
+    $(row).toggleClass('row-warn', level === 'warn');
+    $(row).toggleClass('row-alert', level === 'alert');
 }
-
-let eventsTable;
 const eventsEditor = new DataTable.Editor({
     ajax: './api/events/',
     table: '#events-table',
@@ -41,87 +40,13 @@ const eventsEditor = new DataTable.Editor({
             label: 'Reported By',
             name: 'reporter',
             type: 'select',
-            options: [
-                { label: 'MMO', value: 'MMO' },
-                { label: 'MM1', value: 'MM1' },
-                { label: 'MM2', value: 'MM2' },
-                { label: 'WP1', value: 'WP1' },
-                { label: 'MM2.7', value: 'MM2.7' },
-                { label: 'MM3.6', value: 'MM3.6' },
-                { label: 'MM4', value: 'MM4' },
-                { label: 'MM4.5', value: 'MM4.5' },
-                { label: 'MM50.1', value: 'MM50.1' },
-                { label: 'MM50.2', value: 'MM50.2' },
-                { label: 'AS50', value: 'AS50' },
-                { label: 'MM50.3', value: 'MM50.3' },
-                { label: 'AS1', value: 'AS1' },
-                { label: 'WP2', value: 'WP2' },
-                { label: 'MM5', value: 'MM5' },
-                { label: 'MM5.5', value: 'MM5.5' },
-                { label: 'MM6', value: 'MM6' },
-                { label: 'WP3', value: 'WP3' },
-                { label: 'AS2/3', value: 'AS2/3' },
-                { label: 'MM7', value: 'MM7' },
-                { label: 'MM7.5', value: 'MM7.5' },
-                { label: 'MM8', value: 'MM8' },
-                { label: 'MM9', value: 'MM9' },
-                { label: 'MM10', value: 'MM10' },
-                { label: 'WP5/7', value: 'WP5/7' },
-                { label: 'AS4/6', value: 'AS4/6' },
-                { label: 'MM11', value: 'MM11' },
-                { label: 'MM11.5', value: 'MM11.5' },
-                { label: 'MM12', value: 'MM12' },
-                { label: 'MM12.5', value: 'MM12.5' },
-                { label: 'MM13', value: 'MM13' },
-                { label: 'MM13.5', value: 'MM13.5' },
-                { label: 'WP6', value: 'WP6' },
-                { label: 'MM14', value: 'MM14' },
-                { label: 'MM14.5', value: 'MM14.5' },
-                { label: 'MM15', value: 'MM15' },
-                { label: 'MM15.5', value: 'MM15.5' },
-                { label: 'MM16', value: 'MM16' },
-                { label: 'MM16.5', value: 'MM16.5' },
-                { label: 'MM17', value: 'MM17' },
-                { label: 'AS7', value: 'AS7' },
-                { label: 'MM17.5', value: 'MM17.5' },
-                { label: 'MM18', value: 'MM18' },
-                { label: 'MM18.5', value: 'MM18.5' },
-                { label: 'FS1', value: 'FS1' },
-                { label: 'MM19', value: 'MM19' },
-                { label: 'AS8', value: 'AS8' },
-                { label: 'MM19.5', value: 'MM19.5' },
-                { label: 'MM20', value: 'MM20' },
-                { label: 'MM20.5', value: 'MM20.5' },
-                { label: 'MM21', value: 'MM21' },
-                { label: 'MM21.5', value: 'MM21.5' },
-                { label: 'AS9', value: 'AS9' },
-                { label: 'WP10', value: 'WP10' },
-                { label: 'MM22', value: 'MM22' },
-                { label: 'MM22.5', value: 'MM22.5' },
-                { label: 'MM22.7', value: 'MM22.7' },
-                { label: 'MM23', value: 'MM23' },
-                { label: 'MM23.5', value: 'MM23.5' },
-                { label: 'FS2', value: 'FS2' },
-                { label: 'WP11', value: 'WP11' },
-                { label: 'AS10', value: 'AS10' },
-                { label: 'MM24', value: 'MM24' },
-                { label: 'MM24.5', value: 'MM24.5' },
-                { label: 'WP12', value: 'WP12' },
-                { label: 'MM25', value: 'MM25' },
-                { label: 'MM25.5', value: 'MM25.5' },
-                { label: 'MM26', value: 'MM26' },
-            ]
+            options: []
         },
         {
             label: 'Agency',
             name: 'agency',
             type: 'select',
-            options: [
-                { label: 'DC FEMS', value: 'DC FEMS' },
-                { label: 'Arl Fire', value: 'Arl Fire' },
-                { label: 'Law', value: 'Law' },
-                { label: 'Other', value: 'Other' }
-            ]
+            options: []
         },
         {
             label: 'Agency Notified',
@@ -173,7 +98,10 @@ const events_cols = [
 // Encounters DataTable shown in the page
 eventsTable = new DataTable('#events-table', {
     idSrc: 'id',
+    rowId: 'id',
     ajax: './api/events/',
+    serverSide: true,
+    processing: true,
     order: [[1, 'desc']],
     columns: events_cols,
     layout: {
@@ -201,35 +129,7 @@ eventsTable = new DataTable('#events-table', {
         selector: 'td:first-child'
     },
     rowCallback: function(row, data, index) {
-        let warnTime = 10; // in minutes
-        let alertTime = 15; // in minutes
-        let notifiedTimeDiff = 0;
-        let agencyArrivalTimeDiff = 0;
-        const currentTime = new Date();
-        if (data.agency_notified && !data.agency_arrival) {
-            const notifiedDate = timeStringToDate(data.agency_notified);
-            const notifiedTime = new Date(notifiedDate);
-            notifiedTimeDiff = (currentTime - notifiedTime) / (1000 * 60); // difference in minutes
-            
-        } else if (data.agency_arrival && !data.resolved) {
-            const agencyArrivalDate = timeStringToDate(data.agency_arrival);
-            const agencyArrivalTime = new Date(agencyArrivalDate);
-            agencyArrivalTimeDiff = (currentTime - agencyArrivalTime) / (1000 * 60); // difference in minutes 
-        }
-        console.log(`Notified: ${notifiedTimeDiff} Arrival: ${agencyArrivalTimeDiff}`);
-
-        if ((notifiedTimeDiff > warnTime && notifiedTimeDiff < alertTime) || (agencyArrivalTimeDiff > warnTime && agencyArrivalTimeDiff < alertTime)) {
-            console.log('here');
-            $(row).removeClass('row-alert');
-            $(row).addClass('row-warn');
-        } else if (notifiedTimeDiff > alertTime || agencyArrivalTimeDiff > alertTime)  {
-            console.log('here2');
-            $(row).removeClass('row-warn');
-            $(row).addClass('row-alert');
-        } else {
-            $(row).removeClass('row-alert');
-            $(row).removeClass('row-warn');
-        }   
+        showEscalation(row, escalations[data.id]);
     }
 });
 
@@ -243,4 +143,46 @@ eventsTable.on('click', 'tbody td:not(:first-child)', function (e) {
             }
         }
     });
-});
\ No newline at end of file
+});
+
+// Apply changes pushed by the server instead of refetching the table
+tableSync.register('events', eventsTable);
+
+// Select options come from the server's cached lookup tables
+lookups.bind(eventsEditor, { reporter: 'locations', agency: 'agencies' });
+
+// Writes carry a request id so retries and offline replays are not applied twice
+writes.bind(eventsEditor, 'events');
+
+// The server times agency response and pushes each warn/alert transition
+function setEscalation(change) {
+    if (change.level) {
+        escalations[change.id] = change.level;
+    } else {
+        delete escalations[change.id];
+    }
+    const row = eventsTable.row('#' + change.id);
+    if (row.any()) {
+        showEscalation(row.node(), change.level);
+    }
+}
+
+function loadEscalations() {
+    $.getJSON('./api/events/escalations', function (levels) {
+        escalations = levels;
+        eventsTable.rows().every(function () {
+            showEscalation(this.node(), escalations[this.id()]);
+        });
+    });
+}
+
+['event_warn', 'event_alert', 'event_clear'].forEach(function (msg) {
+    tableSync.on(msg, setEscalation);
+});
+tableSync.on('reset_events', loadEscalations);
+tableSync.on('connect', loadEscalations);
+tableSync.on('resync', function (msg) {
+    if (msg.tables.indexOf('events') !== -1) {
+        loadEscalations();
+    }
+});
@@ -0,0 +1,55 @@
+// Fills Editor select fields from the server's lookup tables.  The
+// browser revalidates each lookup with its ETag, so an unchanged list
+// costs a 304 rather than a download; net control's edits are pushed as
+// 'lookups_changed' and the affected fields are refreshed.  Messages
+// come through tableSync's socket; load this after mt-sync.js.
+const lookups = (function () {
+    const bindings = [];
+
+    function refresh(binding) {
+        $.ajax({ url: './api/lookups/' + binding.table, dataType: 'json' })
+            .done(function (reply) {
+                binding.fields.forEach(function (field) {
+                    const current = field.editor.field(field.name).val();
+                    field.editor.field(field.name).update(reply.options);
+                    field.editor.field(field.name).val(current);
+                });
+            });
+    }
+
+    function changed(table) {
+        bindings.forEach(function (binding) {
+            if (binding.table === table) {
+                refresh(binding);
+            }
+        });
+    }
+
+    tableSync.on('lookups_changed', function (data) {
+        changed(data.table);
+    });
+
+    tableSync.on('resync', function (msg) {
+        msg.tables.forEach(changed);
+    });
+
+    return {
+        // fields maps Editor field names to lookup tables,
+        // e.g. { location: 'locations', agency: 'agencies' }
+        bind: function (editor, fields) {
+            const touched = [];
+            Object.keys(fields).forEach(function (name) {
+                let binding = bindings.find(function (b) { return b.table === fields[name]; });
+                if (!binding) {
+                    binding = { table: fields[name], fields: [] };
+                    bindings.push(binding);
+                }
+                binding.fields.push({ editor: editor, name: name });
+                if (touched.indexOf(binding) === -1) {
+                    touched.push(binding);
+                }
+            });
+            touched.forEach(refresh);
+        }
+    };
+})();
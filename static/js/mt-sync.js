@@ -0,0 +1,172 @@
+// Keeps DataTables current by applying the row changes the server
+// broadcasts on the /api namespace instead of reloading whole tables.
+// Tables in server-side mode only hold one page, so for them a change
+// just schedules a redraw of that page.  Changes arrive in 'batch'
+// messages; a 'resync' means some were dropped and we must catch up.
+const tableSync = (function () {
+    const socket = io('/api');
+    const tables = [];
+    // Other Socket.IO messages scripts asked to be handed, by type
+    const handlers = {};
+
+    // Socket.IO messages carrying changes for each table
+    const changeMsgs = {
+        events: ['new_event', 'edit_events', 'remove_events', 'reset_events'],
+        observations: ['new_observation', 'edit_observations', 'remove_observations', 'reset_observations',
+                       'bulk_observations']
+    };
+
+    // Milliseconds to gather changes before redrawing a server-side page
+    const redrawDelay = 250;
+
+    function reload(entry) {
+        entry.table.ajax.reload(null, false);
+    }
+
+    function redrawPage(entry) {
+        if (entry.redraw) {
+            return;
+        }
+        entry.redraw = setTimeout(function () {
+            entry.redraw = null;
+            entry.table.draw(false);
+        }, redrawDelay);
+    }
+
+    function upsertRow(table, data) {
+        const row = table.row('#' + data.id);
+        if (row.any()) {
+            row.data(data);
+        } else {
+            table.row.add(data);
+        }
+    }
+
+    function removeRow(table, id) {
+        const row = table.row('#' + id);
+        if (row.any()) {
+            row.remove();
+        }
+    }
+
+    // Ask the server only for the rows changed since our revision
+    function catchUp(entry) {
+        if (entry.syncing) {
+            return;
+        }
+        entry.syncing = true;
+        $.getJSON(entry.table.ajax.url(), { since: entry.revision })
+            .done(function (reply) {
+                entry.syncing = false;
+                if (reply.reload) {
+                    reload(entry);
+                    return;
+                }
+                reply.removed.forEach(function (id) {
+                    removeRow(entry.table, id);
+                });
+                reply.data.forEach(function (data) {
+                    upsertRow(entry.table, data);
+                });
+                entry.revision = reply.revision;
+                entry.table.draw(false);
+            })
+            .fail(function () {
+                entry.syncing = false;
+                reload(entry);
+            });
+    }
+
+    function receive(entry, change) {
+        if (!entry.loaded || entry.syncing) {
+            return;
+        }
+        if (entry.table.page.info().serverSide) {
+            if (change.revision > entry.revision || change.action === 'reset') {
+                redrawPage(entry);
+            }
+            return;
+        }
+        if (change.action === 'reset') {
+            reload(entry);
+        } else if (change.action === 'bulk' || change.revision > entry.revision + 1) {
+            // Revisions in between were not sent to us or were lost
+            catchUp(entry);
+        } else if (change.revision === entry.revision + 1) {
+            if (change.action === 'remove') {
+                removeRow(entry.table, change.id);
+            } else {
+                upsertRow(entry.table, change.data);
+            }
+            entry.revision = change.revision;
+            entry.table.draw(false);
+        }
+    }
+
+    function resync(entry) {
+        if (!entry.loaded) {
+            return;
+        }
+        if (entry.table.page.info().serverSide) {
+            redrawPage(entry);
+        } else {
+            catchUp(entry);
+        }
+    }
+
+    function dispatch(type, data) {
+        (handlers[type] || []).forEach(function (handler) {
+            handler(data);
+        });
+    }
+
+    socket.on('connect', function () {
+        tables.forEach(resync);
+        dispatch('connect');
+    });
+
+    // Changes arrive in the order they were made, whichever rooms they
+    // went to, so apply them one after another.  A station only hears of
+    // its own locations, so revisions can still be skipped; receive()
+    // treats any gap as missed changes and catches up.
+    socket.on('batch', function (messages) {
+        messages.forEach(function (msg) {
+            tables.forEach(function (entry) {
+                if (changeMsgs[entry.name].indexOf(msg.type) !== -1) {
+                    receive(entry, msg.data);
+                }
+            });
+            dispatch(msg.type, msg.data);
+        });
+    });
+
+    socket.on('resync', function (msg) {
+        tables.forEach(function (entry) {
+            if (msg.tables.indexOf(entry.name) !== -1) {
+                resync(entry);
+            }
+        });
+        dispatch('resync', msg);
+    });
+
+    return {
+        // Call handler with the data of each message of this type, and
+        // on 'connect' and 'resync' so it can refetch what it may have missed
+        on: function (type, handler) {
+            (handlers[type] = handlers[type] || []).push(handler);
+        },
+
+        register: function (name, table) {
+            const entry = { name: name, table: table, revision: 0, loaded: false, syncing: false, redraw: null };
+            tables.push(entry);
+
+            // Every listing tells us which revision it reflects
+            table.on('xhr', function (e, settings, json) {
+                if (json && json.revision !== undefined) {
+                    entry.revision = json.revision;
+                    entry.loaded = true;
+                }
+            });
+        }
+    };
+})();
@@ -0,0 +1,99 @@
+// Makes Editor writes safe to retry.  Each time a form opens it gets a
+// request id, sent with every submit of that form, so the server answers
+// a resubmit with the first result instead of writing a duplicate.  A
+// submit that cannot reach the server is kept in localStorage and sent
+// with the rest of the queue to /api/replay once we are back online.
+const writes = (function () {
+    const storageKey = 'ndart-pending-writes';
+    let flushing = false;
+
+    function newRequestId() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+    }
+
+    function pending() {
+        try {
+            return JSON.parse(localStorage.getItem(storageKey)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+
+    function save(queue) {
+        localStorage.setItem(storageKey, JSON.stringify(queue));
+    }
+
+    // A resubmit of a queued form replaces its earlier copy
+    function enqueue(write) {
+        const queue = pending().filter(function (queued) {
+            return queued.request_id !== write.request_id;
+        });
+        queue.push(write);
+        save(queue);
+    }
+
+    function flush() {
+        const queue = pending();
+        if (flushing || !queue.length) {
+            return;
+        }
+        flushing = true;
+        $.ajax({
+            url: './api/replay',
+            method: 'POST',
+            contentType: 'application/json',
+            data: JSON.stringify({ writes: queue }),
+            dataType: 'json'
+        }).done(function (reply) {
+            if (!reply.results) {
+                return;
+            }
+            // Writes queued while this batch was in flight stay queued
+            const sent = queue.map(function (write) { return write.request_id; });
+            save(pending().filter(function (write) {
+                return sent.indexOf(write.request_id) === -1;
+            }));
+            reply.results.forEach(function (result) {
+                if (result.error) {
+                    console.error('Queued write ' + result.request_id + ' failed: ' + result.error);
+                }
+            });
+        }).always(function () {
+            flushing = false;
+        });
+    }
+
+    tableSync.on('connect', flush);
+    window.addEventListener('online', flush);
+
+    return {
+        pending: pending,
+        flush: flush,
+
+        // table is the name /api/replay knows the editor's table by
+        bind: function (editor, table) {
+            let requestId = null;
+
+            editor.on('open', function () {
+                requestId = newRequestId();
+            });
+
+            editor.on('preSubmit', function (e, data) {
+                data.request_id = requestId || newRequestId();
+            });
+
+            editor.on('submitError', function (e, xhr, err, thrown, data) {
+                if (xhr.status !== 0) {
+                    return;
+                }
+                enqueue({ request_id: data.request_id, table: table, action: data.action, data: data.data });
+                setTimeout(function () {
+                    editor.close();
+                }, 0);
+            });
+        }
+    };
+})();